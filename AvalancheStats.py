@@ -0,0 +1,300 @@
+r"""
+Avalanche Stats
+
+Streaming statistics of avalanches, in constant memory.
+
+Studies of self-organized criticality drop grains one at a time and look at
+the distributions of avalanche size (the total number of firings), area
+(the number of distinct vertices that fired) and duration (the number of
+rounds of toppling). Over millions of drops, keeping every avalanche is
+wasteful; an AvalancheStats keeps instead, for each of the three:
+
+- a histogram in logarithmic bins, a fixed number per doubling,
+
+- the count, mean and variance, updated with Welford's method,
+
+- the maximum likelihood estimate of a power-law exponent ``alpha`` for
+  values of at least ``xmin``, ``P(x) ~ x**-alpha``, which only needs the
+  number of such values and the sum of their logarithms.
+
+Avalanches are recorded by passing ``stats=`` to
+``SandpileEngine.stabilize()`` or ``stabilize_many()``, or by drive().
+Records are buffered and added in batches with NumPy. Every
+``flush_every`` avalanches a summary is appended as a line of JSON to
+``path``, so a long run can be watched or cut short without losing it.
+
+EXAMPLES:
+
+    >>> engine = SandpileEngine.from_remote(srem)
+    >>> stats = AvalancheStats(path="soc.jsonl", flush_every=100000)
+    >>> config = stats.drive(engine, engine.max_stable(), 10**6, seed=1)
+    >>> stats.exponents()["size"]
+        (1.27, 0.0009)
+    >>> stats.close()
+"""
+
+import json
+import math
+import time
+
+import numpy as np
+
+# The quantities recorded for each avalanche.
+QUANTITIES = ("size", "area", "duration")
+
+
+class _Moments:
+    # Count, mean, variance, maximum and power-law tail sums of one
+    # quantity, added to in batches.
+
+    def __init__(self, xmin, bins_per_octave):
+        self.xmin = xmin
+        self.bins_per_octave = bins_per_octave
+        self.count = 0
+        self.zeros = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.maximum = 0
+        self.tail = 0
+        self.log_sum = 0.0
+        self.histogram = np.zeros(0, dtype=np.int64)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        if not len(values):
+            return
+        # Welford's update for a whole batch at once (Chan et al.).
+        count = len(values)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += float(delta) * count / total
+        self.m2 += float(m2) + float(delta) ** 2 * self.count * count / total
+        self.count = total
+        self.maximum = max(self.maximum, int(values.max()))
+        # The discrete power-law estimate of Clauset, Shalizi and Newman.
+        tail = values[values >= self.xmin]
+        self.tail += len(tail)
+        self.log_sum += np.log(tail / (self.xmin - 0.5)).sum()
+        positive = values[values > 0]
+        self.zeros += count - len(positive)
+        bins = np.floor(np.log2(positive) * self.bins_per_octave + 1e-9).astype(np.int64)
+        counts = np.bincount(bins, minlength=len(self.histogram))
+        counts[:len(self.histogram)] += self.histogram
+        self.histogram = counts
+
+    def exponent(self):
+        if self.tail == 0 or self.log_sum <= 0:
+            return None
+        alpha = 1 + self.tail / float(self.log_sum)
+        return alpha, (alpha - 1) / math.sqrt(self.tail)
+
+    def summary(self):
+        edges = 2 ** (np.arange(len(self.histogram) + 1) / self.bins_per_octave)
+        return dict(count=self.count, zeros=self.zeros, mean=self.mean,
+                    variance=self.m2 / self.count if self.count else 0.0,
+                    max=self.maximum, exponent=self.exponent(),
+                    bin_edges=edges.tolist(), histogram=self.histogram.tolist())
+
+
+class AvalancheStats:
+    r"""
+    Streaming statistics of avalanche size, area and duration. In addition
+    to the methods:
+
+    count - The number of avalanches recorded so far.
+
+    path - The file summaries are appended to, or None.
+    """
+
+    def __init__(self, path=None, flush_every=100000, xmin=1, bins_per_octave=4,
+                 buffer_size=4096):
+        r"""
+        Sets up empty statistics.
+
+        INPUT:
+
+        - ``path`` (optional) - string; a JSON-lines file to append a
+          summary to every ``flush_every`` avalanches and on close().
+          Default is None, for no file.
+
+        - ``flush_every`` (optional) - int; see ``path``. Default is 100000.
+
+        - ``xmin`` (optional) - int, or a dict from quantity to int; the
+          least value included in the power-law fits. Default is 1.
+
+        - ``bins_per_octave`` (optional) - int; the number of histogram
+          bins per doubling. Bin ``i`` holds values ``x`` with
+          ``2**(i/b) <= x < 2**((i+1)/b)``. Default is 4.
+
+        - ``buffer_size`` (optional) - int; how many avalanches to buffer
+          before adding them to the statistics. Default is 4096.
+
+        OUTPUT:
+
+        AvalancheStats; raises ValueError if an ``xmin`` is below 1.
+
+        EXAMPLES::
+
+            >>> stats = AvalancheStats(xmin=dict(size=10, area=5, duration=3))
+        """
+        if not isinstance(xmin, dict):
+            xmin = dict.fromkeys(QUANTITIES, xmin)
+        if min(xmin.values()) < 1:
+            raise ValueError("xmin must be at least 1")
+        self.path = path
+        self.flush_every = flush_every
+        self.buffer_size = buffer_size
+        self.count = 0
+        self.__moments = dict((name, _Moments(xmin.get(name, 1), bins_per_octave))
+                              for name in QUANTITIES)
+        self.__buffer = []
+        self.__flushed = 0
+        self.__started = time.time()
+        self.__out = None
+
+    def record(self, size, area, duration):
+        r"""
+        Records one avalanche.
+
+        INPUT:
+
+        - ``size``, ``area``, ``duration`` - ints.
+
+        OUTPUT:
+
+        None
+        """
+        self.__buffer.append((int(size), int(area), int(duration)))
+        self.count += 1
+        if len(self.__buffer) >= self.buffer_size:
+            self.__drain()
+        if self.path is not None and self.count - self.__flushed >= self.flush_every:
+            self.flush()
+
+    def record_many(self, sizes, areas, durations):
+        r"""
+        Records many avalanches at once.
+
+        INPUT:
+
+        - ``sizes``, ``areas``, ``durations`` - Arrays of ints of the same
+          length.
+
+        OUTPUT:
+
+        None
+        """
+        self.__drain()
+        self.__add(np.asarray(sizes), np.asarray(areas), np.asarray(durations))
+        self.count += len(sizes)
+        if self.path is not None and self.count - self.__flushed >= self.flush_every:
+            self.flush()
+
+    def __drain(self):
+        if self.__buffer:
+            columns = np.array(self.__buffer, dtype=np.int64).T
+            self.__buffer = []
+            self.__add(*columns)
+
+    def __add(self, sizes, areas, durations):
+        for name, values in zip(QUANTITIES, (sizes, areas, durations)):
+            self.__moments[name].add(values)
+
+    def drive(self, engine, config, drops, vertices=None, seed=None):
+        r"""
+        Drops grains one at a time, stabilizing after each and recording
+        the avalanches.
+
+        INPUT:
+
+        - ``engine`` - A SandpileEngine (or GridEngine's ``engine()``).
+
+        - ``config`` - The starting configuration, usually stable.
+
+        - ``drops`` - int; the number of grains to drop.
+
+        - ``vertices`` (optional) - The vertices to drop on, in order.
+          Default is uniformly random non-sinks.
+
+        - ``seed`` (optional) - A seed for the random vertices.
+
+        OUTPUT:
+
+        The final configuration as an array.
+
+        EXAMPLES::
+
+            >>> config = stats.drive(engine, config, 1000, vertices=[5] * 1000)
+        """
+        if vertices is None:
+            nonsinks = np.flatnonzero(engine.degrees > 0)
+            vertices = nonsinks[np.random.default_rng(seed).integers(0, len(nonsinks), drops)]
+        config = np.array(config, dtype=np.int64)
+        for v in vertices[:drops]:
+            config[v] += 1
+            if config[v] >= engine.degrees[v] > 0:
+                config, odometer = engine.stabilize(config, stats=self)
+            else:
+                self.record(0, 0, 0)
+        return config
+
+    def summary(self):
+        r"""
+        Returns the statistics so far, as a dict with ``count``, ``seconds``
+        and, for each of ``size``, ``area`` and ``duration``, a dict with
+        ``count``, ``zeros`` (avalanches with no firings), ``mean``,
+        ``variance``, ``max``, ``exponent``, ``bin_edges`` and
+        ``histogram``.
+        """
+        self.__drain()
+        summary = dict(count=self.count, seconds=time.time() - self.__started)
+        for name in QUANTITIES:
+            summary[name] = self.__moments[name].summary()
+        return summary
+
+    def exponents(self):
+        r"""
+        Returns the power-law exponents fitted so far.
+
+        OUTPUT:
+
+        A dict from ``size``, ``area`` and ``duration`` to a pair
+          ``(alpha, error)``, or to None if there are no values of at least
+          ``xmin`` yet. ``error`` is the standard error of ``alpha``.
+
+        NOTES:
+
+        ``alpha = 1 + n / sum(log(x / (xmin - 1/2)))`` over the ``n``
+          values ``x >= xmin``: the usual approximation to the discrete
+          maximum likelihood estimate, which is good for ``xmin`` of about
+          6 or more. Avalanche distributions have a cutoff at the size of
+          the graph, so the fit is biased unless the graph is large.
+        """
+        self.__drain()
+        return dict((name, self.__moments[name].exponent()) for name in QUANTITIES)
+
+    def flush(self):
+        r"""
+        Appends the current summary to ``path``.
+        """
+        summary = self.summary()
+        self.__flushed = self.count
+        if self.path is None:
+            return
+        if self.__out is None:
+            self.__out = open(self.path, "a")
+        self.__out.write(json.dumps(summary) + "\n")
+        self.__out.flush()
+
+    def close(self):
+        r"""
+        Writes a last summary if there is anything new, and closes ``path``.
+        """
+        self.__drain()
+        if self.path is not None and self.count > self.__flushed:
+            self.flush()
+        if self.__out is not None:
+            self.__out.close()
+            self.__out = None
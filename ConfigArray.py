@@ -0,0 +1,264 @@
+r"""
+Config Array
+
+Configurations stored in NumPy arrays that never overflow.
+
+The program allows any amount of sand on a vertex, including large debts
+made with ``set_sand`` and ``add_sand``, and Python ints hold them all.
+NumPy arrays are far smaller and faster but wrap around silently. A
+ConfigArray keeps its values in the smallest of int32, int64 and object
+(Python int) arrays that holds them. It tracks a bound on the largest
+absolute value, and before each change checks that the result fits,
+moving to a wider type only when it might not. Normal runs stay in int32;
+piles of 10**10 grains move to int64, and beyond that to Python ints.
+
+EXAMPLES:
+
+    >>> config = ConfigArray(srem.get_config())
+    >>> config.dtype
+        dtype('int32')
+    >>> config.add_sand(5, 10**10)
+    >>> config.dtype
+        dtype('int64')
+    >>> config += [10**20] * len(config)
+    >>> config.dtype
+        dtype('O')
+    >>> srem.set_config(config.tolist())
+"""
+
+import numpy as np
+
+# The dtypes in order of width, and the largest absolute value each holds.
+# int32 and int64 can hold one more negative value, which is not used.
+_DTYPES = ((np.dtype(np.int32), 2 ** 31 - 1),
+           (np.dtype(np.int64), 2 ** 63 - 1),
+           (np.dtype(object), None))
+
+
+def fit_dtype(magnitude):
+    r"""
+    Returns the narrowest of int32, int64 and object dtypes that holds
+    every integer of at most ``magnitude`` in absolute value.
+
+    EXAMPLES::
+
+        >>> fit_dtype(10**10)
+            dtype('int64')
+    """
+    for dtype, limit in _DTYPES:
+        if limit is None or magnitude <= limit:
+            return dtype
+
+
+def _rank(dtype):
+    return [d for d, limit in _DTYPES].index(dtype)
+
+
+def _values(amounts):
+    # An array of integers, and the largest absolute value in it.
+    if isinstance(amounts, ConfigArray):
+        return amounts.values, amounts.magnitude
+    array = np.asarray(amounts)
+    if array.dtype.kind not in "iuO":
+        if array.size or array.dtype.kind not in "fb":
+            raise TypeError("expected integers, got %s" % array.dtype)
+        array = array.astype(np.int64)
+    if not array.size:
+        return array.astype(np.int64), 0
+    magnitude = max(int(array.max()), -int(array.min()))
+    if array.dtype.kind != "i":
+        # Unsigned or Python ints, possibly too big for int64.
+        array = array.astype(fit_dtype(magnitude))
+    return array, magnitude
+
+
+class ConfigArray:
+    r"""
+    A configuration in the narrowest integer array that holds it. In
+    addition to the methods:
+
+    values - The NumPy array of int32, int64 or object dtype.
+
+    magnitude - An upper bound on the absolute values; exact after
+    compact().
+    """
+
+    def __init__(self, config):
+        r"""
+        Stores a configuration.
+
+        INPUT:
+
+        - ``config`` - A list or array of ints, one per vertex.
+
+        OUTPUT:
+
+        ConfigArray
+
+        EXAMPLES::
+
+            >>> ConfigArray([3, -2**40, 0]).dtype
+                dtype('int64')
+        """
+        values, magnitude = _values(config)
+        if values.ndim != 1:
+            raise ValueError("expected a 1-D configuration")
+        self.magnitude = magnitude
+        self.values = values.astype(fit_dtype(magnitude))
+
+    @classmethod
+    def zeros(cls, num_vertices):
+        r"""
+        Returns the empty configuration on ``num_vertices`` vertices.
+        """
+        return cls(np.zeros(num_vertices, dtype=np.int32))
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        value = self.values[index]
+        return int(value) if np.ndim(value) == 0 else value.copy()
+
+    def __array__(self, dtype=None, copy=None):
+        # Narrowing to an integer dtype raises OverflowError if a value
+        # does not fit, rather than wrapping it around.
+        dtype = self.values.dtype if dtype is None else np.dtype(dtype)
+        if (dtype.kind in "iu" and len(self.values)
+                and not np.can_cast(self.values.dtype, dtype, "safe")):
+            info = np.iinfo(dtype)
+            if int(self.values.max()) > info.max or int(self.values.min()) < info.min:
+                raise OverflowError("a value does not fit in %s" % dtype)
+        return self.values.astype(dtype)
+
+    def __eq__(self, other):
+        other = other.values if isinstance(other, ConfigArray) else np.asarray(other)
+        return self.values.shape == other.shape and bool((self.values == other).all())
+
+    def __repr__(self):
+        return "ConfigArray(%r)" % (self.tolist(),)
+
+    def __widen(self, magnitude):
+        # Makes room for values up to magnitude, where the tracked bound
+        # is part of magnitude: if they might not fit, find the exact bound
+        # first, and widen only if they still might not.
+        if _rank(fit_dtype(magnitude)) > _rank(self.values.dtype):
+            slack = self.magnitude
+            self.compact()
+            magnitude -= slack - self.magnitude
+            dtype = fit_dtype(magnitude)
+            if _rank(dtype) > _rank(self.values.dtype):
+                self.values = self.values.astype(dtype)
+        return magnitude
+
+    def add(self, amounts, index=None):
+        r"""
+        Adds sand, widening the array first if the result might not fit.
+
+        INPUT:
+
+        - ``amounts`` - An int, or a list or array of ints.
+
+        - ``index`` (optional) - Where to add: a vertex, a slice, or an
+          array of vertices (repeated vertices get each of their amounts).
+          Default is every vertex.
+
+        OUTPUT:
+
+        None
+
+        EXAMPLES::
+
+            >>> config = ConfigArray([1, 2, 3])
+            >>> config.add([2**40, 5], [0, 0])
+            >>> config
+                ConfigArray([1099511627782, 2, 3])
+        """
+        delta, magnitude = _values(amounts)
+        if index is not None and np.ndim(index):
+            # Repeated vertices can get several amounts, or the same
+            # amount several times.
+            magnitude *= len(index)
+        self.magnitude = self.__widen(self.magnitude + magnitude)
+        delta = delta.astype(self.values.dtype)
+        if index is None:
+            self.values += delta
+        else:
+            np.add.at(self.values, index, delta)
+
+    def set(self, amounts, index=None):
+        r"""
+        Sets sand, widening the array first if needed; see add().
+        """
+        delta, magnitude = _values(amounts)
+        self.magnitude = self.__widen(max(self.magnitude, magnitude))
+        self.values[slice(None) if index is None else index] = delta.astype(self.values.dtype)
+
+    def add_sand(self, vert, amount):
+        r"""
+        Adds ``amount`` grains to a vertex, like SandpileRemote.add_sand().
+        """
+        self.add(amount, vert)
+
+    def set_sand(self, vert, amount):
+        r"""
+        Sets the sand on a vertex, like SandpileRemote.set_sand().
+        """
+        self.set(amount, vert)
+
+    def add_config(self, config):
+        r"""
+        Adds a configuration, like SandpileRemote.add_config().
+        """
+        self.add(config)
+
+    def __iadd__(self, other):
+        self.add(other)
+        return self
+
+    def __isub__(self, other):
+        delta, magnitude = _values(other)
+        self.add(-delta.astype(fit_dtype(magnitude + 1)))
+        return self
+
+    def __add__(self, other):
+        result = self.copy()
+        result += other
+        return result
+
+    def __sub__(self, other):
+        result = self.copy()
+        result -= other
+        return result
+
+    def copy(self):
+        r"""
+        Returns a copy.
+        """
+        result = ConfigArray.__new__(ConfigArray)
+        result.values = self.values.copy()
+        result.magnitude = self.magnitude
+        return result
+
+    def compact(self):
+        r"""
+        Finds the exact largest absolute value and moves to the narrowest
+        array that holds it, which may be narrower than the current one
+        after sand was removed.
+        """
+        if len(self.values):
+            self.magnitude = max(int(self.values.max()), -int(self.values.min()))
+        else:
+            self.magnitude = 0
+        self.values = self.values.astype(fit_dtype(self.magnitude))
+
+    def tolist(self):
+        r"""
+        Returns the configuration as a list of Python ints, as for
+        SandpileRemote.set_config().
+        """
+        return [int(x) for x in self.values] if self.values.dtype.kind == "O" else self.values.tolist()
@@ -0,0 +1,232 @@
+r"""
+Config History
+
+Undo and redo for the program's configuration.
+
+A ConfigHistory keeps a list of snapshots of the configuration. Each
+snapshot is split into chunks of consecutive vertices, and a chunk that did
+not change since the previous snapshot is shared with it rather than
+copied, so a long history costs memory in proportion to what changed. Each
+chunk is stored in the narrowest integer array that holds it (see
+ConfigArray.fit_dtype).
+
+Moving through the history with undo(), redo() or checkout() only sends
+the vertices that differ between the program's configuration and the
+target, as ``set_sand`` messages in one pipelined batch; if that would be
+more than the whole configuration, a single ``set_config`` is sent instead.
+Committing a new snapshot after an undo discards the snapshots that could
+have been redone, as in an editor.
+
+The history assumes the program's configuration is the snapshot it last
+committed or checked out. Changes made since through the remote (such as
+``stabilize()``) must be committed before moving, or they are lost.
+
+EXAMPLES:
+
+    >>> history = ConfigHistory(srem)
+    >>> srem.add_sand(5, 100)
+    >>> srem.stabilize()
+    >>> history.commit()
+        1
+    >>> history.undo()
+        0
+    >>> history.redo()
+        1
+"""
+
+import numpy as np
+
+from ConfigArray import fit_dtype
+from SandpileRemote import CommandError
+
+# About how many characters a set_sand message and a value of set_config
+# take, to choose between them.
+_SET_SAND_COST = 20
+_VALUE_COST = 4
+
+
+def _freeze(values):
+    # A read-only chunk in the narrowest dtype that holds the values.
+    magnitude = max(int(values.max()), -int(values.min())) if len(values) else 0
+    chunk = values.astype(fit_dtype(magnitude))
+    chunk.flags.writeable = False
+    return chunk
+
+
+class ConfigHistory:
+    r"""
+    A history of configurations of the program, with undo and redo. In
+    addition to the methods:
+
+    position - The step the program's configuration is at.
+
+    chunk_size - The number of vertices per shared chunk.
+    """
+
+    def __init__(self, remote, chunk_size=1024):
+        r"""
+        Starts a history at the program's current configuration, as step 0.
+
+        INPUT:
+
+        - ``remote`` - A connected SandpileRemote or SageRemote.
+          Configurations are always indexed by vertex.
+
+        - ``chunk_size`` (optional) - int; the number of vertices per
+          chunk. Smaller chunks share more but cost more per chunk.
+          Default is 1024.
+
+        OUTPUT:
+
+        ConfigHistory
+
+        EXAMPLES::
+
+            >>> history = ConfigHistory(srem)
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.srem = remote.srem if hasattr(remote, "labels_to_indices") else remote
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.__snapshots = []
+        self.commit()
+
+    def __len__(self):
+        return len(self.__snapshots)
+
+    def __snapshot(self, config):
+        # Chunks of config, sharing those equal to the current snapshot's.
+        config = np.asarray(config)
+        if config.dtype.kind not in "iO":
+            config = config.astype(np.int64)
+        previous = self.__snapshots[self.position] if self.__snapshots else []
+        size = self.chunk_size
+        chunks = []
+        for i, start in enumerate(range(0, len(config), size)):
+            values = config[start:start + size]
+            if (i < len(previous) and len(previous[i]) == len(values)
+                    and (previous[i] == values).all()):
+                chunks.append(previous[i])
+            else:
+                chunks.append(_freeze(values))
+        return tuple(chunks)
+
+    def commit(self, config=None):
+        r"""
+        Adds a snapshot after the current step, discarding any steps that
+        could have been redone.
+
+        INPUT:
+
+        - ``config`` (optional) - The configuration to record, if already
+          known. Default is to fetch it from the program.
+
+        OUTPUT:
+
+        int; the new step.
+
+        EXAMPLES::
+
+            >>> history.commit()
+                1
+        """
+        if config is None:
+            config = self.srem.get_config()
+        snapshot = self.__snapshot(config)
+        del self.__snapshots[self.position + 1:]
+        self.__snapshots.append(snapshot)
+        self.position = len(self.__snapshots) - 1
+        return self.position
+
+    def config_at(self, step):
+        r"""
+        Returns the configuration recorded at a step, as a list.
+
+        INPUT:
+
+        - ``step`` - int; negative values count from the end.
+        """
+        snapshot = self.__snapshots[step]
+        return [int(x) for chunk in snapshot for x in chunk]
+
+    def memory(self):
+        r"""
+        Returns the number of bytes held by the chunks of all the
+        snapshots, counting each shared chunk once.
+        """
+        chunks = dict((id(chunk), chunk) for snapshot in self.__snapshots for chunk in snapshot)
+        return sum(chunk.nbytes for chunk in chunks.values())
+
+    def __differences(self, source, target):
+        # The vertices where target differs from source, and their values
+        # in target. Shared chunks are skipped without comparing.
+        vertices = []
+        amounts = []
+        start = 0
+        for a, b in zip(source, target):
+            if a is not b:
+                changed = np.flatnonzero(a != b)
+                vertices.extend((start + changed).tolist())
+                amounts.extend(int(x) for x in b[changed])
+            start += len(b)
+        return vertices, amounts
+
+    def checkout(self, step):
+        r"""
+        Sets the program's configuration to the one recorded at a step.
+
+        INPUT:
+
+        - ``step`` - int; negative values count from the end.
+
+        OUTPUT:
+
+        int; the number of vertices that were sent.
+
+        EXAMPLES::
+
+            >>> history.checkout(0)
+                37
+        """
+        if not -len(self) <= step < len(self):
+            raise IndexError("step out of range")
+        step %= len(self)
+        source = self.__snapshots[self.position]
+        target = self.__snapshots[step]
+        num_vertices = sum(len(chunk) for chunk in target)
+        if sum(len(chunk) for chunk in source) != num_vertices:
+            vertices = None
+        else:
+            vertices, amounts = self.__differences(source, target)
+        if vertices is None or len(vertices) * _SET_SAND_COST > num_vertices * _VALUE_COST:
+            self.srem.set_config(self.config_at(step))
+            sent = num_vertices
+        else:
+            if vertices:
+                replies = self.srem.pipeline(["set_sand %d %d" % pair
+                                              for pair in zip(vertices, amounts)])
+                for reply in replies:
+                    if reply != "done\n":
+                        raise CommandError(reply)
+                if self.srem.auto_repaint:
+                    self.srem.repaint()
+            sent = len(vertices)
+        self.position = step
+        return sent
+
+    def undo(self, steps=1):
+        r"""
+        Goes back ``steps`` steps (not past step 0) and returns the step
+        now current.
+        """
+        self.checkout(max(self.position - steps, 0))
+        return self.position
+
+    def redo(self, steps=1):
+        r"""
+        Goes forward ``steps`` steps (not past the last) and returns the
+        step now current.
+        """
+        self.checkout(min(self.position + steps, len(self) - 1))
+        return self.position
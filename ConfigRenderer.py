@@ -0,0 +1,447 @@
+r"""
+Config Renderer
+
+Headless rendering of configurations to images, without going through the
+program's ``repaint()``.
+
+A ConfigRenderer is built once from the vertex positions (as returned by
+``get_vertices()``) and then turns any configuration into an RGB image with
+a few NumPy operations. If the vertices sit on a square lattice, each vertex
+is mapped straight to a block of pixels; otherwise each vertex is splatted
+as a small square at its position.
+
+A FrameWriter renders and writes frames on a background thread. Frames are
+handed over through a bounded queue and dropped (and counted) when the queue
+is full, so capturing never stalls the simulation.
+
+EXAMPLES:
+
+    >>> srem = SandpileRemote()
+    >>> srem.connect()
+    >>> renderer = ConfigRenderer.from_remote(srem)
+    >>> write_png("frame.png", renderer.render(srem.get_config()))
+
+Stream every update of a stabilization to numbered PNG files:
+
+    >>> writer = FrameWriter(renderer, png_sequence("frames/%05d.png"))
+    >>> writer.record_updates(srem)
+        212
+    >>> writer.close()
+
+Or to a video through ffmpeg:
+
+    >>> h, w = renderer.shape
+    >>> ffmpeg = subprocess.Popen(["ffmpeg", "-f", "rawvideo", "-pix_fmt",
+    ...     "rgb24", "-s", "%dx%d" % (w, h), "-i", "-", "relax.mp4"],
+    ...     stdin=subprocess.PIPE)
+    >>> writer = FrameWriter(renderer, raw_video(ffmpeg.stdin))
+"""
+
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from queue import Queue, Full
+
+# Colors for 0, 1, 2, ... grains. Larger piles use the last color.
+DEFAULT_PALETTE = np.array([
+    [0, 0, 0],
+    [40, 60, 200],
+    [40, 180, 220],
+    [60, 200, 60],
+    [230, 220, 50],
+    [240, 140, 30],
+    [220, 40, 40],
+    [255, 255, 255],
+], dtype=np.uint8)
+
+DEFAULT_NEGATIVE = np.array([120, 0, 120], dtype=np.uint8)
+DEFAULT_BACKGROUND = np.array([32, 32, 32], dtype=np.uint8)
+
+
+def lattice_cells(positions, tol=1e-6, density=4):
+    r"""
+    Checks whether the positions lie on a square lattice.
+
+    INPUT:
+
+    - ``positions`` - An array-like of shape (N, 2).
+
+    - ``tol`` (optional) - float; the allowed deviation from the lattice,
+      as a fraction of the spacing.
+
+    - ``density`` (optional) - The most cells the lattice may have per
+      vertex. Default is 4, which admits grids with holes and a ring of
+      sinks but not scattered points that happen to have round
+      coordinates.
+
+    OUTPUT:
+
+    A tuple ``(rows, cols, shape)`` of int arrays giving each vertex's cell
+      and the lattice shape, or None if the positions are not on a lattice,
+      the lattice has more than ``density * N`` cells, or two vertices
+      share a cell.
+
+    EXAMPLES::
+
+        >>> lattice_cells([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+            (array([1, 1, 0]), array([0, 1, 0]), (2, 2))
+        >>> lattice_cells([[0.0, 0.0], [1e-7, 0.0], [10.0, 10.0]]) is None
+            True
+    """
+    pos = np.asarray(positions, dtype=float).reshape(-1, 2)
+    if len(pos) == 0:
+        return None
+    cells = []
+    count = 1
+    for axis in range(2):
+        coords = pos[:, axis]
+        values = np.unique(coords)
+        if len(values) == 1:
+            cells.append(np.zeros(len(pos), dtype=np.int64))
+            continue
+        spacing = np.diff(values).min()
+        # Check the size before making cell indices, which may not even
+        # fit in an int64 for a tiny spacing.
+        count *= (values[-1] - values[0]) / spacing + 1
+        if count > density * len(pos):
+            return None
+        steps = (coords - values[0]) / spacing
+        index = np.rint(steps)
+        if np.abs(steps - index).max() > tol:
+            return None
+        cells.append(index.astype(np.int64))
+    cols, rows = cells
+    # Image rows grow downwards, y grows upwards.
+    rows = rows.max() - rows
+    shape = (int(rows.max()) + 1, int(cols.max()) + 1)
+    flat = rows * shape[1] + cols
+    if len(np.unique(flat)) != len(flat):
+        return None
+    return rows, cols, shape
+
+
+class ConfigRenderer:
+    r"""
+    Turns configurations into RGB images (uint8 arrays of shape (H, W, 3)).
+    """
+
+    def __init__(self, positions, size=512, cell=None, palette=None,
+                 negative=None, background=None, radius=None):
+        r"""
+        Prepare the pixel mapping for a graph.
+
+        INPUT:
+
+        - ``positions`` - A list of lists of floats of the format
+          [[x1, y1], [x2, y2], ...], as given by ``get_vertices()``.
+
+        - ``size`` (optional) - int; the larger image dimension, in pixels,
+          for graphs that are not lattices. Default is 512.
+
+        - ``cell`` (optional) - int; the side of each vertex's block of
+          pixels for lattices. By default it is chosen so the image is
+          about ``size`` pixels across.
+
+        - ``palette`` (optional) - An array of shape (K, 3) of colors for
+          0, 1, ..., K-1 grains. Larger amounts use the last color.
+
+        - ``negative`` (optional) - The color of vertices in debt.
+
+        - ``background`` (optional) - The color of pixels with no vertex.
+
+        - ``radius`` (optional) - int; the half-width in pixels of the
+          square drawn for each vertex of a non-lattice graph.
+
+        OUTPUT:
+
+        ConfigRenderer
+
+        EXAMPLES::
+
+            >>> renderer = ConfigRenderer(srem.get_vertices(), size=800)
+        """
+        self.palette = np.asarray(DEFAULT_PALETTE if palette is None else palette,
+                                  dtype=np.uint8)
+        self.negative = np.asarray(DEFAULT_NEGATIVE if negative is None else negative,
+                                   dtype=np.uint8)
+        self.background = np.asarray(DEFAULT_BACKGROUND if background is None else background,
+                                     dtype=np.uint8)
+        pos = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.num_vertices = len(pos)
+        lattice = lattice_cells(pos)
+        self.is_lattice = lattice is not None
+        if self.is_lattice:
+            rows, cols, grid_shape = lattice
+            if cell is None:
+                cell = max(1, size // max(grid_shape))
+            self.cell = cell
+            self.grid_shape = grid_shape
+            self.__cells = rows * grid_shape[1] + cols
+            self.shape = (grid_shape[0] * cell, grid_shape[1] * cell)
+        else:
+            self.__init_splat(pos, size, radius)
+
+    def __init_splat(self, pos, size, radius):
+        lo = pos.min(axis=0) if len(pos) else np.zeros(2)
+        hi = pos.max(axis=0) if len(pos) else np.ones(2)
+        extent = np.maximum(hi - lo, 1e-12)
+        if radius is None:
+            radius = max(1, size // (4 * max(1, int(np.sqrt(len(pos))))))
+        inner = size - 1 - 2 * radius
+        scale = inner / extent.max()
+        width = int(np.ceil(extent[0] * scale)) + 1 + 2 * radius
+        height = int(np.ceil(extent[1] * scale)) + 1 + 2 * radius
+        self.shape = (height, width)
+        px = np.rint((pos[:, 0] - lo[0]) * scale).astype(np.int64) + radius
+        py = height - 1 - radius - np.rint((pos[:, 1] - lo[1]) * scale).astype(np.int64)
+        offsets = np.arange(-radius, radius + 1)
+        dy, dx = np.meshgrid(offsets, offsets, indexing="ij")
+        # (N, footprint) flat pixel indices, later vertices drawn on top.
+        self.__pixels = ((py[:, None] + dy.ravel()[None, :]) * width
+                         + px[:, None] + dx.ravel()[None, :])
+
+    @classmethod
+    def from_remote(cls, remote, **kwargs):
+        r"""
+        Builds a renderer for the program's current graph.
+
+        INPUT:
+
+        - ``remote`` - A connected SandpileRemote.
+
+        - Any keyword arguments of the constructor.
+
+        OUTPUT:
+
+        ConfigRenderer
+
+        EXAMPLES::
+
+            >>> renderer = ConfigRenderer.from_remote(srem)
+        """
+        return cls(list(remote.get_vertices()), **kwargs)
+
+    def colors(self, config):
+        r"""
+        Returns the color of each vertex as a uint8 array of shape (N, 3).
+        """
+        config = np.asarray(config)
+        if len(config) != self.num_vertices:
+            raise ValueError("config has %d entries but the graph has %d vertices"
+                             % (len(config), self.num_vertices))
+        index = np.clip(config, 0, len(self.palette) - 1).astype(np.intp)
+        colors = self.palette[index]
+        colors[config < 0] = self.negative
+        return colors
+
+    def render(self, config):
+        r"""
+        Renders a configuration.
+
+        INPUT:
+
+        ``config`` - A list or array of ints, one per vertex.
+
+        OUTPUT:
+
+        A uint8 array of shape (H, W, 3).
+
+        EXAMPLES::
+
+            >>> image = renderer.render(srem.get_config())
+            >>> image.shape
+                (480, 480, 3)
+        """
+        colors = self.colors(config)
+        if self.is_lattice:
+            grid = np.empty((self.grid_shape[0] * self.grid_shape[1], 3), dtype=np.uint8)
+            grid[:] = self.background
+            grid[self.__cells] = colors
+            grid = grid.reshape(self.grid_shape + (3,))
+            if self.cell > 1:
+                grid = np.repeat(np.repeat(grid, self.cell, axis=0), self.cell, axis=1)
+            return grid
+        image = np.empty((self.shape[0] * self.shape[1], 3), dtype=np.uint8)
+        image[:] = self.background
+        footprint = self.__pixels.shape[1]
+        image[self.__pixels.ravel()] = np.repeat(colors, footprint, axis=0)
+        return image.reshape(self.shape + (3,))
+
+
+def encode_png(image):
+    r"""
+    Encodes an RGB uint8 array of shape (H, W, 3) as PNG bytes.
+    """
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    raw = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 0] = 0
+    raw[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+
+def write_png(path, image):
+    r"""
+    Writes an RGB uint8 array of shape (H, W, 3) to a PNG file.
+    """
+    with open(path, "wb") as f:
+        f.write(encode_png(image))
+
+
+def png_sequence(pattern):
+    r"""
+    Returns a frame sink for FrameWriter that writes each frame to
+    ``pattern % frame_number``, e.g. ``"frames/%05d.png"``.
+    """
+    def sink(number, image):
+        write_png(pattern % number, image)
+    return sink
+
+
+def raw_video(stream):
+    r"""
+    Returns a frame sink for FrameWriter that writes each frame as raw
+    rgb24 bytes to a binary stream, e.g. the stdin of an ffmpeg process.
+    """
+    def sink(number, image):
+        stream.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+    return sink
+
+
+class FrameWriter:
+    r"""
+    Renders and writes frames on a background thread.
+
+    ``capture()`` only copies the configuration into a bounded queue. If the
+    writer has fallen behind and the queue is full the frame is dropped
+    instead of blocking; ``dropped`` counts such frames.
+    """
+
+    def __init__(self, renderer, sink, max_queued=16):
+        r"""
+        Start the writer thread.
+
+        INPUT:
+
+        - ``renderer`` - A ConfigRenderer.
+
+        - ``sink`` - A function ``sink(frame_number, image)``, e.g. from
+          ``png_sequence()`` or ``raw_video()``.
+
+        - ``max_queued`` (optional) - int; the number of frames that may
+          wait to be written. Default is 16.
+
+        OUTPUT:
+
+        FrameWriter
+
+        EXAMPLES::
+
+            >>> writer = FrameWriter(renderer, png_sequence("f%05d.png"))
+        """
+        self.renderer = renderer
+        self.sink = sink
+        self.captured = 0
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self.__queue = Queue(max_queued)
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            number, config = item
+            if self.error is not None:
+                continue
+            try:
+                self.sink(number, self.renderer.render(config))
+                self.written += 1
+            except Exception as e:
+                self.error = e
+
+    def capture(self, config, block=False):
+        r"""
+        Queues a configuration to be rendered as the next frame.
+
+        INPUT:
+
+        - ``config`` - A list or array of ints.
+
+        - ``block`` (optional) - If True, wait for room in the queue rather
+          than dropping the frame. Default is False.
+
+        OUTPUT:
+
+        boolean; False if the frame was dropped.
+
+        EXAMPLES::
+
+            >>> writer.capture(srem.get_config())
+                True
+        """
+        if self.error is not None:
+            raise self.error
+        item = (self.captured, np.array(config))
+        try:
+            self.__queue.put(item, block)
+        except Full:
+            self.dropped += 1
+            return False
+        self.captured += 1
+        return True
+
+    def record_updates(self, remote, max_steps=None):
+        r"""
+        Captures the current configuration, then updates the program and
+        captures after each update until it is stable.
+
+        INPUT:
+
+        - ``remote`` - A connected SandpileRemote.
+
+        - ``max_steps`` (optional) - int; stop after this many updates.
+
+        OUTPUT:
+
+        int; the number of updates performed.
+
+        EXAMPLES::
+
+            >>> writer.record_updates(srem)
+                212
+        """
+        self.capture(remote.get_config())
+        steps = 0
+        while remote.get_num_unstables() > 0:
+            if max_steps is not None and steps >= max_steps:
+                break
+            remote.update()
+            self.capture(remote.get_config())
+            steps += 1
+        return steps
+
+    def close(self):
+        r"""
+        Waits for the queued frames to be written and stops the thread.
+        Raises the first error the sink hit, if any.
+        """
+        self.__queue.put(None)
+        self.__thread.join()
+        if self.error is not None:
+            raise self.error
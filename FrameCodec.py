@@ -0,0 +1,119 @@
+r"""
+Frame Codec
+
+The framing used by the optional compressed transport between
+SandpileRemote and a Sandpile server.
+
+Normally each message is a line of text. Once compression has been
+negotiated (see SandpileRemote.connect), each message is instead sent as a
+frame: a one byte tag saying how the payload is encoded, the payload length
+as a 4 byte big-endian int, and the payload. Messages shorter than the
+threshold are sent raw, since compressing them costs more than it saves.
+
+zlib is always available; lz4 is used if the ``lz4`` package is installed.
+"""
+
+import struct
+import zlib
+
+try:
+    import lz4.frame as _lz4
+except ImportError:
+    _lz4 = None
+
+HEADER = struct.Struct(">cI")
+RAW = b"r"
+
+# name -> (tag, compress(data, level), decompress(data))
+CODECS = {
+    "zlib": (b"z", zlib.compress, zlib.decompress),
+}
+if _lz4 is not None:
+    CODECS["lz4"] = (b"l",
+                     lambda data, level: _lz4.compress(data, compression_level=level),
+                     _lz4.decompress)
+
+_DECOMPRESS = dict((tag, decompress) for tag, compress, decompress in CODECS.values())
+
+
+def encode_frame(data, codec=None, threshold=0, level=1):
+    r"""
+    Encodes a message as a frame.
+
+    INPUT:
+
+    - ``data`` - bytes; the message, without a trailing newline.
+
+    - ``codec`` (optional) - string; a name in CODECS, or None to send raw.
+
+    - ``threshold`` (optional) - int; messages shorter than this many bytes
+      are sent raw. Default is 0.
+
+    - ``level`` (optional) - int; the compression level. Default is 1.
+
+    OUTPUT:
+
+    bytes
+
+    EXAMPLES::
+
+        >>> encode_frame(b"done")
+            b'r\x00\x00\x00\x04done'
+    """
+    if codec is not None and len(data) >= threshold:
+        tag, compress, decompress = CODECS[codec]
+        packed = compress(data, level)
+        if len(packed) < len(data):
+            return HEADER.pack(tag, len(packed)) + packed
+    return HEADER.pack(RAW, len(data)) + data
+
+
+def read_raw_frame(f):
+    r"""
+    Reads one frame from a binary file object without decoding it.
+
+    INPUT:
+
+    - ``f`` - A file object, e.g. from ``socket.makefile("rb")``.
+
+    OUTPUT:
+
+    A pair ``(tag, payload)`` of bytes, or None if the stream ended.
+    """
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    tag, length = HEADER.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length:
+        return None
+    return tag, payload
+
+
+def decode_frame(tag, payload):
+    r"""
+    Returns the message carried by a frame read with read_raw_frame().
+    """
+    if tag == RAW:
+        return payload
+    if tag not in _DECOMPRESS:
+        raise ValueError("unknown frame encoding %r" % tag)
+    return _DECOMPRESS[tag](payload)
+
+
+def read_frame(f):
+    r"""
+    Reads one frame from a binary file object.
+
+    INPUT:
+
+    - ``f`` - A file object, e.g. from ``socket.makefile("rb")``.
+
+    OUTPUT:
+
+    bytes; the decoded message, or None if the stream ended.
+    """
+    frame = read_raw_frame(f)
+    if frame is None:
+        return None
+    return decode_frame(*frame)
@@ -0,0 +1,506 @@
+r"""
+Graph Generators
+
+Standard graphs, generated in chunks and streamed to the program.
+
+``add_vertices()`` and ``add_edges()`` take whole lists, so building a
+large lattice first means holding millions of small Python lists. The
+generators here describe a graph by how to compute the positions and
+out-edges of any range of vertices with NumPy. upload() then sends it a
+chunk of vertices at a time through the same bulk commands, so only one
+chunk is ever held as Python lists.
+
+Every generator returns a GeneratedGraph. Lattices (grid(), torus(),
+triangular() and hexagonal()) number their vertices row by row from the
+top, followed by the sinks. Edges are weight 1 in both directions. A
+vertex of grid(), triangular() or hexagonal() on the boundary has an edge
+to a sink for each neighbour it is missing, so every non-sink vertex has
+the full degree of the lattice. torus() has no boundary, and neither do
+random_regular() and erdos_renyi(); those add a single sink as their last
+vertex, with an edge to it from each of the ``attach`` vertices (by
+default vertex 0; ``"all"`` for every vertex).
+
+EXAMPLES:
+
+    >>> graph = grid(1000, 1000)
+    >>> graph.num_vertices
+        1004000
+    >>> graph.upload(srem)
+    >>> engine = graph.engine()
+
+    >>> graph = erdos_renyi(10000, 0.001, seed=1, attach="all")
+    >>> positions, edges = graph.to_lists()
+"""
+
+import math
+
+import numpy as np
+
+from SandpileEngine import SandpileEngine
+
+# The default number of vertices per chunk sent to the program.
+CHUNK_SIZE = 65536
+
+
+class GeneratedGraph:
+    r"""
+    A graph given by functions computing its positions and out-edges for
+    ranges of vertices.
+
+    num_vertices - The number of vertices, sinks included.
+    """
+
+    def __init__(self, num_vertices, positions, edges):
+        r"""
+        Describes a graph.
+
+        INPUT:
+
+        - ``num_vertices`` - int; the number of vertices.
+
+        - ``positions`` - A function of ``(start, stop)`` returning a
+          (stop - start, 2) float array of the positions of those vertices.
+
+        - ``edges`` - A function of ``(start, stop)`` returning an (E, 3)
+          int64 array of the ``[source, dest, weight]`` edges out of those
+          vertices.
+
+        OUTPUT:
+
+        GeneratedGraph
+        """
+        self.num_vertices = num_vertices
+        self.__positions = positions
+        self.__edges = edges
+
+    def __ranges(self, chunk_size):
+        for start in range(0, self.num_vertices, chunk_size):
+            yield start, min(start + chunk_size, self.num_vertices)
+
+    def positions(self, chunk_size=CHUNK_SIZE):
+        r"""
+        Yields the vertex positions as float arrays of up to
+        ``chunk_size`` rows.
+        """
+        for start, stop in self.__ranges(chunk_size):
+            yield self.__positions(start, stop)
+
+    def edges(self, chunk_size=CHUNK_SIZE):
+        r"""
+        Yields the edges as (E, 3) int64 arrays, one for each
+        ``chunk_size`` source vertices.
+        """
+        for start, stop in self.__ranges(chunk_size):
+            yield self.__edges(start, stop)
+
+    def upload(self, srem, chunk_size=CHUNK_SIZE):
+        r"""
+        Adds the graph to the program, a chunk at a time. The vertices are
+        numbered after any already in the program.
+
+        INPUT:
+
+        - ``srem`` - A connected SandpileRemote.
+
+        - ``chunk_size`` (optional) - int; the number of vertices per
+          ``add_vertices`` message, and of source vertices per
+          ``add_edges`` message. Default is CHUNK_SIZE.
+
+        OUTPUT:
+
+        int; the index of the graph's first vertex in the program.
+
+        EXAMPLES::
+
+            >>> grid(1000, 1000).upload(srem)
+                0
+        """
+        offset = srem.get_num_of_vertices()
+        for chunk in self.positions(chunk_size):
+            srem.add_vertices(chunk.tolist())
+        for chunk in self.edges(chunk_size):
+            if len(chunk):
+                chunk[:, :2] += offset
+                srem.add_edges(chunk.tolist())
+        if srem.auto_repaint:
+            srem.repaint()
+        return offset
+
+    def to_lists(self):
+        r"""
+        Returns ``(positions, edges)`` as lists, in the formats of
+        ``add_vertices()`` and ``add_edges()``. For small graphs.
+        """
+        positions = self.__positions(0, self.num_vertices)
+        return positions.tolist(), self.__edges(0, self.num_vertices).tolist()
+
+    def engine(self):
+        r"""
+        Returns a SandpileEngine for the graph, built from the edge arrays
+        without making lists.
+        """
+        edges = np.concatenate(list(self.edges()) + [np.zeros((0, 3), dtype=np.int64)])
+        return SandpileEngine(self.num_vertices, edges)
+
+
+def _lattice_edges(rows, cols, neighbours, sink):
+    # The out-edges of vertices start..stop of a rows x cols lattice, where
+    # neighbours(r, c) gives the neighbours' rows and columns, one array
+    # pair per direction, and sink(r, c, i, mask) gives the sink for the
+    # vertices in mask, which have no neighbour in direction i.
+    def edges(start, stop):
+        vertices = np.arange(start, min(stop, rows * cols), dtype=np.int64)
+        r, c = np.divmod(vertices, cols)
+        parts = []
+        for i, (nr, nc) in enumerate(neighbours(r, c)):
+            inside = (nr >= 0) & (nr < rows) & (nc >= 0) & (nc < cols)
+            dest = np.where(inside, nr * cols + nc, 0)
+            if not inside.all():
+                dest[~inside] = sink(r, c, i, ~inside)
+            parts.append(np.stack((vertices, dest, np.ones_like(vertices)), axis=1))
+        if not len(vertices):
+            return np.zeros((0, 3), dtype=np.int64)
+        # Sort by source, then by direction.
+        return np.stack(parts, axis=1).reshape(-1, 3)
+    return edges
+
+
+def _lattice_positions(rows, cols, place, extra):
+    # The positions of vertices start..stop: place(r, c) for the lattice,
+    # then the rows of extra for the sinks.
+    def positions(start, stop):
+        count = rows * cols
+        vertices = np.arange(start, min(stop, count), dtype=np.int64)
+        x, y = place(*np.divmod(vertices, cols))
+        inner = np.stack((x, y), axis=1).astype(float)
+        return np.concatenate((inner, extra[max(start - count, 0):max(stop - count, 0)]))
+    return positions
+
+
+def grid(rows, cols, spacing=10.0):
+    r"""
+    Returns the rows x cols grid with a ring of sinks around it, as in
+    ``GridEngine.grid_graph()``: each grid vertex has an edge to each of
+    its four neighbours, where those beyond the edge are sinks.
+
+    INPUT:
+
+    - ``rows``, ``cols`` - ints; the size of the grid.
+
+    - ``spacing`` (optional) - float; the distance between neighbours.
+      Default is 10.0.
+
+    OUTPUT:
+
+    GeneratedGraph. The sinks come after the grid: those above it, below
+      it, left of it and right of it, in order along each side.
+
+    EXAMPLES::
+
+        >>> grid(20, 20).num_vertices
+            480
+    """
+    count = rows * cols
+    sides = np.concatenate((np.stack((np.full(cols, -1), np.arange(cols)), axis=1),
+                            np.stack((np.full(cols, rows), np.arange(cols)), axis=1),
+                            np.stack((np.arange(rows), np.full(rows, -1)), axis=1),
+                            np.stack((np.arange(rows), np.full(rows, cols)), axis=1)))
+
+    def place(r, c):
+        return c * spacing, (rows - 1 - r) * spacing
+
+    def neighbours(r, c):
+        return [(r + dr, c + dc) for dr, dc in ((1, 0), (-1, 0), (0, 1), (0, -1))]
+
+    def sink(r, c, i, mask):
+        return count + [cols + c, c, 2 * cols + rows + r, 2 * cols + r][i][mask]
+
+    x, y = place(sides[:, 0], sides[:, 1])
+    extra = np.stack((x, y), axis=1).astype(float)
+    return GeneratedGraph(count + len(sides), _lattice_positions(rows, cols, place, extra),
+                          _lattice_edges(rows, cols, neighbours, sink))
+
+
+def _single_sink(count, attach, neighbour_edges):
+    # Adds a sink as vertex count to a graph given by neighbour_edges, with
+    # an edge to it from each vertex in attach.
+    if isinstance(attach, str):
+        if attach != "all":
+            raise ValueError("attach must be a list of vertices or 'all'")
+        attached = np.ones(count, dtype=bool)
+    else:
+        attached = np.zeros(count, dtype=bool)
+        attach = np.asarray(attach, dtype=np.int64)
+        if len(attach) and (attach.min() < 0 or attach.max() >= count):
+            raise ValueError("attach vertex out of range")
+        attached[attach] = True
+
+    def edges(start, stop):
+        stop = min(stop, count)
+        inner = neighbour_edges(start, stop)
+        vertices = np.flatnonzero(attached[start:stop]) + start
+        to_sink = np.stack((vertices, np.full_like(vertices, count), np.ones_like(vertices)), axis=1)
+        both = np.concatenate((inner, to_sink))
+        return both[np.argsort(both[:, 0], kind="stable")]
+    return edges
+
+
+def torus(rows, cols, spacing=10.0, attach=(0,)):
+    r"""
+    Returns the rows x cols torus: a grid whose opposite sides are joined,
+    with a single sink.
+
+    INPUT:
+
+    - ``rows``, ``cols`` - ints; the size, each at least 3.
+
+    - ``spacing`` (optional) - float. Default is 10.0.
+
+    - ``attach`` (optional) - The vertices with an edge to the sink, or
+      ``"all"``. Default is vertex 0.
+
+    OUTPUT:
+
+    GeneratedGraph; the sink is drawn below the torus.
+    """
+    if rows < 3 or cols < 3:
+        raise ValueError("a torus needs at least 3 rows and columns")
+    count = rows * cols
+
+    def place(r, c):
+        return c * spacing, (rows - 1 - r) * spacing
+
+    def neighbours(r, c):
+        return [((r + dr) % rows, (c + dc) % cols) for dr, dc in ((1, 0), (-1, 0), (0, 1), (0, -1))]
+
+    extra = np.array([[(cols - 1) * spacing / 2, -2 * spacing]])
+    edges = _lattice_edges(rows, cols, neighbours, None)
+    return GeneratedGraph(count + 1, _lattice_positions(rows, cols, place, extra),
+                          _single_sink(count, attach, edges))
+
+
+def triangular(rows, cols, spacing=10.0):
+    r"""
+    Returns a rows x cols patch of the triangular lattice, where each
+    vertex has six neighbours; odd rows are shifted half a step right.
+    Missing neighbours are replaced by edges to a single sink, so that
+    every other vertex has degree 6.
+
+    INPUT:
+
+    - ``rows``, ``cols`` - ints; the size.
+
+    - ``spacing`` (optional) - float. Default is 10.0.
+
+    OUTPUT:
+
+    GeneratedGraph; the sink is the last vertex, drawn below the patch.
+    """
+    count = rows * cols
+    height = spacing * math.sqrt(3) / 2
+
+    def place(r, c):
+        return c * spacing + (r % 2) * spacing / 2, (rows - 1 - r) * height
+
+    def neighbours(r, c):
+        shift = r % 2
+        return [(r, c + 1), (r, c - 1),
+                (r - 1, c - 1 + shift), (r - 1, c + shift),
+                (r + 1, c - 1 + shift), (r + 1, c + shift)]
+
+    def sink(r, c, i, mask):
+        return count
+
+    extra = np.array([[(cols - 1) * spacing / 2, -2 * height]])
+    return GeneratedGraph(count + 1, _lattice_positions(rows, cols, place, extra),
+                          _lattice_edges(rows, cols, neighbours, sink))
+
+
+def hexagonal(rows, cols, spacing=10.0):
+    r"""
+    Returns a rows x cols patch of the hexagonal (honeycomb) lattice,
+    where each vertex has three neighbours: both neighbours in its row,
+    and the vertex below it if its row and column add up to an even
+    number, else the one above. Missing neighbours are replaced by edges
+    to a single sink, so that every other vertex has degree 3.
+
+    INPUT:
+
+    - ``rows``, ``cols`` - ints; the size.
+
+    - ``spacing`` (optional) - float; the length of each edge. Default is
+      10.0.
+
+    OUTPUT:
+
+    GeneratedGraph; the sink is the last vertex, drawn below the patch.
+    """
+    count = rows * cols
+    width = spacing * math.sqrt(3) / 2
+
+    def place(r, c):
+        return c * width, (1.5 * (rows - 1 - r) - 0.5 * ((r + c + 1) % 2)) * spacing
+
+    def neighbours(r, c):
+        down = (r + c) % 2 == 0
+        return [(r, c + 1), (r, c - 1), (np.where(down, r + 1, r - 1), c)]
+
+    def sink(r, c, i, mask):
+        return count
+
+    extra = np.array([[(cols - 1) * width / 2, -2 * spacing]])
+    return GeneratedGraph(count + 1, _lattice_positions(rows, cols, place, extra),
+                          _lattice_edges(rows, cols, neighbours, sink))
+
+
+def _random_graph(n, pairs, spacing, rng, attach):
+    # An undirected graph on n random positions, from an (M, 2) array of
+    # distinct pairs u < v, with a single sink.
+    side = spacing * math.sqrt(max(n, 1))
+    positions = np.concatenate((rng.random((n, 2)) * side, [[side / 2, -2 * spacing]]))
+    both = np.concatenate((pairs, pairs[:, ::-1]))
+    both = both[np.argsort(both[:, 0], kind="stable")]
+    starts = np.searchsorted(both[:, 0], np.arange(n + 1))
+
+    def neighbour_edges(start, stop):
+        part = both[starts[start]:starts[stop]]
+        return np.concatenate((part, np.ones((len(part), 1), dtype=np.int64)), axis=1)
+
+    return GeneratedGraph(n + 1, lambda start, stop: positions[start:stop],
+                          _single_sink(n, attach, neighbour_edges))
+
+
+def _switch_pairs(n, degree, rng):
+    # Pairs the ends of n * degree edges at random, then removes loops and
+    # repeated edges one at a time with switches, which turn two pairs
+    # (a, b) and (c, d) into (a, c) and (b, d) and so keep every degree.
+    # Returns None if a bad pair found no switch after many tries.
+    ends = rng.permutation(np.repeat(np.arange(n, dtype=np.int64), degree))
+    pairs = np.sort(ends.reshape(-1, 2), axis=1)
+    keys = pairs[:, 0] * n + pairs[:, 1]
+    order = np.argsort(keys, kind="stable")
+    repeated = np.zeros(len(pairs), dtype=bool)
+    repeated[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+    bad = np.flatnonzero(repeated | (pairs[:, 0] == pairs[:, 1])).tolist()
+    sorted_keys = keys[order]
+    # Changes to the number of pairs with each key since sorted_keys.
+    changes = dict()
+
+    def count(key):
+        return (int(np.searchsorted(sorted_keys, key, "right"))
+                - int(np.searchsorted(sorted_keys, key)) + changes.get(key, 0))
+
+    tries = 0
+    while bad:
+        i = bad[-1]
+        a, b = pairs[i].tolist()
+        if a != b and count(a * n + b) == 1:
+            bad.pop()
+            continue
+        j = int(rng.integers(0, len(pairs)))
+        c, d = pairs[j].tolist()[::rng.choice((1, -1))]
+        first, second = (min(a, c), max(a, c)), (min(b, d), max(b, d))
+        new = first[0] * n + first[1], second[0] * n + second[1]
+        if (a == c or b == d or new[0] == new[1]
+                or count(new[0]) or count(new[1])):
+            tries += 1
+            if tries > 100 * (len(bad) + 10):
+                return None
+            continue
+        for key, change in ((a * n + b, -1), (min(c, d) * n + max(c, d), -1),
+                            (new[0], 1), (new[1], 1)):
+            changes[key] = changes.get(key, 0) + change
+        pairs[i], pairs[j] = first, second
+    return pairs
+
+
+def random_regular(n, degree, seed=None, spacing=10.0, attach=(0,)):
+    r"""
+    Returns a random simple graph where every vertex has the given number
+    of neighbours, from the pairing model: the ends of the edges are
+    paired at random, and each pair that would give a loop or a repeated
+    edge is switched with a random other pair until there are none. For
+    more than ``(n - 1) / 2`` neighbours, the complement of a random graph
+    with ``n - 1 - degree`` neighbours is returned instead.
+
+    INPUT:
+
+    - ``n``, ``degree`` - ints; ``n * degree`` must be even and
+      ``degree`` less than ``n``.
+
+    - ``seed`` (optional) - A seed for ``numpy.random.default_rng``.
+
+    - ``spacing`` (optional) - float; vertices are placed at random in a
+      square of side ``spacing * sqrt(n)``. Default is 10.0.
+
+    - ``attach`` (optional) - The vertices with an edge to the sink, or
+      ``"all"``. Default is vertex 0.
+
+    OUTPUT:
+
+    GeneratedGraph
+
+    EXAMPLES::
+
+        >>> random_regular(6, 5).engine().degrees
+            array([6, 5, 5, 5, 5, 5, 0])
+    """
+    if (n * degree) % 2 or not 0 <= degree < n:
+        raise ValueError("no %d-regular graph on %d vertices" % (degree, n))
+    rng = np.random.default_rng(seed)
+    complement = 2 * degree > n - 1
+    pairs = None
+    while pairs is None:
+        pairs = _switch_pairs(n, n - 1 - degree if complement else degree, rng)
+    if complement:
+        u, v = np.triu_indices(n, 1)
+        keep = ~np.isin(u * n + v, pairs[:, 0] * n + pairs[:, 1])
+        pairs = np.stack((u[keep], v[keep]), axis=1).astype(np.int64)
+    keys = np.sort(pairs[:, 0] * n + pairs[:, 1])
+    if ((pairs[:, 0] == pairs[:, 1]).any() or (keys[1:] == keys[:-1]).any()
+            or (np.bincount(pairs.ravel(), minlength=n) != degree).any()):
+        raise RuntimeError("failed to make a simple %d-regular graph" % degree)
+    return _random_graph(n, pairs, spacing, rng, attach)
+
+
+def erdos_renyi(n, p, seed=None, spacing=10.0, attach=(0,)):
+    r"""
+    Returns an Erdos-Renyi random graph, where each pair of vertices is
+    joined with probability ``p``.
+
+    INPUT:
+
+    - ``n`` - int; the number of vertices, not counting the sink.
+
+    - ``p`` - float; the probability of each edge.
+
+    - ``seed``, ``spacing``, ``attach`` (optional) - As for
+      random_regular().
+
+    OUTPUT:
+
+    GeneratedGraph
+
+    EXAMPLES::
+
+        >>> erdos_renyi(5, 1.0).engine().degrees
+            array([5, 4, 4, 4, 4, 0])
+    """
+    rng = np.random.default_rng(seed)
+    total = n * (n - 1) // 2
+    count = rng.binomial(total, p) if total else 0
+    # Choose count of the pairs, numbered 0..total-1 row by row.
+    if count > total // 2:
+        chosen = np.sort(rng.permutation(total)[:count])
+    else:
+        chosen = np.zeros(0, dtype=np.int64)
+        while len(chosen) < count:
+            extra = rng.integers(0, total, count - len(chosen))
+            chosen = np.unique(np.concatenate((chosen, extra)))
+    # Pair k is (u, v) with u < v, where row u starts at u*n - u*(u+1)/2.
+    u = np.floor((2 * n - 1 - np.sqrt((2 * n - 1) ** 2 - 8 * chosen.astype(float))) / 2).astype(np.int64)
+    starts = u * n - u * (u + 1) // 2
+    u -= chosen < starts
+    u += chosen >= u * n - u * (u + 1) // 2 + (n - 1 - u)
+    v = chosen - (u * n - u * (u + 1) // 2) + u + 1
+    return _random_graph(n, np.stack((u, v), axis=1), spacing, rng, attach)
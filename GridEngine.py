@@ -0,0 +1,357 @@
+r"""
+Grid Engine
+
+Stabilization on square grids with whole-array NumPy operations.
+
+When every vertex sits on a square lattice and every edge joins two
+neighbouring cells, a configuration is just a 2-D array and a round of
+firings is a stencil: each cell fires ``config // degree`` times at once,
+and the grains are moved to the four neighbours with shifted array
+additions. Sinks are cells of degree 0 (for example the ring of sinks
+around the usual grid) and simply collect what they receive; cells
+without a vertex are holes that never receive anything.
+
+Each round touches the whole array, so this is the fastest way to relax
+large piles everywhere at once; for small avalanches on a mostly stable
+configuration, SandpileEngine only visits the vertices that fire.
+
+The grid is detected from the program's ``get_vertices()`` and
+``get_edges()``, or the cells can be given explicitly. Results are
+returned indexed by vertex, like the program's, and the 2-D forms are
+available through to_grid() and stabilize_grid().
+
+EXAMPLES:
+
+Build the 20x20 grid with sinks around the edges and stabilize the max
+stable configuration plus one grain everywhere (see
+``SandpileRemote.get_num_unstables``):
+
+    >>> positions, edges = grid_graph(20, 20)
+    >>> srem.add_vertices(positions)
+    >>> srem.add_edges(edges)
+    >>> engine = GridEngine.from_remote(srem)
+    >>> stable, odometer = engine.stabilize(engine.max_stable() + 1)
+    >>> odometer.sum()
+        11556
+"""
+
+import numpy as np
+
+from ConfigRenderer import lattice_cells
+from SandpileEngine import SandpileEngine
+
+# The neighbour directions as (row step, column step), in the order used
+# by GridEngine.weights.
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+# Stands in for the degree of sinks and holes, so that they never fire.
+_NEVER = np.iinfo(np.int64).max
+
+
+def _shift(step, n):
+    # The source and destination slices along one axis for a step.
+    if step > 0:
+        return slice(0, n - step), slice(step, n)
+    if step < 0:
+        return slice(-step, n), slice(0, n + step)
+    return slice(None), slice(None)
+
+
+def grid_graph(rows, cols, spacing=10.0):
+    r"""
+    Returns the usual grid graph: a rows x cols grid of vertices, each with
+    an edge of weight 1 to each of its four neighbours, where the
+    neighbours beyond the edges of the grid are sinks.
+
+    INPUT:
+
+    - ``rows``, ``cols`` - ints; the size of the grid.
+
+    - ``spacing`` (optional) - float; the distance between neighbouring
+      vertices. Default is 10.0.
+
+    OUTPUT:
+
+    A pair ``(positions, edges)`` in the formats of ``add_vertices()`` and
+      ``add_edges()``. The grid vertices come first, row by row from the
+      top, followed by the ``2 * (rows + cols)`` sinks.
+
+    EXAMPLES::
+
+        >>> positions, edges = grid_graph(20, 20)
+        >>> len(positions)
+            480
+    """
+    positions = [[c * spacing, (rows - 1 - r) * spacing]
+                 for r in range(rows) for c in range(cols)]
+    sinks = dict()
+    edges = []
+    for r in range(rows):
+        for c in range(cols):
+            for dr, dc in DIRECTIONS:
+                nr, nc = r + dr, c + dc
+                if 0 <= nr < rows and 0 <= nc < cols:
+                    dest = nr * cols + nc
+                else:
+                    if (nr, nc) not in sinks:
+                        sinks[(nr, nc)] = len(positions)
+                        positions.append([nc * spacing, (rows - 1 - nr) * spacing])
+                    dest = sinks[(nr, nc)]
+                edges.append([r * cols + c, dest, 1])
+    return positions, edges
+
+
+class GridEngine:
+    r"""
+    A graph laid out on a square lattice, with methods to topple
+    configurations on it as 2-D arrays.
+
+    num_vertices - The number of vertices.
+
+    shape - The shape (H, W) of the lattice.
+
+    rows, cols - The cell of each vertex.
+
+    vertex - An (H, W) array of the vertex in each cell; -1 for holes.
+
+    weights - An (4, H, W) array of the weight of the edge from each cell
+    in each of DIRECTIONS.
+
+    degrees - An (H, W) array of out-degrees; 0 for sinks and holes.
+    """
+
+    def __init__(self, num_vertices, edges, cells):
+        r"""
+        Builds an engine from a list of edges and the cell of each vertex.
+
+        INPUT:
+
+        - ``num_vertices`` - int; the number of vertices.
+
+        - ``edges`` - A list of ``[source, dest, weight]`` triples, as
+          returned by ``SandpileRemote.get_edges()``.
+
+        - ``cells`` - A tuple ``(rows, cols, shape)``: the row and column
+          of each vertex and the lattice shape, as returned by
+          ``ConfigRenderer.lattice_cells()``.
+
+        OUTPUT:
+
+        GridEngine; raises ValueError if two vertices share a cell or an
+          edge does not join neighbouring cells.
+
+        EXAMPLES::
+
+            >>> engine = GridEngine(3, [[0, 1, 1], [1, 0, 1], [1, 2, 1]],
+            ...                     ([0, 0, 0], [0, 1, 2], (1, 3)))
+            >>> engine.degrees
+                array([[1, 2, 0]])
+        """
+        rows, cols, shape = cells
+        self.num_vertices = num_vertices
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.shape = tuple(shape)
+        if len(self.rows) != num_vertices or len(self.cols) != num_vertices:
+            raise ValueError("expected a cell for each of %d vertices" % num_vertices)
+        self.vertex = np.full(self.shape, -1, dtype=np.int64)
+        self.vertex[self.rows, self.cols] = np.arange(num_vertices)
+        if (self.vertex >= 0).sum() != num_vertices:
+            raise ValueError("two vertices share a cell")
+        self.weights = np.zeros((len(DIRECTIONS),) + self.shape, dtype=np.int64)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 3)
+        self.__edges = edges
+        self.__engine = None
+        if len(edges):
+            source, dest, weight = edges.T
+            dr = self.rows[dest] - self.rows[source]
+            dc = self.cols[dest] - self.cols[source]
+            direction = np.full(len(edges), -1)
+            for i, (r, c) in enumerate(DIRECTIONS):
+                direction[(dr == r) & (dc == c)] = i
+            if (direction < 0).any():
+                bad = edges[np.flatnonzero(direction < 0)[0]]
+                raise ValueError("edge %d -> %d does not join neighbouring cells"
+                                 % (bad[0], bad[1]))
+            np.add.at(self.weights, (direction, self.rows[source], self.cols[source]), weight)
+        if (self.weights < 0).any():
+            raise ValueError("negative edge weight")
+        self.degrees = self.weights.sum(axis=0)
+        self.__fire_degrees = np.where(self.degrees > 0, self.degrees, _NEVER)
+        self.__moves = []
+        for i, (r, c) in enumerate(DIRECTIONS):
+            (src_r, dst_r), (src_c, dst_c) = _shift(r, self.shape[0]), _shift(c, self.shape[1])
+            if self.weights[i].any():
+                self.__moves.append((self.weights[i][src_r, src_c], (src_r, src_c), (dst_r, dst_c)))
+
+    @classmethod
+    def from_graph(cls, positions, edges):
+        r"""
+        Builds an engine for a graph whose vertices lie on a square lattice.
+
+        INPUT:
+
+        - ``positions`` - A list of lists of floats, as given by
+          ``get_vertices()``.
+
+        - ``edges`` - A list of ``[source, dest, weight]`` triples, as
+          given by ``get_edges()``.
+
+        OUTPUT:
+
+        GridEngine; raises ValueError if the graph is not a grid.
+
+        EXAMPLES::
+
+            >>> engine = GridEngine.from_graph(*grid_graph(20, 20))
+            >>> engine.shape
+                (22, 22)
+        """
+        cells = lattice_cells(positions)
+        if cells is None:
+            raise ValueError("the vertices are not on a square lattice")
+        return cls(len(positions), edges, cells)
+
+    @classmethod
+    def from_remote(cls, srem):
+        r"""
+        Builds an engine from the graph currently in the program.
+
+        INPUT:
+
+        - ``srem`` - A connected SandpileRemote.
+
+        OUTPUT:
+
+        GridEngine; raises ValueError if the graph is not a grid.
+
+        EXAMPLES::
+
+            >>> engine = GridEngine.from_remote(srem)
+        """
+        return cls.from_graph(srem.get_vertices(), srem.get_edges())
+
+    def to_grid(self, config):
+        r"""
+        Returns a configuration as an (H, W) array; holes hold 0.
+        """
+        config = np.asarray(config, dtype=np.int64)
+        if config.shape != (self.num_vertices,):
+            raise ValueError("expected %d values, got %d"
+                             % (self.num_vertices, config.size))
+        grid = np.zeros(self.shape, dtype=np.int64)
+        grid[self.rows, self.cols] = config
+        return grid
+
+    def from_grid(self, grid):
+        r"""
+        Returns the configuration held in an (H, W) array, indexed by vertex.
+        """
+        return np.asarray(grid)[self.rows, self.cols]
+
+    def max_stable(self):
+        r"""
+        Returns the maximal stable configuration, indexed by vertex.
+        """
+        return self.from_grid(np.maximum(self.degrees - 1, 0))
+
+    def __topple(self, grid, times):
+        # Fires every cell the given (H, W) number of times.
+        grid -= times * self.degrees
+        for weights, src, dst in self.__moves:
+            grid[dst] += times[src] * weights
+
+    def __firings(self, grid, out=None):
+        times = np.floor_divide(grid, self.__fire_degrees, out=out)
+        return np.maximum(times, 0, out=times)
+
+    def update(self, config):
+        r"""
+        Fires every unstable vertex once, like ``SandpileRemote.update()``.
+
+        INPUT:
+
+        - ``config`` - A list or array of ints, one per vertex.
+
+        OUTPUT:
+
+        The new configuration as an array, indexed by vertex.
+        """
+        grid = self.to_grid(config)
+        self.__topple(grid, np.minimum(self.__firings(grid), 1))
+        return self.from_grid(grid)
+
+    def stabilize_grid(self, grid):
+        r"""
+        Stabilizes a configuration given as an (H, W) array.
+        Warning: If the configuration cannot stabilize (there is no path to
+        a sink), this never returns.
+
+        INPUT:
+
+        - ``grid`` - An (H, W) array of ints. It is not modified.
+
+        OUTPUT:
+
+        A pair ``(stable, odometer)`` of (H, W) int64 arrays.
+
+        EXAMPLES::
+
+            >>> grid = np.zeros(engine.shape, dtype=np.int64)
+            >>> grid[11, 11] = 10000
+            >>> stable, odometer = engine.stabilize_grid(grid)
+        """
+        grid = np.array(grid, dtype=np.int64)
+        if grid.shape != self.shape:
+            raise ValueError("expected an array of shape %r" % (self.shape,))
+        odometer = np.zeros(self.shape, dtype=np.int64)
+        times = np.empty(self.shape, dtype=np.int64)
+        while self.__firings(grid, out=times).any():
+            odometer += times
+            self.__topple(grid, times)
+        return grid, odometer
+
+    def engine(self):
+        r"""
+        Returns a SandpileEngine for the same graph, built on first use.
+        """
+        if self.__engine is None:
+            self.__engine = SandpileEngine(self.num_vertices, self.__edges)
+        return self.__engine
+
+    def stabilize(self, config, estimate=False):
+        r"""
+        Stabilizes a configuration.
+        Warning: If the configuration cannot stabilize (there is no path to
+        a sink), this never returns.
+
+        INPUT:
+
+        - ``config`` - A list or array of ints, one per vertex.
+
+        - ``estimate`` (optional) - If True, first fire the vertices as
+          many times as SandpileEngine.estimate_odometer() gives, all in one
+          step, as in SandpileEngine.stabilize(). Requires SciPy. Default is
+          False.
+
+        OUTPUT:
+
+        A pair ``(stable, odometer)`` of int64 arrays indexed by vertex: the
+          stabilized configuration and how many times each vertex fired.
+          These are the same as SandpileEngine.stabilize() gives.
+
+        EXAMPLES::
+
+            >>> engine = GridEngine.from_graph(*grid_graph(20, 20))
+            >>> stable, odometer = engine.stabilize(engine.max_stable() + 1)
+            >>> odometer.sum()
+                11556
+        """
+        if not estimate:
+            grid, odometer = self.stabilize_grid(self.to_grid(config))
+            return self.from_grid(grid), self.from_grid(odometer)
+        engine = self.engine()
+        bulk = engine.estimate_odometer(config)
+        config = np.asarray(config, dtype=np.int64) - engine.laplacian().dot(bulk)
+        grid, odometer = self.stabilize_grid(self.to_grid(config))
+        return self.from_grid(grid), self.from_grid(odometer) + bulk
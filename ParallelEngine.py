@@ -0,0 +1,277 @@
+r"""
+Parallel Engine
+
+Stabilization of one large configuration on several cores.
+
+The vertices are split into regions, one per worker process, and the
+configuration lives in ``multiprocessing.shared_memory``. Each region is
+laid out in the shared block as its own vertices followed by "ghost" slots
+for the vertices of other regions that its edges lead to. A worker
+stabilizes its region with a SandpileEngine in which the ghosts are sinks,
+so grains leaving the region pile up in the ghost slots. Then every worker
+adds the grains waiting in other regions' ghost slots to its own vertices,
+the ghosts are emptied, and the rounds repeat until no region has an
+unstable vertex. Workers meet at a barrier between the steps, so each slot
+is only written by one worker at a time.
+
+By the abelian property the order of firings does not matter, so the
+result is exactly that of SandpileEngine.stabilize(), odometer included.
+
+EXAMPLES:
+
+    >>> engine = ParallelEngine.from_remote(srem, processes=8)
+    >>> stable, odometer = engine.stabilize(config)
+    >>> srem.set_config(stable)
+
+See bench_parallel.py for timings on 1 to N cores.
+"""
+
+import multiprocessing
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from SandpileEngine import SandpileEngine
+
+
+def partition(num_vertices, edges, parts):
+    r"""
+    Splits the vertices into regions of about equal size that follow the
+    edges, by cutting a breadth-first ordering of the graph (ignoring edge
+    directions) into consecutive pieces.
+
+    INPUT:
+
+    - ``num_vertices`` - int; the number of vertices.
+
+    - ``edges`` - A list of ``[source, dest, weight]`` triples.
+
+    - ``parts`` - int; the number of regions.
+
+    OUTPUT:
+
+    An int array giving the region of each vertex.
+
+    EXAMPLES::
+
+        >>> partition(4, [[0, 1, 1], [1, 2, 1], [2, 3, 1]], 2)
+            array([0, 0, 1, 1])
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 3)
+    ends = np.concatenate((edges[:, :2], edges[:, 1::-1]))
+    ends = ends[np.argsort(ends[:, 0], kind="stable")]
+    indptr = np.searchsorted(ends[:, 0], np.arange(num_vertices + 1))
+    neighbours = ends[:, 1]
+    seen = np.zeros(num_vertices, dtype=bool)
+    order = []
+    for start in range(num_vertices):
+        if seen[start]:
+            continue
+        seen[start] = True
+        todo = deque([start])
+        while todo:
+            v = todo.popleft()
+            order.append(v)
+            for u in neighbours[indptr[v]:indptr[v + 1]]:
+                if not seen[u]:
+                    seen[u] = True
+                    todo.append(u)
+    regions = np.empty(num_vertices, dtype=np.int64)
+    regions[np.array(order, dtype=np.int64)] = np.arange(num_vertices) * parts // max(num_vertices, 1)
+    return regions
+
+
+class _Region:
+    # What a worker needs to know about its region. Positions are offsets
+    # into the shared configuration block.
+
+    def __init__(self, engine, vertices, start):
+        self.vertices = vertices
+        own = len(vertices)
+        local = np.full(engine.num_vertices, -1, dtype=np.int64)
+        local[vertices] = np.arange(own)
+        starts = engine.indptr[vertices]
+        counts = engine.indptr[vertices + 1] - starts
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+            np.arange(counts.sum())
+        targets = engine.indices[positions]
+        self.ghosts = np.unique(targets[local[targets] < 0])
+        local[self.ghosts] = own + np.arange(len(self.ghosts))
+        indptr = np.concatenate(([0], np.cumsum(counts), np.full(len(self.ghosts), counts.sum())))
+        self.engine = SandpileEngine.from_csr(indptr, local[targets], engine.weights[positions])
+        self.own = own
+        self.start = start
+        self.stop = start + own + len(self.ghosts)
+
+    def inbox(self, others):
+        # The ghost slots in other regions that stand for this region's
+        # vertices, and the slots of those vertices.
+        slots, targets = [], []
+        mine = dict((v, i) for i, v in enumerate(self.vertices))
+        for other in others:
+            if other is self:
+                continue
+            for i, v in enumerate(other.ghosts):
+                if v in mine:
+                    slots.append(other.start + other.own + i)
+                    targets.append(self.start + mine[v])
+        self.inbox_slots = np.array(slots, dtype=np.int64)
+        self.inbox_targets = np.array(targets, dtype=np.int64)
+
+
+def _worker(index, region, name, layout, barrier):
+    # ``layout`` gives the sizes of the three parts of the shared block:
+    # the regions with their ghosts, the odometer, and a flag per worker
+    # saying whether its region is still unstable.
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        block = np.ndarray((sum(layout),), dtype=np.int64, buffer=shm.buf)
+        config, odometer, busy = np.split(block, np.cumsum(layout)[:2])
+        segment = slice(region.start, region.stop)
+        while True:
+            stable, fired = region.engine.stabilize(config[segment])
+            config[segment] = stable
+            odometer[region.vertices] += fired[:region.own]
+            barrier.wait()
+            np.add.at(config, region.inbox_targets, config[region.inbox_slots])
+            busy[index] = len(region.engine.unstables(config[segment]))
+            barrier.wait()
+            config[region.start + region.own:region.stop] = 0
+            if not busy.any():
+                break
+    finally:
+        del block, config, odometer, busy
+        shm.close()
+
+
+class ParallelEngine:
+    r"""
+    Stabilizes configurations with several worker processes sharing one
+    block of memory.
+
+    num_vertices - The number of vertices.
+
+    processes - The number of worker processes.
+
+    regions - The region (and so the worker) of each vertex, numbered
+    from 0.
+    """
+
+    def __init__(self, num_vertices, edges, processes=None, regions=None):
+        r"""
+        Splits a graph into regions for parallel stabilization.
+
+        INPUT:
+
+        - ``num_vertices`` - int; the number of vertices.
+
+        - ``edges`` - A list of ``[source, dest, weight]`` triples, as
+          returned by ``SandpileRemote.get_edges()``.
+
+        - ``processes`` (optional) - int; the number of worker processes,
+          at most the number of non-sink vertices. Default is the number
+          of CPUs.
+
+        - ``regions`` (optional) - An int array giving the region of each
+          vertex. Region numbers with no vertices are skipped. Default is
+          partition() into ``processes`` regions.
+
+        OUTPUT:
+
+        ParallelEngine
+
+        EXAMPLES::
+
+            >>> positions, edges = grid_graph(1000, 1000)
+            >>> engine = ParallelEngine(len(positions), edges, processes=4)
+        """
+        self.num_vertices = num_vertices
+        engine = SandpileEngine(num_vertices, edges)
+        if regions is None:
+            if processes is None:
+                processes = multiprocessing.cpu_count()
+            # More workers than non-sinks would only have sinks to hold.
+            processes = max(min(processes, np.count_nonzero(engine.degrees)), 1)
+            regions = partition(num_vertices, edges, processes)
+        # Number the regions that have vertices from 0, skipping empty ones.
+        used, regions = np.unique(np.asarray(regions, dtype=np.int64), return_inverse=True)
+        self.regions = regions.reshape(-1)
+        self.processes = len(used)
+        self.__regions = []
+        start = 0
+        for r in range(self.processes):
+            region = _Region(engine, np.flatnonzero(self.regions == r), start)
+            self.__regions.append(region)
+            start = region.stop
+        for region in self.__regions:
+            region.inbox(self.__regions)
+        self.__size = start
+
+    @classmethod
+    def from_remote(cls, srem, processes=None):
+        r"""
+        Builds a parallel engine from the graph currently in the program.
+        """
+        return cls(srem.get_num_of_vertices(), srem.get_edges(), processes)
+
+    def stabilize(self, config):
+        r"""
+        Stabilizes a configuration using all the workers.
+        Warning: If the configuration cannot stabilize (there is no path to
+        a sink), this never returns.
+
+        INPUT:
+
+        - ``config`` - A list or array of ints, one per vertex. It is not
+          modified.
+
+        OUTPUT:
+
+        A pair ``(stable, odometer)`` of int64 arrays, the same as
+          SandpileEngine.stabilize() gives.
+
+        EXAMPLES::
+
+            >>> stable, odometer = engine.stabilize(config)
+        """
+        config = np.asarray(config, dtype=np.int64)
+        if config.shape != (self.num_vertices,):
+            raise ValueError("expected %d values, got %d"
+                             % (self.num_vertices, config.size))
+        if not self.processes:
+            return config.copy(), np.zeros(self.num_vertices, dtype=np.int64)
+        layout = (self.__size, self.num_vertices, self.processes)
+        size = sum(layout)
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1) * 8)
+        try:
+            block = np.ndarray((size,), dtype=np.int64, buffer=shm.buf)
+            block[:] = 0
+            for region in self.__regions:
+                block[region.start:region.start + region.own] = config[region.vertices]
+            barrier = multiprocessing.Barrier(self.processes)
+            workers = [multiprocessing.Process(target=_worker,
+                                               args=(i, region, shm.name, layout, barrier))
+                       for i, region in enumerate(self.__regions)]
+            for worker in workers:
+                worker.start()
+            failed = False
+            for worker in workers:
+                # If one worker dies, the others would wait for it at the
+                # barrier forever.
+                while worker.is_alive():
+                    worker.join(0.1)
+                    if not failed and any(w.exitcode for w in workers):
+                        failed = True
+                        barrier.abort()
+            if failed or any(worker.exitcode for worker in workers):
+                raise RuntimeError("a stabilization worker failed")
+            stable = np.empty(self.num_vertices, dtype=np.int64)
+            for region in self.__regions:
+                stable[region.vertices] = block[region.start:region.start + region.own]
+            odometer = block[self.__size:self.__size + self.num_vertices].copy()
+            del block
+        finally:
+            shm.close()
+            shm.unlink()
+        return stable, odometer
@@ -0,0 +1,173 @@
+r"""
+Random Sand
+
+Reproducible random sand, generated locally for many trials at once.
+
+``SandpileRemote.add_random_sand()`` lets the program choose where the
+grains go, so runs cannot be repeated, and every trial is a round trip. A
+RandomSand instead draws the placements with a seeded NumPy generator: the
+number of grains landing on each non-sink vertex is multinomial, either
+uniform or in proportion to given vertex weights, and a whole batch of
+trials is drawn by NumPy at once. The configurations can be sent with
+``add_config()`` or stabilized locally with
+``SandpileEngine.stabilize_many()``.
+
+EXAMPLES:
+
+    >>> sand = RandomSand.from_remote(srem, seed=1)
+    >>> configs = sand.batch(100, 1000, base=srem.get_config())
+    >>> stable, firings = srem.get_engine().stabilize_many(configs)
+    >>> sand.add_to(srem, 100)
+"""
+
+import numpy as np
+
+
+class RandomSand:
+    r"""
+    A seeded source of random sand for one graph.
+
+    num_vertices - The number of vertices.
+
+    nonsinks - The vertices that can receive sand.
+
+    probabilities - The chance of each grain landing on each of nonsinks.
+
+    seed - The seed the generator was created with.
+    """
+
+    def __init__(self, degrees, weights=None, seed=None):
+        r"""
+        Sets up random sand for a graph.
+
+        INPUT:
+
+        - ``degrees`` - The out-degree of each vertex, as in
+          ``SandpileEngine.degrees``; vertices of degree 0 are sinks and get
+          no sand.
+
+        - ``weights`` (optional) - Nonnegative numbers, one per vertex,
+          giving how likely a grain is to land on each vertex; weights of
+          sinks are ignored. Default is the same for every non-sink.
+
+        - ``seed`` (optional) - A seed for ``numpy.random.default_rng``.
+          The same seed and calls give the same sand. Default is a fresh
+          random seed.
+
+        OUTPUT:
+
+        RandomSand; raises ValueError if there are no non-sinks or the
+          weights of the non-sinks are all 0.
+
+        EXAMPLES::
+
+            >>> sand = RandomSand([1, 2, 0], seed=1)
+            >>> sand.sample(10)
+                array([5, 5, 0])
+        """
+        degrees = np.asarray(degrees)
+        self.num_vertices = len(degrees)
+        self.nonsinks = np.flatnonzero(degrees > 0)
+        if not len(self.nonsinks):
+            raise ValueError("there are no non-sink vertices")
+        uniform = weights is None
+        if uniform:
+            weights = np.ones(len(self.nonsinks))
+        else:
+            weights = np.asarray(weights, dtype=float)
+            if weights.shape != (self.num_vertices,):
+                raise ValueError("expected %d weights, got %d"
+                                 % (self.num_vertices, weights.size))
+            weights = weights[self.nonsinks]
+            if (weights < 0).any() or not weights.sum() > 0:
+                raise ValueError("weights must be nonnegative and not all 0")
+        self.probabilities = weights / weights.sum()
+        # None lets numpy draw uniformly without a search.
+        self.__p = None if uniform else self.probabilities
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_remote(cls, srem, weights=None, seed=None):
+        r"""
+        Sets up random sand for the graph currently in the program.
+
+        INPUT:
+
+        - ``srem`` - A connected SandpileRemote.
+
+        - ``weights``, ``seed`` (optional) - As for RandomSand().
+
+        OUTPUT:
+
+        RandomSand
+        """
+        return cls(srem.get_engine().degrees, weights, seed)
+
+    def batch(self, amount, trials, base=None):
+        r"""
+        Returns random sand for many trials.
+
+        INPUT:
+
+        - ``amount`` - int, or an int per trial; the number of grains to
+          add in each trial. Negative amounts add nothing, as with
+          ``add_random_sand()``.
+
+        - ``trials`` - int; the number of trials.
+
+        - ``base`` (optional) - A configuration to add the sand to. Default
+          is all zeros.
+
+        OUTPUT:
+
+        A (trials, N) int64 array with one configuration per row, ready for
+          ``SandpileEngine.stabilize_many()``.
+
+        EXAMPLES::
+
+            >>> sand.batch(10, 2)
+                array([[8, 2, 0],
+                       [3, 7, 0]])
+        """
+        amount = np.maximum(np.broadcast_to(np.asarray(amount, dtype=np.int64), (trials,)), 0)
+        configs = np.zeros((trials, self.num_vertices), dtype=np.int64)
+        count = len(self.nonsinks)
+        if amount.sum() < trials * count:
+            # Fewer grains than vertices: drawing where each grain goes and
+            # counting is cheaper than a multinomial draw over every vertex,
+            # and gives the same distribution.
+            places = self.rng.choice(count, size=amount.sum(), p=self.__p)
+            places += np.repeat(np.arange(trials) * count, amount)
+            counts = np.bincount(places, minlength=trials * count)
+            configs[:, self.nonsinks] = counts.reshape(trials, count)
+        else:
+            configs[:, self.nonsinks] = self.rng.multinomial(amount, self.probabilities)
+        if base is not None:
+            configs += np.asarray(base, dtype=np.int64)
+        return configs
+
+    def sample(self, amount):
+        r"""
+        Returns one configuration of ``amount`` random grains.
+        """
+        return self.batch(amount, 1)[0]
+
+    def add_to(self, srem, amount):
+        r"""
+        Adds ``amount`` random grains to the program's configuration, like
+        ``add_random_sand()`` but reproducibly.
+
+        INPUT:
+
+        - ``srem`` - A connected SandpileRemote for the same graph.
+
+        - ``amount`` - int; the number of grains.
+
+        OUTPUT:
+
+        The configuration that was added, as an array.
+        """
+        config = self.sample(amount)
+        srem.add_config(config.tolist())
+        return config
@@ -0,0 +1,252 @@
+r"""
+Resilient Remote
+
+A SandpileRemote that survives dropped connections.
+
+Every command that changes the graph or configuration is written, in order,
+to a client-side journal. If the connection fails, ResilientRemote reconnects
+with exponential backoff, rebuilds the graph and configuration in the
+program from the journal, and then resends the commands that were waiting
+for a reply. Because the graph is rebuilt in the same order, vertex indices
+are unchanged, so a SageRemote built on top keeps a valid label mapping.
+
+To keep replays short, the configuration commands in the journal are
+replaced by a single ``set_config`` every ``checkpoint_interval`` commands.
+``add_random_sand`` cannot be replayed, so the checkpoint is taken as soon
+as it is answered; only a drop before that checkpoint's reply replays it
+with different sand. Commands that reset the configuration, such as
+``set_config`` or ``set_to_max_stable``, drop the configuration commands
+before them.
+
+A command that times out (see RemoteTimeout) is not resent, since the
+program may still be working on it. It is left out of the journal, and the
+next command reconnects and restores the graph and configuration from
+before it.
+
+EXAMPLES:
+
+    >>> srem = ResilientRemote()
+    >>> srem.connect()
+    >>> srem.add_vertices([[0.0, 0.0], [5.0, 5.0]])
+    >>> srem.set_config([3, 4])
+
+Now restart the program and turn the server back on:
+
+    >>> srem.get_config()
+        [3, 4]
+    >>> srem.reconnects
+        1
+"""
+
+import time
+from collections import deque
+from socket import error as socket_error
+
+from SandpileRemote import SandpileRemote, CommandError, RemoteTimeout
+
+# Commands that build the graph.
+GRAPH_COMMANDS = set(["add_vertex", "add_vertices", "add_edge", "add_edges"])
+
+# Commands that replace the configuration with one that only depends on
+# the graph.
+CONFIG_RESETS = set(["set_config", "clear_sand", "set_to_max_stable",
+                     "set_to_identity", "set_to_burning", "set_to_dual"])
+
+# Commands that change the configuration deterministically.
+CONFIG_COMMANDS = set(["set_sand", "add_sand", "add_config", "update",
+                       "stabilize", "add_max_stable", "add_identity",
+                       "add_burning", "add_dual"])
+
+
+class ResilientRemote(SandpileRemote):
+    r"""
+    A SandpileRemote that reconnects and replays its journal when the
+    connection to the program drops. In addition to the fields of
+    SandpileRemote:
+
+    max_retries - The number of reconnection attempts before giving up
+    and raising the connection error. Default is 8.
+
+    backoff - Seconds to wait before the first reconnection attempt; the
+    wait doubles with each attempt up to max_backoff. Default is 0.5.
+
+    max_backoff - The longest wait between attempts. Default is 30.
+
+    checkpoint_interval - The number of configuration commands after which
+    the journal fetches the configuration and starts over from it. Default
+    is 1000.
+
+    reconnects - The number of times the connection has been restored.
+
+    journal - The commands that are replayed after reconnecting.
+    """
+
+    def __init__(self):
+        r"""
+        Create an object to access the Sandpile program remotely that
+        reconnects automatically.
+
+        INPUT:
+
+        None
+
+        OUTPUT:
+
+        ResilientRemote
+
+        EXAMPLES:
+
+        >>> srem = ResilientRemote()
+        """
+        SandpileRemote.__init__(self)
+        self.max_retries = 8
+        self.backoff = 0.5
+        self.max_backoff = 30.0
+        self.checkpoint_interval = 1000
+        self.reconnects = 0
+        self.journal = []
+        self.__config_entries = 0
+        self.__outstanding = deque()
+        self.__needs_checkpoint = False
+        self.__timed_out = False
+        self.__address = None
+
+    def connect(self, host="localhost", port=7236, timeout=None,
+                compression=None, compress_threshold=1024, compress_level=1,
+                negotiate_timeout=2.0):
+        r"""
+        Connects to the Sandpile program; see SandpileRemote.connect. The
+        address is remembered for reconnecting. The journal starts empty,
+        so the program's current graph is not known to it: build the graph
+        through this object (or call delete_graph first) for it to be
+        restored after a failure.
+        """
+        self.__address = (host, port, timeout, compression,
+                          compress_threshold, compress_level, negotiate_timeout)
+        self.__outstanding.clear()
+        self.__timed_out = False
+        SandpileRemote.connect(self, *self.__address)
+
+    def send(self, msg):
+        if self.__timed_out:
+            self.__timed_out = False
+            self.__recover()
+        if self.__needs_checkpoint and not self.__outstanding:
+            self.__needs_checkpoint = False
+            self.checkpoint()
+        self.__outstanding.append(msg)
+        try:
+            SandpileRemote.send(self, msg)
+        except socket_error:
+            self.__recover()
+
+    def receive(self, timeout=None):
+        while True:
+            try:
+                reply = SandpileRemote.receive(self, timeout)
+                break
+            except socket_error:
+                self.__recover()
+            except RemoteTimeout:
+                # The connection is closed and the replies to everything
+                # outstanding are lost; none of it is resent.
+                self.__outstanding.clear()
+                self.__timed_out = True
+                raise
+        if self.__outstanding:
+            self.__record(self.__outstanding.popleft(), reply)
+        if self.__needs_checkpoint and not self.__outstanding:
+            self.__needs_checkpoint = False
+            self.checkpoint()
+        return reply
+
+    def pipeline(self, msgs):
+        r"""
+        Sends the messages one at a time and returns the replies; see
+        SandpileRemote.pipeline. Messages are not overlapped here, so that
+        reconnecting never races with a sending thread.
+        """
+        replies = []
+        for msg in msgs:
+            self.send(msg)
+            replies.append(self.receive())
+        return replies
+
+    def __record(self, msg, reply):
+        if reply != "done\n":
+            return
+        command = msg.split(" ", 1)[0]
+        if command == "delete_graph":
+            self.journal = []
+            self.__config_entries = 0
+        elif command in GRAPH_COMMANDS:
+            self.journal.append(msg)
+        elif command in CONFIG_RESETS:
+            self.__reset_config(msg)
+        elif command in CONFIG_COMMANDS or command == "add_random_sand":
+            self.journal.append(msg)
+            self.__config_entries += 1
+            if (command == "add_random_sand"
+                    or self.__config_entries > self.checkpoint_interval):
+                # Taken once no other reply is outstanding.
+                self.__needs_checkpoint = True
+
+    def __reset_config(self, msg):
+        # Everything before a reset only matters for the graph.
+        self.journal = [m for m in self.journal
+                        if m.split(" ", 1)[0] in GRAPH_COMMANDS]
+        self.journal.append(msg)
+        self.__config_entries = 0
+
+    def checkpoint(self):
+        r"""
+        Fetches the configuration and makes it the starting point of the
+        journal, so that a replay is a single set_config.
+
+        INPUT:
+
+        None
+
+        OUTPUT:
+
+        None
+
+        EXAMPLES::
+
+            >>> srem.checkpoint()
+        """
+        config = self.get_config()
+        if config:
+            self.__reset_config("set_config " + self.format_seq(config))
+
+    def __recover(self):
+        if self.__address is None:
+            raise socket_error("not connected")
+        delay = self.backoff
+        attempt = 0
+        while True:
+            try:
+                self.close()
+            except socket_error:
+                pass
+            try:
+                SandpileRemote.connect(self, *self.__address)
+                self.__replay()
+                for msg in self.__outstanding:
+                    SandpileRemote.send(self, msg)
+                self.reconnects += 1
+                return
+            except socket_error:
+                attempt += 1
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(delay)
+                delay = min(2 * delay, self.max_backoff)
+
+    def __replay(self):
+        for msg in ["delete_graph"] + self.journal:
+            SandpileRemote.send(self, msg)
+            reply = SandpileRemote.receive(self)
+            if reply != "done\n":
+                raise CommandError("replaying %r failed: %s"
+                                   % (msg.split(" ", 1)[0], reply))
@@ -1,9 +1,28 @@
 from SandpileRemote import *
+from ResilientRemote import ResilientRemote
 
 class SageRemote:
 
-    def __init__(self):
-        self.srem = SandpileRemote()
+    def __init__(self, resilient=False):
+        r"""
+        Create an object to access the Sandpile program remotely with
+        Sage graphs.
+
+        INPUT:
+
+        - ``resilient`` (optional) - If True, use a ResilientRemote, which
+          reconnects and restores the graph and configuration if the
+          connection drops. The vertex labels stay valid since the graph
+          is rebuilt in the same order. Default is False.
+
+        OUTPUT:
+
+        SageRemote
+        """
+        if resilient:
+            self.srem = ResilientRemote()
+        else:
+            self.srem = SandpileRemote()
         self.labels_to_indices = dict()
         self.indices_to_labels = list()
 
@@ -50,6 +69,43 @@ class SageRemote:
         """
         self.srem.update()
 
+    def apply_firing_vector(self, vector):
+        r"""
+        Fires each vertex the number of times given by a dict from labels
+        to ints, sending only the vertices that change; see
+        SandpileRemote.apply_firing_vector.
+
+        INPUT:
+
+        ``vector`` - A dict from vertex labels to ints.
+
+        OUTPUT:
+
+        int; the number of vertices that changed.
+        """
+        indexed = [0] * len(self.indices_to_labels)
+        for v in vector:
+            indexed[self.labels_to_indices[v]] = vector[v]
+        return self.srem.apply_firing_vector(indexed)
+
+    def fire_vertices(self, verts, legal=False):
+        r"""
+        Fires each of a set of vertices once; see
+        SandpileRemote.fire_vertices.
+
+        INPUT:
+
+        ``verts`` - A list of vertex labels.
+
+        ``legal`` (optional) - If True, raise ValueError unless firing the
+          set is legal. Default is False.
+
+        OUTPUT:
+
+        int; the number of vertices that changed.
+        """
+        return self.srem.fire_vertices([self.labels_to_indices[v] for v in verts], legal)
+
     def stabilize(self):
         r"""
         Tells the program to stabilize the current configuration.
@@ -0,0 +1,393 @@
+r"""
+Sandpile Group
+
+Arithmetic in the sandpile group of the program's graph, computed locally.
+
+The recurrent configurations form a group under "add, then stabilize".
+Instead of sending ``set_config``, ``add_config``, ``stabilize`` and
+``get_config`` to the program for every operation, a SandpileGroup does the
+arithmetic with the remote's SandpileEngine (see
+``SandpileRemote.get_engine``) and remembers recent sums in an LRU memo
+keyed by a hash of the two configurations. Powers are computed by repeated
+squaring, so ``power(a, n)`` takes about ``2 log2(n)`` stabilizations, and
+orders are computed exactly from the Laplacian without stabilizing at all.
+
+Configurations are lists indexed by vertex, as from ``get_config()``, or
+dicts keyed by label for a SageRemote. Values on sinks are ignored and
+returned as 0 (left out for a SageRemote).
+
+EXAMPLES:
+
+    >>> group = SandpileGroup(srem)
+    >>> a = group.identity()
+    >>> b = srem.get_config()
+    >>> group.is_recurrent(b)
+        True
+    >>> group.add(a, b) == b
+        True
+    >>> group.order(b)
+        1120
+    >>> group.power(b, 1120) == group.identity()
+        True
+"""
+
+import hashlib
+import math
+from collections import OrderedDict
+from fractions import Fraction
+
+import numpy as np
+
+# Primes below 2**25, so that the product of two residues fits in an int64.
+_PRIMES = (33554393, 33554383, 33554371, 33554341, 33554317)
+
+# Residues are split at this many bits for products with long sums; see
+# _dot_mod().
+_LIMB_BITS = 12
+
+
+def _dot_mod(matrix, vector, p):
+    # Returns matrix * vector modulo p for residues below 2**25. A sum of n
+    # full products would overflow an int64 once n passes 2**13, so the
+    # vector is split into limbs of 12 and 13 bits, whose products with a
+    # residue are below 2**38 and can be summed over 2**25 rows.
+    low = vector & ((1 << _LIMB_BITS) - 1)
+    high = vector >> _LIMB_BITS
+    return ((matrix.dot(high) % p << _LIMB_BITS) + matrix.dot(low)) % p
+
+
+def _eliminate(work, rows, col, p):
+    # Clears column col from the given rows using the (normalized) row col.
+    if len(rows):
+        work[rows] -= np.outer(work[rows, col], work[col]) % p
+        work[rows] %= p
+
+
+def inverse_mod(matrix, p):
+    r"""
+    Returns the inverse of a square integer matrix modulo a prime below
+    2**25, or None if it is singular modulo p.
+
+    INPUT:
+
+    - ``matrix`` - An int64 NumPy array.
+
+    - ``p`` - int; the prime.
+
+    OUTPUT:
+
+    An int64 array of residues.
+
+    NOTES:
+
+    Laplacians are sparse and mostly banded, so rows are eliminated below
+      the diagonal first and then above it from the last column back, which
+      keeps each step to the few rows within the band.
+    """
+    n = len(matrix)
+    work = np.concatenate((matrix % p, np.eye(n, dtype=np.int64)), axis=1)
+    for col in range(n):
+        rows = np.flatnonzero(work[col:, col]) + col
+        if not len(rows):
+            return None
+        if rows[0] != col:
+            work[[col, rows[0]]] = work[[rows[0], col]]
+        work[col] = work[col] * pow(int(work[col, col]), p - 2, p) % p
+        _eliminate(work, rows[1:], col, p)
+    for col in range(n - 1, 0, -1):
+        _eliminate(work, np.flatnonzero(work[:col, col]), col, p)
+    return work[:, n:]
+
+
+def _rational_solve(matrix, b):
+    r"""
+    Solves ``matrix * x = b`` exactly for a nonsingular integer matrix, by
+    Dixon's p-adic lifting.
+
+    OUTPUT:
+
+    A list of Fractions; raises ValueError if the matrix is singular or
+      the lifted solution fails the exact check.
+    """
+    n = len(matrix)
+    if n == 0:
+        return []
+    for p in _PRIMES:
+        inverse = inverse_mod(matrix, p)
+        if inverse is not None:
+            break
+    else:
+        raise ValueError("the matrix is singular")
+    # By Hadamard's bound H and Cramer's rule the denominators are at most
+    # H and the numerators at most H |b|, so 2 log2(H |b|) + 1 bits of
+    # p-adic digits determine the answer. H is taken over both the rows and
+    # the columns, as the columns bound the numerators. The answer is
+    # checked exactly all the same.
+    squares = matrix.astype(float) ** 2
+    log_hadamard = max(np.log2(np.maximum(np.sqrt(squares.sum(axis=axis)), 1)).sum()
+                       for axis in (0, 1))
+    log_b = math.log2(max(float(np.sqrt((b.astype(float) ** 2).sum())), 1))
+    digits = int((2 * (log_hadamard + log_b) + 2) / math.log2(p)) + 1
+    rows, cols = np.nonzero(matrix)
+    entries = matrix[rows, cols].astype(object)
+    target = b.astype(object)
+    residual = b.astype(np.int64)
+    solution = [0] * n
+    power = 1
+    for i in range(digits):
+        digit = _dot_mod(inverse, residual % p, p)
+        residual = (residual - matrix.dot(digit)) // p
+        for j, d in enumerate(digit.tolist()):
+            solution[j] += d * power
+        power *= p
+    denominator = 1
+    result = []
+    for value in solution:
+        # Scaling by the denominators found so far keeps the fractions to
+        # reconstruct small.
+        fraction = rational_reconstruct(value * denominator % power, power)
+        result.append(fraction / denominator)
+        denominator *= fraction.denominator
+    numerators = np.array([int(x * denominator) for x in result], dtype=object)
+    product = np.zeros(n, dtype=object)
+    np.add.at(product, rows, entries * numerators[cols])
+    if not (product == target * denominator).all():
+        # More digits cannot help past the bound, so the lifting itself
+        # went wrong, e.g. the residuals overflowed for huge entries.
+        raise ValueError("no solution within the Hadamard bound of %d digits" % digits)
+    return [Fraction(int(x), denominator) for x in numerators]
+
+
+def rational_reconstruct(value, modulus):
+    r"""
+    Returns the fraction ``r / s`` with ``|r|`` and ``s`` below
+    ``sqrt(modulus / 2)`` that is congruent to ``value`` modulo ``modulus``,
+    by the extended Euclidean algorithm. If there is none, the result is
+    some other fraction, so callers must check it.
+    """
+    bound = math.isqrt(modulus // 2)
+    r0, r1 = modulus, value % modulus
+    s0, s1 = 0, 1
+    while r1 > bound:
+        q = r0 // r1
+        r0, r1 = r1, r0 - q * r1
+        s0, s1 = s1, s0 - q * s1
+    return Fraction(r1, s1)
+
+
+class SandpileGroup:
+    r"""
+    The sandpile group of a remote's graph. In addition to the methods:
+
+    engine - The SandpileEngine used for stabilizing.
+
+    hits, misses - Counts of sums found in and missing from the memo.
+    """
+
+    def __init__(self, remote, cache_size=1024):
+        r"""
+        Binds a group to the program's current graph.
+
+        INPUT:
+
+        - ``remote`` - A connected SandpileRemote or SageRemote. The graph
+          is read once; make a new SandpileGroup after changing it.
+
+        - ``cache_size`` (optional) - int; the number of sums, and of
+          orders, to remember. Default is 1024.
+
+        OUTPUT:
+
+        SandpileGroup
+
+        EXAMPLES::
+
+            >>> group = SandpileGroup(srem)
+        """
+        self.remote = remote
+        self.labelled = hasattr(remote, "labels_to_indices")
+        srem = remote.srem if self.labelled else remote
+        self.engine = srem.get_engine()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.__memo = OrderedDict()
+        self.__nonsinks = np.flatnonzero(self.engine.degrees > 0)
+        self.__zero = None
+        self.__order_denominators = OrderedDict()
+
+    # Conversions between the caller's configurations and arrays.
+
+    def __array(self, config):
+        if self.labelled:
+            indexed = np.zeros(self.engine.num_vertices, dtype=np.int64)
+            sink = getattr(self.remote, "sink_label", None)
+            for label, amount in config.items():
+                if label != sink:
+                    indexed[self.remote.labels_to_indices[label]] = amount
+            config = indexed
+        config = np.array(config, dtype=np.int64)
+        if config.shape != (self.engine.num_vertices,):
+            raise ValueError("expected %d values, got %d"
+                             % (self.engine.num_vertices, config.size))
+        config[self.engine.degrees == 0] = 0
+        return config
+
+    def __export(self, config):
+        if self.labelled:
+            labels = self.remote.indices_to_labels
+            return dict((labels[v], int(config[v])) for v in self.__nonsinks)
+        return config.tolist()
+
+    @staticmethod
+    def __key(config):
+        return hashlib.blake2b(config.tobytes(), digest_size=16).digest()
+
+    # Arithmetic on arrays.
+
+    def __stabilize(self, config):
+        stable, odometer = self.engine.stabilize(config)
+        stable[self.engine.degrees == 0] = 0
+        return stable
+
+    def __add(self, a, b):
+        key = tuple(sorted((self.__key(a), self.__key(b))))
+        if key in self.__memo:
+            self.hits += 1
+            self.__memo.move_to_end(key)
+            return self.__memo[key]
+        self.misses += 1
+        total = self.__stabilize(a + b)
+        self.__memo[key] = total
+        if len(self.__memo) > self.cache_size:
+            self.__memo.popitem(last=False)
+        return total
+
+    def __power(self, a, n):
+        if n < 0:
+            a, n = self.__inverse(a), -n
+        result = self.engine.identity()
+        while n:
+            if n & 1:
+                result = self.__add(result, a)
+            n >>= 1
+            if n:
+                a = self.__add(a, a)
+        return result
+
+    def __inverse(self, a):
+        # 2m - stab(2m) is equivalent to 0 and at least m, so adding twice
+        # it to the inverse of a gives a recurrent configuration.
+        if self.__zero is None:
+            double = 2 * self.engine.max_stable()
+            self.__zero = double - self.__stabilize(double)
+        return self.__stabilize(2 * self.__zero - a)
+
+    # The public methods take and return the caller's configurations.
+
+    def identity(self):
+        r"""
+        Returns the identity of the group; see SandpileEngine.identity().
+        """
+        return self.__export(self.engine.identity())
+
+    def add(self, a, b):
+        r"""
+        Returns the stabilization of ``a + b``, which is their sum in the
+        group when both are recurrent.
+
+        EXAMPLES::
+
+            >>> group.add(a, group.inverse(a)) == group.identity()
+                True
+        """
+        return self.__export(self.__add(self.__array(a), self.__array(b)))
+
+    def inverse(self, a):
+        r"""
+        Returns the inverse of a recurrent configuration.
+        """
+        return self.__export(self.__inverse(self.__array(a)))
+
+    def power(self, a, n):
+        r"""
+        Returns ``a`` added to itself ``n`` times (the inverse for negative
+        ``n``, the identity for 0), by repeated squaring.
+
+        INPUT:
+
+        - ``a`` - A recurrent configuration.
+
+        - ``n`` - int.
+
+        OUTPUT:
+
+        A recurrent configuration.
+
+        EXAMPLES::
+
+            >>> group.power(a, 10**12)
+        """
+        return self.__export(self.__power(self.__array(a), n))
+
+    def order(self, a):
+        r"""
+        Returns the order of a configuration in the group: the least
+        ``n > 0`` such that ``n * a`` is equivalent to 0, meaning it equals
+        ``L * x`` for an integer firing vector ``x``.
+
+        INPUT:
+
+        - ``a`` - A configuration.
+
+        OUTPUT:
+
+        int
+
+        NOTES:
+
+        This solves ``L x = a`` exactly on the non-sinks with rational
+          numbers, and the order is the least common denominator of ``x``.
+          It costs a dense elimination on the Laplacian, so is for graphs
+          of up to a few thousand vertices.
+
+        EXAMPLES::
+
+            >>> group.order(group.identity())
+                1
+        """
+        a = self.__array(a)
+        key = self.__key(a)
+        if key in self.__order_denominators:
+            self.__order_denominators.move_to_end(key)
+            return self.__order_denominators[key]
+        nonsinks = self.__nonsinks
+        lap = self.engine.laplacian()[nonsinks][:, nonsinks].toarray()
+        x = _rational_solve(lap, a[nonsinks])
+        order = 1
+        for value in x:
+            order = order * value.denominator // math.gcd(order, value.denominator)
+        self.__order_denominators[key] = order
+        if len(self.__order_denominators) > self.cache_size:
+            self.__order_denominators.popitem(last=False)
+        return order
+
+    def is_recurrent(self, a):
+        r"""
+        Checks whether a configuration is recurrent, by the burning
+        algorithm; see SandpileEngine.burn().
+
+        INPUT:
+
+        - ``a`` - A configuration.
+
+        OUTPUT:
+
+        bool
+
+        EXAMPLES::
+
+            >>> group.is_recurrent(srem.get_max_stable())
+                True
+        """
+        return self.engine.is_recurrent(self.__array(a))
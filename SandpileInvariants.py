@@ -0,0 +1,602 @@
+r"""
+Sandpile Invariants
+
+The order and structure of the sandpile group, computed exactly.
+
+The sandpile group is the cokernel of the reduced Laplacian (the Laplacian
+without the rows and columns of the sinks), so its order is the
+determinant of that matrix, which is also the number of spanning trees
+directed into the sinks, and its structure is given by the invariant
+factors of its Smith normal form. They are computed in these steps:
+
+1. Sparse elimination on unit entries. A pivot of +1 or -1 can remove its
+   row and column without changing the cokernel, and a Laplacian has many
+   such entries. The rows are swept in breadth-first order from a vertex
+   at the edge of the graph, each pivoting on its unit entry furthest
+   ahead, which keeps the fill-in to a moving front; then any unit entries
+   left are taken by least Markowitz cost (the product of the numbers of
+   other entries in the pivot's row and column). On an n x n grid this
+   leaves a dense matrix A of n rows.
+
+2. The determinant D of A, modulo many primes with NumPy, combined by the
+   Chinese remainder theorem. The reduced Laplacian is an M-matrix, so D
+   is at most the product of its diagonal, which says how many primes.
+
+3. The subgroup generated by a few random configurations ``b``, from the
+   denominators of ``A^-1 b`` found by p-adic lifting. For each prime
+   whose whole power in D divides the subgroup's order, the subgroup is
+   the whole part of the group for that prime. This is almost always so
+   for large primes, where the group has few generators for them.
+
+4. The Smith normal form of A for the primes left: modulo the power of
+   each small prime that divides D, and modulo the product of any large
+   ones. Working modulo these keeps the numbers small.
+
+Results are cached by a hash of the graph, so asking again about the same
+graph (from any remote or engine) is free.
+
+EXAMPLES:
+
+    >>> invariants = SandpileInvariants.from_remote(srem)
+    >>> invariants.order
+        557568000
+    >>> invariants.factors
+        [8, 8, 1320, 6600]
+"""
+
+import hashlib
+import heapq
+import math
+
+import numpy as np
+
+from SandpileEngine import SandpileEngine
+from SandpileGroup import inverse_mod, rational_reconstruct
+
+# Primes below 2**25 for the determinant, so that products of two residues
+# fit in an int64.
+_PRIME_LIMIT = 2 ** 25
+
+# Primes below this are split off D and handled one at a time in step 4.
+_SMALL_PRIME_LIMIT = 2 ** 16
+
+# How many matrices of residues step 2 works on at once, in entries.
+_STACK = 2 ** 22
+
+# Entries of A are split into limbs of this many bits for NumPy.
+_LIMB = 24
+
+# The number of random configurations in step 3, and their seed.
+_COLUMNS = 3
+_SEED = 0
+
+# Results by graph hash; see SandpileInvariants.
+_cache = dict()
+
+
+def graph_hash(engine):
+    r"""
+    Returns a hex digest identifying the graph of a SandpileEngine. Graphs
+    with the same vertices, (merged) edges and degrees have the same hash;
+    the degrees differ from the edge weights for quotient engines (see
+    ``SandpileEngine.from_csr``).
+    """
+    digest = hashlib.sha256()
+    for array in (engine.indptr, engine.indices, engine.weights, engine.degrees):
+        digest.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def _primes_to(limit):
+    # The primes below limit, by the sieve of Eratosthenes.
+    sieve = np.ones(limit, dtype=bool)
+    sieve[:2] = False
+    for i in range(2, math.isqrt(limit) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = False
+    return np.flatnonzero(sieve).tolist()
+
+
+def _large_primes(count):
+    # The largest count primes below _PRIME_LIMIT, by sieving a window
+    # below it.
+    divisors = _primes_to(math.isqrt(_PRIME_LIMIT) + 1)
+    span = 32 * count + 1024
+    while True:
+        low = _PRIME_LIMIT - span
+        sieve = np.ones(span, dtype=bool)
+        for q in divisors:
+            sieve[-low % q::q] = False
+        primes = (low + np.flatnonzero(sieve))[::-1].tolist()
+        if len(primes) >= count:
+            return primes[:count]
+        span *= 2
+
+
+def _bfs(neighbours, start):
+    # The vertices reachable from start in breadth-first order.
+    order = [start]
+    seen = set(order)
+    for v in order:
+        for w in neighbours[v]:
+            if w not in seen:
+                seen.add(w)
+                order.append(w)
+    return order
+
+
+def _sweep_order(rows):
+    # Positions for the vertices in a breadth-first order (ignoring edge
+    # directions) from a vertex far from the others, per component.
+    neighbours = dict((r, set()) for r in rows)
+    for r, row in rows.items():
+        for c in row:
+            if c != r:
+                neighbours[r].add(c)
+                neighbours[c].add(r)
+    position = dict()
+    for start in sorted(rows):
+        if start not in position:
+            for v in _bfs(neighbours, _bfs(neighbours, start)[-1]):
+                position[v] = len(position)
+    return position
+
+
+def _pivot(rows, cols, r, c):
+    # Uses the unit entry at (r, c) to clear column c from the other rows,
+    # then drops row r and column c. Returns the rows that changed.
+    row = rows.pop(r)
+    unit = row[c]
+    targets = [i for i in cols.pop(c) if i != r]
+    for i in targets:
+        other = rows[i]
+        factor = other[c] * unit
+        for j, value in row.items():
+            new = other.get(j, 0) - factor * value
+            if new:
+                if j not in other:
+                    cols[j].add(i)
+                other[j] = new
+            else:
+                del other[j]
+                if j != c:
+                    cols[j].discard(i)
+    for j in row:
+        if j != c:
+            cols[j].discard(r)
+    return targets
+
+
+def _unit_eliminate(rows):
+    # Eliminates unit pivots from a sparse matrix given as a dict of rows,
+    # each a dict of column to value, in place. Returns the rows and
+    # columns that are left.
+    cols = dict()
+    for r, row in rows.items():
+        for c in row:
+            cols.setdefault(c, set()).add(r)
+    # First sweep along a breadth-first order, pivoting each row on its
+    # unit entry furthest ahead. On a grid this moves a front of rows
+    # across it, like a transfer matrix, and leaves one row per vertex of
+    # the last front.
+    position = _sweep_order(rows)
+    for r in sorted(rows, key=position.get):
+        units = [c for c, value in rows[r].items() if value == 1 or value == -1]
+        if units:
+            _pivot(rows, cols, r, max(units, key=position.get))
+    # Then take any unit entries that are left, by least Markowitz cost.
+    heap = []
+
+    def push(r):
+        row = rows[r]
+        for c, value in row.items():
+            if value == 1 or value == -1:
+                heapq.heappush(heap, ((len(row) - 1) * (len(cols[c]) - 1), r, c))
+
+    for r in rows:
+        push(r)
+    while heap:
+        cost, r, c = heapq.heappop(heap)
+        row = rows.get(r)
+        if row is None or row.get(c) not in (1, -1):
+            continue
+        current = (len(row) - 1) * (len(cols[c]) - 1)
+        if current > cost:
+            heapq.heappush(heap, (current, r, c))
+            continue
+        for i in _pivot(rows, cols, r, c):
+            push(i)
+    return sorted(rows), sorted(cols)
+
+
+class _Dense:
+    # A dense square matrix of Python ints, also kept as signed limbs
+    # (A = sum of limbs[j] << (_LIMB * j)) so that NumPy can reduce it
+    # modulo a number and multiply it by small vectors exactly.
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.size = len(rows)
+        width = max([abs(x).bit_length() for row in rows for x in row] + [1])
+        count = (width + _LIMB - 1) // _LIMB
+        mask = (1 << _LIMB) - 1
+        self.limbs = np.array([[[(abs(x) >> (_LIMB * j) & mask) * (1 if x >= 0 else -1)
+                                 for x in row] for row in rows] for j in range(count)],
+                              dtype=np.int64).reshape(count, self.size, self.size)
+
+    def residues(self, m):
+        # A modulo m < 2**31, as an int64 array.
+        result = np.zeros((self.size, self.size), dtype=np.int64)
+        for j, limb in enumerate(self.limbs):
+            result = (result + limb % m * pow(2, _LIMB * j, m)) % m
+        return result
+
+    def reduce(self, m):
+        # A modulo any m, as an array NumPy can do exact arithmetic on.
+        if m < 2 ** 31:
+            return self.residues(m)
+        return np.array([[x % m for x in row] for row in self.rows], dtype=object)
+
+    def dot(self, matrix):
+        # A times an (N, r) int64 matrix with entries below 2**25, as rows
+        # of Python ints.
+        parts = self.limbs.dot(matrix).tolist()
+        return [[sum(part[i][c] << (_LIMB * j) for j, part in enumerate(parts))
+                 for c in range(len(matrix[0]))] for i in range(self.size)]
+
+
+def _determinant(dense, bits):
+    # The absolute value of the determinant of A, given that it is below
+    # 2**bits, and a prime that does not divide it. The determinant modulo
+    # each prime is found by elimination on a stack of matrices of
+    # residues, one per prime.
+    n = dense.size
+    primes = _large_primes(int(bits / math.log2(_PRIME_LIMIT / 2)) + 2)
+    residues = []
+    size = max(_STACK // (n * n), 1)
+    for start in range(0, len(primes), size):
+        chunk = primes[start:start + size]
+        p = np.array(chunk, dtype=np.int64)
+        stack = np.arange(len(chunk))
+        work = np.stack([dense.residues(q) for q in chunk])
+        det = np.ones(len(chunk), dtype=np.int64)
+        for col in range(n):
+            first = (work[:, col:, col] != 0).argmax(axis=1) + col
+            swap = first != col
+            if swap.any():
+                rows = work[stack, first]
+                work[stack, first] = work[stack, col]
+                work[stack, col] = rows
+                det = np.where(swap, p - det, det)
+            pivot = work[:, col, col]
+            det = det * pivot % p
+            inverse = np.array([pow(x, -1, q) if x else 0
+                                for x, q in zip(pivot.tolist(), chunk)], dtype=np.int64)
+            factors = work[:, col + 1:, col] * inverse[:, None] % p[:, None]
+            work[:, col + 1:, col:] -= factors[:, :, None] * work[:, None, col, col:] % p[:, None, None]
+            work[:, col + 1:, col:] %= p[:, None, None]
+        residues.extend(det.tolist())
+    det, modulus = 0, 1
+    for p, residue in zip(primes, residues):
+        det += modulus * ((residue - det) * pow(modulus, -1, p) % p)
+        modulus *= p
+    if det > modulus // 2:
+        det -= modulus
+    good = next(p for p, residue in zip(primes, residues) if residue)
+    return abs(det), good
+
+
+def _solve(dense, p, columns):
+    # Solves A X = B for a random (N, columns) matrix B by Dixon's p-adic
+    # lifting, where p is a prime that does not divide det A. Returns the
+    # least common denominator d of X and the integer matrix d X. The
+    # number of p-adic digits needed is not known in advance, so X is
+    # reconstructed after 8, 16, 32, ... digits and checked exactly.
+    n = dense.size
+    inverse = inverse_mod(dense.residues(p), p)
+    b = np.random.default_rng(_SEED).integers(0, 2 ** 16, (n, columns)).tolist()
+    residual = [list(row) for row in b]
+    solution = [[0] * columns for i in range(n)]
+    power = 1
+    digits = 0
+    check = 8
+    while True:
+        digit = inverse.dot(np.array([[x % p for x in row] for row in residual],
+                                     dtype=np.int64)) % p
+        product = dense.dot(digit)
+        digit = digit.tolist()
+        for i in range(n):
+            residual[i] = [(x - y) // p for x, y in zip(residual[i], product[i])]
+            solution[i] = [x + d * power for x, d in zip(solution[i], digit[i])]
+        power *= p
+        digits += 1
+        if digits < check:
+            continue
+        check *= 2
+        bound = math.isqrt(power // 2)
+        denominator = 1
+        for row in solution:
+            for value in row:
+                # Scaling by the denominators found so far keeps the
+                # fractions to reconstruct small.
+                denominator *= rational_reconstruct(value * denominator % power, power).denominator
+                if denominator > bound:
+                    break
+            if denominator > bound:
+                break
+        if denominator > bound:
+            continue
+        numerators = [[(value * denominator + power // 2) % power - power // 2 for value in row]
+                      for row in solution]
+        if all(sum(a * x[c] for a, x in zip(row, numerators)) == denominator * b[i][c]
+               for i, row in enumerate(dense.rows) for c in range(columns)):
+            return denominator, numerators
+
+
+def _smith_local(dense, q, e):
+    # The invariant factors other than 1 of A modulo q**e for a prime q,
+    # each a power of q up to q**e. Modulo q**e an entry of least valuation
+    # divides all the others, so it is always a good pivot.
+    m = q ** e
+    a = dense.reduce(m)
+    n = len(a)
+    factors = []
+    power, valuation = 1, 0
+    for t in range(n):
+        rest = a[t:, t:]
+        while valuation < e:
+            found = np.argwhere(rest % (power * q) != 0)
+            if len(found):
+                break
+            power *= q
+            valuation += 1
+        if valuation == e:
+            factors.extend([m] * (n - t))
+            break
+        i, j = found[0] + t
+        a[[t, i]] = a[[i, t]]
+        a[:, [t, j]] = a[:, [j, t]]
+        inverse = pow(int(a[t, t] // power), -1, m)
+        column = (a[t + 1:, t] // power) * inverse % m
+        a[t + 1:, t:] = (a[t + 1:, t:] - np.outer(column, a[t, t:]) % m) % m
+        if power > 1:
+            factors.append(power)
+    return factors
+
+
+def _smith_diagonal(matrix, modulus):
+    # The diagonal of a Smith form of a (not necessarily square) matrix of
+    # Python ints, with all arithmetic modulo modulus, and each entry
+    # replaced by its gcd with the modulus.
+    a = [[x % modulus for x in row] for row in matrix]
+    rows, cols = len(a), len(a[0]) if a else 0
+    diagonal = []
+    for t in range(min(rows, cols)):
+        # Look for a pivot that is a unit modulo the modulus: clearing its
+        # column then also clears its row.
+        unit = None
+        for j in range(t, cols):
+            for i in range(t, rows):
+                if a[i][j] and math.gcd(a[i][j], modulus) == 1:
+                    unit = i, j
+                    break
+            if unit is not None:
+                break
+        if unit is not None:
+            i, j = unit
+            a[t], a[i] = a[i], a[t]
+            for row in a[t:]:
+                row[t], row[j] = row[j], row[t]
+            pivot = a[t]
+            inverse = pow(pivot[t], -1, modulus)
+            for i in range(t + 1, rows):
+                row = a[i]
+                if row[t]:
+                    factor = row[t] * inverse % modulus
+                    a[i] = row[:t + 1] + [(x - factor * y) % modulus
+                                         for x, y in zip(row[t + 1:], pivot[t + 1:])]
+                    a[i][t] = 0
+            diagonal.append(1)
+            continue
+        # Otherwise clear the row and column until the pivot divides
+        # everything in them. An entry the pivot divides is cleared by
+        # subtracting a multiple of the pivot's row or column; any other
+        # is combined with the pivot by extended gcds, which makes the
+        # pivot a proper divisor of itself, so this stops.
+        while True:
+            for i in range(t + 1, rows):
+                p, q = a[t][t], a[i][t]
+                if not q:
+                    continue
+                if p and q % p == 0:
+                    f = q // p
+                    a[i] = [(y - f * x) % modulus for x, y in zip(a[t], a[i])]
+                else:
+                    g, x, y = _extended_gcd(p, q)
+                    u, v = p // g, q // g
+                    a[t], a[i] = ([(x * p + y * q) % modulus for p, q in zip(a[t], a[i])],
+                                  [(v * p - u * q) % modulus for p, q in zip(a[t], a[i])])
+            changed = False
+            for j in range(t + 1, cols):
+                p, q = a[t][t], a[t][j]
+                if not q:
+                    continue
+                if p and q % p == 0:
+                    f = q // p
+                    for row in a[t:]:
+                        row[j] = (row[j] - f * row[t]) % modulus
+                else:
+                    changed = True
+                    g, x, y = _extended_gcd(p, q)
+                    u, v = p // g, q // g
+                    for row in a[t:]:
+                        p, q = row[t], row[j]
+                        row[t], row[j] = (x * p + y * q) % modulus, (v * p - u * q) % modulus
+            if not changed or not any(a[i][t] for i in range(t + 1, rows)):
+                break
+        diagonal.append(math.gcd(a[t][t], modulus))
+    return diagonal
+
+
+def _extended_gcd(a, b):
+    # Returns (g, x, y) with a x + b y = g = gcd(a, b).
+    x0, x1, y0, y1 = 1, 0, 0, 1
+    while b:
+        q = a // b
+        a, b = b, a - q * b
+        x0, x1 = x1, x0 - q * x1
+        y0, y1 = y1, y0 - q * y1
+    return a, x0, y0
+
+
+def _chain(orders):
+    # The invariant factors other than 1 of a product of cyclic groups of
+    # the given orders, each dividing the next.
+    orders = list(orders)
+    for i in range(len(orders)):
+        for j in range(i + 1, len(orders)):
+            g = math.gcd(orders[i], orders[j])
+            orders[i], orders[j] = g, orders[i] * orders[j] // g
+    return [d for d in orders if d != 1]
+
+
+def _part(value, primes):
+    # The largest divisor of value made of primes dividing primes.
+    part = 1
+    shared = math.gcd(value, primes)
+    while shared > 1:
+        value //= shared
+        part *= shared
+        shared = math.gcd(value, shared)
+    return part
+
+
+def _invariants(dense, bits):
+    # The order and invariant factors of the cokernel of A; see steps 2 to
+    # 4 above.
+    if dense.size == 0:
+        return 1, []
+    order, p = _determinant(dense, bits)
+    # The subgroup H generated by the columns of B is the image of d X
+    # modulo d, so its factors come from a small Smith form.
+    denominator, numerators = _solve(dense, p, _COLUMNS)
+    subgroup = _chain(denominator // y for y in _smith_diagonal(numerators, denominator))
+    rest = _part(order, order // math.prod(subgroup))
+    covered = order // rest
+    # Each part lists factors of orders coprime to the other parts, each
+    # dividing the next, so the invariant factors are their products from
+    # the largest down. The parts for the primes H misses are first
+    # computed modulo their share of d, which is usually the largest factor
+    # for them: it is exactly that when the factors found multiply to the
+    # whole share of the order.
+    parts = [[math.gcd(h, covered) for h in subgroup]]
+    for q in _primes_to(_SMALL_PRIME_LIMIT):
+        if rest == 1:
+            break
+        if rest % q == 0:
+            e = 0
+            while rest % q == 0:
+                rest //= q
+                e += 1
+            f = 1
+            while denominator % q ** (f + 1) == 0:
+                f += 1
+            part = _smith_local(dense, q, min(f, e))
+            if math.prod(part) != q ** e:
+                part = _smith_local(dense, q, e)
+            parts.append(part)
+    if rest > 1:
+        part = _chain(_smith_diagonal(dense.rows, math.gcd(denominator, rest)))
+        if math.prod(part) != rest:
+            part = _chain(_smith_diagonal(dense.rows, rest))
+        parts.append(part)
+    factors = []
+    for i in range(max(len(part) for part in parts)):
+        factors.append(math.prod(part[-1 - i] for part in parts if i < len(part)))
+    return order, [d for d in reversed(factors) if d != 1]
+
+
+class SandpileInvariants:
+    r"""
+    The order and invariant factors of the sandpile group of a graph.
+
+    order - The number of elements (recurrent configurations), which is
+    the number of spanning trees directed into the sinks.
+
+    factors - The invariant factors other than 1, each dividing the next:
+    the group is the product of the cyclic groups of these orders.
+
+    exponent - The largest order of an element; the last factor.
+
+    rank - The least number of generators; the number of factors.
+
+    hash - The graph hash the results are cached under.
+    """
+
+    def __init__(self, engine):
+        r"""
+        Computes (or looks up) the invariants of a graph.
+
+        INPUT:
+
+        - ``engine`` - A SandpileEngine for the graph.
+
+        OUTPUT:
+
+        SandpileInvariants; raises UnreachableSinkError if some vertex has
+          no path to a sink, since then the group is infinite.
+
+        EXAMPLES::
+
+            >>> positions, edges = grid_graph(3, 3)
+            >>> SandpileInvariants(SandpileEngine(len(positions), edges)).factors
+                [4, 112, 224]
+        """
+        self.hash = graph_hash(engine)
+        if self.hash not in _cache:
+            engine.check_sinks_reachable()
+            rows = dict()
+            bits = 1.0
+            for v in np.flatnonzero(engine.degrees > 0).tolist():
+                row = {v: int(engine.degrees[v])}
+                for i in range(engine.indptr[v], engine.indptr[v + 1]):
+                    w = int(engine.indices[i])
+                    if engine.degrees[w] > 0:
+                        row[w] = row.get(w, 0) - int(engine.weights[i])
+                rows[v] = dict((c, x) for c, x in row.items() if x)
+                bits += math.log2(rows[v][v])
+            left, cols = _unit_eliminate(rows)
+            dense = _Dense([[rows[r].get(c, 0) for c in cols] for r in left])
+            _cache[self.hash] = _invariants(dense, bits)
+        order, factors = _cache[self.hash]
+        self.order = order
+        self.factors = list(factors)
+        self.exponent = factors[-1] if factors else 1
+        self.rank = len(factors)
+
+    @classmethod
+    def from_graph(cls, num_vertices, edges):
+        r"""
+        Returns the invariants of a graph given by its edges, as from
+        ``SandpileRemote.get_edges()``.
+        """
+        return cls(SandpileEngine(num_vertices, edges))
+
+    @classmethod
+    def from_remote(cls, srem):
+        r"""
+        Returns the invariants of the graph currently in the program.
+
+        INPUT:
+
+        - ``srem`` - A connected SandpileRemote.
+
+        OUTPUT:
+
+        SandpileInvariants
+
+        EXAMPLES::
+
+            >>> SandpileInvariants.from_remote(srem).order
+        """
+        return cls(srem.get_engine())
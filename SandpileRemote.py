@@ -21,6 +21,11 @@ The Sandpile program will inform you of the connection.
 """
 
 from socket import *
+from socket import timeout as SocketTimeout
+import threading
+import time
+
+from FrameCodec import encode_frame, read_frame
 
 class CommandError(Exception):
     """
@@ -33,6 +38,56 @@ class CommandError(Exception):
     def __str__(self):
         return self.msg
 
+class RemoteTimeout(Exception):
+    """
+    This error occurs when the Sandpile program does not answer within
+    the allowed time. The connection is closed when this happens, since
+    a late answer would otherwise be taken as the reply to the next
+    command.
+    """
+
+    def __init__(self, message):
+        self.msg = message
+    def __str__(self):
+        return self.msg
+
+class StabilizeTimeout(RemoteTimeout):
+    """
+    This error occurs when a stabilization runs past its deadline. The
+    ``stats`` field holds the progress made so far, with the keys of
+    stabilize_by_updates(). After a plain stabilize() only ``seconds`` is
+    known; ``rounds``, ``firings`` and ``unstables`` are None there, since
+    the program reports nothing until it finishes.
+    """
+
+    def __init__(self, message, stats):
+        self.msg = message
+        self.stats = stats
+
+class StabilizeCancelled(Exception):
+    """
+    This error occurs when a stabilization is cancelled. The ``stats``
+    field holds the progress made so far (see stabilize_by_updates).
+    """
+
+    def __init__(self, message, stats):
+        self.msg = message
+        self.stats = stats
+    def __str__(self):
+        return self.msg
+
+class UnreachableSinkError(Exception):
+    """
+    This error occurs when some vertices have no path to a sink, so that
+    stabilizing might never finish. The ``vertices`` field lists them.
+    """
+
+    def __init__(self, message, vertices):
+        self.msg = message
+        self.vertices = vertices
+    def __str__(self):
+        return self.msg
+
 class SandpileRemote:
     r"""
     This class can connect connect to the Sandpile program and can
@@ -90,6 +145,11 @@ class SandpileRemote:
         self.auto_repaint = True
         self.verbose = False
         self.echo = False
+        self.timeout = None
+        self.compression = None
+        self.compress_threshold = 1024
+        self.compress_level = 1
+        self.__engine = None
 
     def __print_verbose(self, msg):
         """
@@ -110,6 +170,15 @@ class SandpileRemote:
             print(result)
             raise CommandError(result)
 
+    def __parse_ints(self, data):
+        """
+        Parses a comma separated list of ints, which the program sends
+        as an empty line when the list is empty.
+        """
+        if data.strip() == "":
+            return []
+        return list(map(int, data.split(",")))
+
     def __try_repaint(self):
         """
         A convenience method that will send the repaint command if autorepaint
@@ -118,7 +187,9 @@ class SandpileRemote:
         if(self.auto_repaint):
             self.repaint()
 
-    def connect(self, host="localhost", port=7236):
+    def connect(self, host="localhost", port=7236, timeout=None,
+                compression=None, compress_threshold=1024, compress_level=1,
+                negotiate_timeout=2.0):
         r"""
         Attempts to connect to the Sandpile program. If the program is not
         accepting connections, will raise a Connection refused error.
@@ -130,6 +201,29 @@ class SandpileRemote:
 
         - ``port`` (optional) - An int representing the port to use. Default is
           7236.
+
+        - ``timeout`` (optional) - A float; the number of seconds to wait for
+          each reply before raising RemoteTimeout. Default is None, meaning
+          wait forever.
+
+        - ``compression`` (optional) - A string naming a codec from
+          FrameCodec.CODECS ("zlib", or "lz4" if installed) to ask the
+          program to compress messages with. This needs a server that
+          knows the ``set_compression`` command, such as SandpileServer;
+          the Sandpile program itself does not. If the request is refused,
+          or not answered within ``negotiate_timeout`` seconds (in which
+          case the connection is made again), the connection stays
+          uncompressed; check the ``compression`` field afterwards.
+          Default is None.
+
+        - ``compress_threshold`` (optional) - An int; messages shorter than
+          this many bytes are sent uncompressed. Default is 1024.
+
+        - ``compress_level`` (optional) - An int; the compression level
+          used for messages sent by this end. Default is 1.
+
+        - ``negotiate_timeout`` (optional) - A float; the number of seconds
+          to wait for the answer to the compression request. Default is 2.
         
         OUTPUT:
 
@@ -146,12 +240,39 @@ class SandpileRemote:
         
             >>> srem = SandpileRemote()
             >>> srem.connect(host="some_ip_address", port=1234)
+
+        Compress large messages, which helps on slow links to another host:
+
+            >>> srem.connect(host="some_ip_address", compression="zlib")
+            >>> srem.compression
+                'zlib'
         """
         self.s = socket()
+        self.timeout = timeout
+        self.compression = None
+        self.s.settimeout(timeout)
         self.__print_verbose("Attempting to connect")
         self.s.connect((host, port))
+        # Commands are small; send them at once rather than waiting to
+        # fill a packet, which stalls pipelined commands.
+        self.s.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
         self.__print_verbose("Connected")
-        self.f = self.s.makefile()
+        self.f = self.s.makefile("rb")
+        if compression is not None:
+            self.compress_threshold = compress_threshold
+            self.compress_level = compress_level
+            # Bypass subclasses, which may track the commands they send.
+            SandpileRemote.send(self, "set_compression %s %d" % (compression, compress_threshold))
+            try:
+                reply = SandpileRemote.receive(self, negotiate_timeout)
+            except RemoteTimeout:
+                # A server that ignores unknown commands. The connection
+                # was closed, since an answer might still come later.
+                self.__print_verbose("No answer to set_compression")
+                SandpileRemote.connect(self, host, port, timeout)
+                return
+            if reply == "done\n":
+                self.compression = compression
 
     def close(self):
         r"""
@@ -208,17 +329,24 @@ class SandpileRemote:
             self.__print_verbose("Sending message: \"" + msg +"\"")
         else:
             self.__print_verbose("Sending message")
-        self.s.send(msg+"\n")
+        if self.compression is None:
+            self.s.sendall((msg+"\n").encode())
+        else:
+            self.s.sendall(encode_frame(msg.encode(), self.compression,
+                                        self.compress_threshold, self.compress_level))
         self.__print_verbose("Message sent")
 
-    def receive(self):
+    def receive(self, timeout=None):
         r"""
         Receives a single message sent by the program. If none is present, 
-        it will wait until there is.
+        it will wait until there is. Raises socket.error if the program
+        closed the connection.
 
         INPUT:
 
-        None
+        ``timeout`` (optional) - A float; the number of seconds to wait
+          for the message before closing the connection and raising
+          RemoteTimeout. Default is the timeout given to connect().
 
         OUTPUT:
 
@@ -236,13 +364,72 @@ class SandpileRemote:
                 '0.0,0.0\n'
         """
         self.__print_verbose("Waiting for message")
-        msg = self.f.readline()
+        if timeout is not None:
+            self.s.settimeout(timeout)
+        try:
+            if self.compression is None:
+                msg = self.f.readline().decode()
+            else:
+                frame = read_frame(self.f)
+                msg = "" if frame is None else frame.decode() + "\n"
+        except SocketTimeout:
+            self.close()
+            raise RemoteTimeout("no reply from the Sandpile program")
+        finally:
+            if timeout is not None and not self.f.closed:
+                self.s.settimeout(self.timeout)
+        if not msg:
+            raise error("connection closed by the Sandpile program")
         if self.echo:
             self.__print_verbose("Received message: \"" + msg +"\"")
         else:
             self.__print_verbose("Received message")
         return msg
 
+    def pipeline(self, msgs):
+        r"""
+        Sends several messages without waiting for the replies in between,
+        and returns the replies in order. This saves a round trip per
+        message. The messages are sent from a helper thread while the
+        replies are read, so large messages cannot fill both directions of
+        the connection and stall. Like send(), this is mostly for use by
+        other methods; replies are returned as received, without checking.
+
+        INPUT:
+
+        ``msgs`` - A list of strings, as for send().
+
+        OUTPUT:
+
+        A list of strings, the reply to each message.
+
+        EXAMPLES::
+
+            >>> srem.pipeline(["set_sand 0 5", "get_config"])
+                ['done\n', '5,0\n']
+        """
+        failed = []
+
+        def write():
+            try:
+                for msg in msgs:
+                    self.send(msg)
+            except Exception as e:
+                failed.append(e)
+
+        writer = threading.Thread(target=write)
+        writer.daemon = True
+        writer.start()
+        replies = []
+        try:
+            for msg in msgs:
+                replies.append(self.receive())
+        finally:
+            writer.join()
+        if failed:
+            raise failed[0]
+        return replies
+
     def repaint(self):
         r"""
         Tells the program to repaint. The program will not repaint
@@ -283,17 +470,93 @@ class SandpileRemote:
         self.__check_result(self.receive())
         self.__try_repaint()
 
-    def stabilize(self):
+    def apply_firing_vector(self, vector):
+        r"""
+        Fires each vertex ``vector[v]`` times, whether or not it is
+        unstable. The changes are computed with the local engine (see
+        get_engine) and only the vertices that change are sent, as one
+        pipelined batch of ``add_sand`` messages. Requires NumPy.
+
+        INPUT:
+
+        ``vector`` - A list of ints, one per vertex; negative entries
+          unfire.
+
+        OUTPUT:
+
+        int; the number of vertices that changed.
+
+        EXAMPLES::
+
+            >>> srem.apply_firing_vector([5, 2, 0])
+                3
+        """
+        vertices, changes = self.get_engine().firing_changes(vector)
+        msgs = ["add_sand %d %d" % pair for pair in zip(vertices.tolist(), changes.tolist())]
+        if msgs:
+            for reply in self.pipeline(msgs):
+                self.__check_result(reply)
+            self.__try_repaint()
+        return len(msgs)
+
+    def fire_vertices(self, verts, legal=False):
+        r"""
+        Fires each of a set of vertices once, whether or not it is
+        unstable; see apply_firing_vector. Requires NumPy.
+
+        INPUT:
+
+        ``verts`` - A list of vertex indices; repeats are ignored.
+
+        ``legal`` (optional) - If True, first check that firing the set is
+          legal, meaning no vertex of the set is left with a negative
+          amount of sand, and raise ValueError (firing nothing) if not.
+          This costs a ``get_sand`` per vertex of the set. Default is
+          False.
+
+        OUTPUT:
+
+        int; the number of vertices that changed.
+
+        EXAMPLES::
+
+            >>> srem.fire_vertices([0, 1], legal=True)
+                3
+        """
+        engine = self.get_engine()
+        verts = sorted(set(verts))
+        if legal and verts:
+            config = [0] * engine.num_vertices
+            replies = self.pipeline(["get_sand %d" % v for v in verts])
+            for v, reply in zip(verts, replies):
+                config[v] = int(reply)
+            engine.fire_vertices(config, verts, legal=True)
+        vector = [0] * engine.num_vertices
+        for v in verts:
+            vector[v] = 1
+        return self.apply_firing_vector(vector)
+
+    def stabilize(self, timeout=None, check_sinks=False):
         r"""
         Tells the program to stabilize the current configuration.
         Warning: If the current graph and configuration cannot stabilize
         (there is no global sink), then the program will enter an infinite
-        loop and this method will never return. Also note that this can
-        take a long time depending on the graph and configuration.
+        loop and this method will never return unless a timeout is given.
+        Also note that this can take a long time depending on the graph
+        and configuration.
 
         INPUT:
 
-        None
+        - ``timeout`` (optional) - A float; the number of seconds to wait
+          before giving up with StabilizeTimeout. Since the program keeps
+          working on the stabilization, the connection is closed when this
+          happens, and the error's ``stats`` only has the seconds waited
+          (the other statistics are None). Use stabilize_by_updates() to
+          learn how far it got. Default is the timeout given to connect().
+
+        - ``check_sinks`` (optional) - If True, first check that every
+          vertex has a path to a sink and raise UnreachableSinkError if
+          not. Default is False.
 
         OUTPUT:
 
@@ -302,10 +565,197 @@ class SandpileRemote:
         EXAMPLES::
 
             >>> srem.stabilize()
+            >>> srem.stabilize(timeout=60.0, check_sinks=True)
         """
+        if check_sinks:
+            self.check_sinks_reachable()
+        start = time.time()
         self.send("stabilize")
-        self.__check_result(self.receive())
+        try:
+            self.__check_result(self.receive(timeout))
+        except RemoteTimeout:
+            raise StabilizeTimeout("stabilize did not finish in time",
+                                   dict(rounds=None, firings=None, unstables=None,
+                                        seconds=time.time() - start))
+        self.__try_repaint()
+
+    def check_sinks_reachable(self):
+        r"""
+        Checks that every vertex has a directed path to a sink, which
+        guarantees that any configuration stabilizes. The check is done
+        locally from the edges and sinks of the program's graph.
+
+        INPUT:
+
+        None
+
+        OUTPUT:
+
+        None; raises UnreachableSinkError listing the offending vertices.
+
+        EXAMPLES::
+
+            >>> srem.add_vertices([[0.0, 0.0], [5.0, 5.0], [10.0, 0]])
+            >>> srem.add_edges([[0, 1, 1], [1, 0, 1], [2, 1, 1]])
+            >>> srem.check_sinks_reachable()
+                UnreachableSinkError: 3 vertices have no path to a sink
+        """
+        num_vertices = self.get_num_of_vertices()
+        in_edges = [[] for v in range(num_vertices)]
+        for e in self.get_edges():
+            in_edges[e[1]].append(e[0])
+        reached = [False] * num_vertices
+        todo = self.get_sinks()
+        for v in todo:
+            reached[v] = True
+        while todo:
+            v = todo.pop()
+            for u in in_edges[v]:
+                if not reached[u]:
+                    reached[u] = True
+                    todo.append(u)
+        stuck = [v for v in range(num_vertices) if not reached[v]]
+        if stuck:
+            raise UnreachableSinkError("%d vertices have no path to a sink"
+                                       % len(stuck), stuck)
+
+    def stabilize_by_updates(self, timeout=None, cancel=None, progress=None):
+        r"""
+        Stabilizes by repeatedly telling the program to update, checking
+        the number of unstable vertices after each update. Unlike
+        stabilize(), this can stop part way: when the deadline passes or
+        ``cancel`` is set, it raises with the statistics gathered so far.
+        The program is left in the partially stabilized configuration.
+
+        INPUT:
+
+        - ``timeout`` (optional) - A float; the number of seconds allowed.
+          Default is None, meaning no limit.
+
+        - ``cancel`` (optional) - A threading.Event; setting it stops the
+          stabilization after the current update.
+
+        - ``progress`` (optional) - A dict; it is kept up to date with the
+          statistics while running, e.g. for another thread to watch.
+
+        OUTPUT:
+
+        A dict of statistics with keys ``rounds`` (the number of updates),
+          ``firings`` (the total number of vertex firings), ``unstables``
+          (the number of unstable vertices left) and ``seconds``.
+
+        NOTES:
+
+        Raises StabilizeTimeout or StabilizeCancelled, whose ``stats`` field
+          holds the statistics up to that point.
+
+        EXAMPLES::
+
+            >>> srem.stabilize_by_updates(timeout=10.0)
+                {'rounds': 212, 'firings': 11556, 'unstables': 0, 'seconds': 3.1}
+        """
+        start = time.time()
+        deadline = None if timeout is None else start + timeout
+        stats = progress if progress is not None else dict()
+        stats.update(rounds=0, firings=0, unstables=0, seconds=0.0)
+
+        def remaining():
+            if deadline is None:
+                return None
+            left = deadline - time.time()
+            if left <= 0:
+                raise StabilizeTimeout("stabilize did not finish in time", stats)
+            return left
+
+        try:
+            self.send("get_num_unstables")
+            stats["unstables"] = int(self.receive(remaining()))
+            while stats["unstables"] > 0:
+                if cancel is not None and cancel.is_set():
+                    raise StabilizeCancelled("stabilize was cancelled", stats)
+                remaining()
+                self.send("update")
+                self.__check_result(self.receive(remaining()))
+                stats["rounds"] += 1
+                stats["firings"] += stats["unstables"]
+                self.send("get_num_unstables")
+                stats["unstables"] = int(self.receive(remaining()))
+                stats["seconds"] = time.time() - start
+        except RemoteTimeout:
+            stats["seconds"] = time.time() - start
+            raise StabilizeTimeout("stabilize did not finish in time", stats)
+        stats["seconds"] = time.time() - start
         self.__try_repaint()
+        return stats
+
+    def stabilize_async(self, timeout=None):
+        r"""
+        Starts stabilize_by_updates() on a background thread.
+
+        INPUT:
+
+        - ``timeout`` (optional) - A float; the number of seconds allowed.
+
+        OUTPUT:
+
+        A StabilizeTask, which can be watched, cancelled and waited on.
+
+        NOTES:
+
+        Do not issue other commands on this connection until the task is
+          done.
+
+        EXAMPLES::
+
+            >>> task = srem.stabilize_async(timeout=600.0)
+            >>> task.progress()["firings"]
+                5220
+            >>> task.cancel()
+            >>> task.wait()
+                StabilizeCancelled: stabilize was cancelled
+        """
+        return StabilizeTask(self, timeout)
+
+    def stabilize_many(self, configs):
+        r"""
+        Stabilizes many configurations in the program in one pipelined
+        exchange (see pipeline()): each is set, stabilized and read back,
+        without waiting for a reply in between. The program's
+        configuration is restored afterwards. Requires NumPy and SciPy.
+
+        INPUT:
+
+        ``configs`` - A (B, N) array-like of ints, one configuration per
+          row, where N is the number of vertices.
+
+        OUTPUT:
+
+        A pair ``(stable, firings)``: a (B, N) NumPy array of the stabilized
+          configurations, and a (B,) array of the total number of firings
+          for each. The firings are computed locally from the Laplacian,
+          since the program does not count them.
+
+        EXAMPLES::
+
+            >>> configs = [srem.get_max_stable()] * 100
+            >>> for c in configs: c[random.randrange(len(c))] += 1
+            >>> stable, firings = srem.stabilize_many(configs)
+        """
+        import numpy as np
+        configs = np.array(configs, dtype=np.int64)
+        msgs = ["get_config"]
+        for config in configs:
+            msgs += ["set_config " + self.format_seq(config), "stabilize", "get_config"]
+        replies = self.pipeline(msgs)
+        self.set_config(self.__parse_ints(replies[0]))
+        stable = np.zeros(configs.shape, dtype=np.int64)
+        for i in range(len(configs)):
+            set_reply, stabilize_reply, config_data = replies[1 + 3 * i:4 + 3 * i]
+            self.__check_result(set_reply)
+            self.__check_result(stabilize_reply)
+            stable[i] = self.__parse_ints(config_data)
+        firings = self.get_engine().odometer(configs, stable).sum(axis=1)
+        return stable, firings
 
     def delete_graph(self):
         r"""
@@ -323,6 +773,7 @@ class SandpileRemote:
 
             >>> srem.delete_graph()
         """
+        self.__engine = None
         self.send("delete_graph")
         self.__check_result(self.receive())
 
@@ -370,7 +821,7 @@ class SandpileRemote:
         if vertex_data == "\n":
             return []
         else:
-            return map(lambda x : map(float, x.split(",")), vertex_data.split(" "))
+            return [list(map(float, x.split(","))) for x in vertex_data.split(" ")]
 
     def get_num_of_vertices(self):
         r"""
@@ -412,7 +863,7 @@ class SandpileRemote:
         """
         
         self.send("get_vertex "+str(vert))
-        return map(float, self.receive().split(","))
+        return list(map(float, self.receive().split(",")))
 
     def add_vertices(self, vertex_positions):
         """
@@ -436,10 +887,8 @@ class SandpileRemote:
             >>> srem.get_vertices()
                 [[0.0, 0.0], [3.0, -2.0], [5.0, 5.0], [1.0, 2.0]]
         """
-        if(len(vertex_positions)>1):
-            self.send("add_vertices "+(self.format_seq_of_seqs(vertex_positions)))
-        else:
-            self.send("add_vertices " + first_vert)
+        self.__engine = None
+        self.send("add_vertices "+(self.format_seq_of_seqs(vertex_positions)))
         self.__check_result(self.receive())
         self.__try_repaint()
 
@@ -465,6 +914,7 @@ class SandpileRemote:
             >>> srem.get_vertices()
                 [[0.0, 0.0], [5.0, 5.0]]
         """
+        self.__engine = None
         self.send("add_vertex " + str(x) + " " + str(y))
         self.__check_result(self.receive())
         self.__try_repaint()
@@ -501,7 +951,7 @@ class SandpileRemote:
         if edge_data == "\n":
             return []
         else:
-            return map(lambda x : map(int, x.split(",")), edge_data.split(" "))
+            return [list(map(int, x.split(","))) for x in edge_data.split(" ")]
 
     def add_edge(self, source_vert, dest_vert, weight):
         r"""
@@ -545,6 +995,7 @@ class SandpileRemote:
             >>> srem.add_edge(1, 0, -2)
             >>> [[0, 1, 8]]
         """
+        self.__engine = None
         self.send("add_edge "+str(source_vert)+" "+str(dest_vert)+" "+str(weight))
         self.__check_result(self.receive())
         self.__try_repaint()
@@ -584,6 +1035,7 @@ class SandpileRemote:
             >>> srem.get_edges()
             >>> [[0, 1, 8]]
         """
+        self.__engine = None
         self.send("add_edges " + self.format_seq_of_seqs(edge_data))
         self.__check_result(self.receive())
         self.__try_repaint()
@@ -615,7 +1067,30 @@ class SandpileRemote:
         if config_data == "\n":
             return []
         else:
-            return map(int, config_data.split(","))
+            return list(map(int, config_data.split(",")))
+
+    def get_config_array(self):
+        r"""
+        Returns the current configuration as a ConfigArray: a NumPy array
+        of the narrowest integer type that holds it, widened as needed by
+        later changes. Requires NumPy.
+
+        INPUT:
+
+        None
+
+        OUTPUT:
+
+        ConfigArray
+
+        EXAMPLES::
+
+            >>> config = srem.get_config_array()
+            >>> config.add_sand(0, 10**12)
+            >>> srem.set_config(config.tolist())
+        """
+        from ConfigArray import ConfigArray
+        return ConfigArray(self.get_config())
 
     def get_sand(self, vert):
         r"""
@@ -841,7 +1316,7 @@ class SandpileRemote:
 
         
         self.send("get_unstables")
-        return map(int, self.receive().split(","))
+        return self.__parse_ints(self.receive())
 
     def get_num_unstables(self):
         r"""
@@ -912,7 +1387,7 @@ class SandpileRemote:
         """ 
         self.send("is_sink "+str(vert))
         response = self.receive()
-        if(response=="true"):
+        if(response.strip()=="true"):
             return True
         else:
             return False
@@ -941,7 +1416,7 @@ class SandpileRemote:
                 [2, 3]
         """
         self.send("get_sinks")
-        return map(int, self.receive().split(","))
+        return self.__parse_ints(self.receive())
 
     def get_nonsinks(self):
         r"""
@@ -964,7 +1439,7 @@ class SandpileRemote:
                 [0, 1]
         """
         self.send("get_nonsinks")
-        return map(int, self.receive().split(","))
+        return self.__parse_ints(self.receive())
 
     def get_selected(self):
         r"""
@@ -988,7 +1463,7 @@ class SandpileRemote:
             [189, 190, 210, 209]
         """
         self.send("get_selected")
-        return map(int, self.receive().split(","))
+        return self.__parse_ints(self.receive())
 
     def get_config_named(self, name):
         r"""
@@ -1018,7 +1493,7 @@ class SandpileRemote:
         """
 
         self.send("get_config "+name)
-        return map(int, self.receive().split(","))
+        return list(map(int, self.receive().split(",")))
     
     def set_to_max_stable(self):
         r"""
@@ -1048,15 +1523,73 @@ class SandpileRemote:
 
     def get_max_stable(self):
         self.send("get_max_stable")
-        return map(int, self.receive().split(","))
+        return list(map(int, self.receive().split(",")))
 
-    def set_to_identity(self):
+    def get_engine(self, refresh=False):
+        r"""
+        Returns a SandpileEngine for the program's graph, for computing
+        locally. It is built on first use and kept until the graph is
+        changed through this object. Requires NumPy.
+
+        INPUT:
+
+        ``refresh`` (optional) - If True, rebuild it, e.g. after the graph
+          was edited in the program itself. Default is False.
+
+        OUTPUT:
+
+        SandpileEngine
+
+        EXAMPLES::
+
+            >>> engine = srem.get_engine()
+            >>> stable, odometer = engine.stabilize(srem.get_config())
+        """
+        if self.__engine is None or refresh:
+            from SandpileEngine import SandpileEngine
+            self.__engine = SandpileEngine.from_remote(self)
+        return self.__engine
+
+    def is_recurrent(self, config=None):
+        r"""
+        Checks whether a configuration is recurrent, by running the burning
+        algorithm locally; see SandpileEngine.burn(). Requires NumPy.
+
+        INPUT:
+
+        ``config`` (optional) - A list of ints, or a list of such lists to
+          check many at once. Default is the program's configuration.
+
+        OUTPUT:
+
+        bool, or a list of bools for a list of configurations.
+
+        EXAMPLES::
+
+            >>> srem.is_recurrent(srem.get_config_named("identity"))
+                True
+        """
+        if config is None:
+            config = self.get_config()
+        recurrent = self.get_engine().is_recurrent(config)
+        return recurrent if isinstance(recurrent, bool) else recurrent.tolist()
+
+    def __local_config(self, name):
+        """
+        Computes a configuration named by a SandpileEngine method locally
+        and returns it as a list with the sinks set to 0.
+        """
+        return getattr(self.get_engine(), name)().tolist()
+
+    def set_to_identity(self, local=False):
         r"""
         Sets the current configuration to the identity configuration.
 
         INPUT:
 
-        None
+        ``local`` (optional) - If True, compute the identity here with
+          get_engine() and upload it with set_config, instead of having the
+          program compute it. Default is False.
 
         OUTPUT:
 
@@ -1072,18 +1605,23 @@ class SandpileRemote:
         EXAMPLES::
 
             >>> srem.set_to_identity()
+            >>> srem.set_to_identity(local=True)
         """
+        if local:
+            self.set_config(self.__local_config("identity"))
+            return
         self.send("set_to_identity")
         self.__check_result(self.receive())
         self.__try_repaint()
 
-    def add_identity(self):
+    def add_identity(self, local=False):
         r"""
         Adds the identity configuration to the current configuration_x_s.
 
         INPUT:
 
-        None
+        ``local`` (optional) - If True, compute the identity here and
+          upload it with add_config. Default is False.
 
         OUTPUT:
 
@@ -1100,22 +1638,28 @@ class SandpileRemote:
 
             >>> srem.add_identity()
         """
+        if local:
+            self.add_config(self.__local_config("identity"))
+            return
         self.send("add_identity")
         self.__check_result(self.receive())
         self.__try_repaint()
 
-    def get_identity(self):
+    def get_identity(self, local=False):
+        if local:
+            return self.__local_config("identity")
         self.send("get_identity")
-        return map(int, self.receive().split(","))
+        return list(map(int, self.receive().split(",")))
 
-    def set_to_burning(self):
+    def set_to_burning(self, local=False):
         r"""
         Sets the current configuration to the minimal burning
           configuration.
 
         INPUT:
 
-        None
+        ``local`` (optional) - If True, compute it here with get_engine()
+          and upload it with set_config. Default is False.
 
         OUTPUT:
 
@@ -1125,38 +1669,114 @@ class SandpileRemote:
 
             >>> srem.set_to_burning()
         """
+        if local:
+            self.set_config(self.__local_config("burning"))
+            return
         self.send("set_to_burning")
         self.__check_result(self.receive())
         self.__try_repaint()
 
-    def add_burning(self):
+    def add_burning(self, local=False):
+        if local:
+            self.add_config(self.__local_config("burning"))
+            return
         self.send("add_burning")
         self.__check_result(self.receive())
         self.__try_repaint()
 
-    def get_burning(self):
+    def get_burning(self, local=False):
+        if local:
+            return self.__local_config("burning")
         self.send("get_burning")
-        return map(int, self.receive().split(","))
+        return list(map(int, self.receive().split(",")))
 
-    def set_to_dual(self):
+    def set_to_dual(self, local=False):
+        if local:
+            self.set_config(self.__local_config("dual"))
+            return
         self.send("set_to_dual")
         self.__check_result(self.receive())
         self.__try_repaint()
 
-    def add_dual(self):
+    def add_dual(self, local=False):
+        if local:
+            self.add_config(self.__local_config("dual"))
+            return
         self.send("add_dual")
         self.__check_result(self.receive())
         self.__try_repaint()
 
-    def get_dual(self):
+    def get_dual(self, local=False):
+        if local:
+            return self.__local_config("dual")
         self.send("get_dual")
-        return map(int, self.receive().split(","))
+        return list(map(int, self.receive().split(",")))
 
 
     def format_seq(self, seq):
-        return reduce(lambda s, x : s+","+str(x), seq[1:], str(seq[0]))
+        return ",".join(map(str, seq))
     
     def format_seq_of_seqs(self, seq):
-        return reduce(lambda s, x : s+" "+self.format_seq(x), seq[1:], self.format_seq(seq[0]))
+        return " ".join(map(self.format_seq, seq))
 
     
+
+
+class StabilizeTask:
+    r"""
+    A stabilization running on a background thread; see
+    SandpileRemote.stabilize_async().
+    """
+
+    def __init__(self, remote, timeout=None):
+        self.stats = dict(rounds=0, firings=0, unstables=0, seconds=0.0)
+        self.error = None
+        self.__cancel = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, args=(remote, timeout))
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __run(self, remote, timeout):
+        try:
+            remote.stabilize_by_updates(timeout, self.__cancel, self.stats)
+        except Exception as e:
+            self.error = e
+
+    def progress(self):
+        r"""
+        Returns a copy of the statistics so far.
+        """
+        return dict(self.stats)
+
+    def done(self):
+        r"""
+        Returns True if the stabilization has finished, failed or stopped.
+        """
+        return not self.__thread.is_alive()
+
+    def cancel(self):
+        r"""
+        Asks the stabilization to stop after the current update.
+        """
+        self.__cancel.set()
+
+    def wait(self, timeout=None):
+        r"""
+        Waits for the stabilization to end.
+
+        INPUT:
+
+        - ``timeout`` (optional) - A float; the number of seconds to wait.
+
+        OUTPUT:
+
+        The statistics dict. Raises the task's StabilizeTimeout or
+          StabilizeCancelled if it was stopped, and RemoteTimeout if it is
+          still running after ``timeout`` seconds.
+        """
+        self.__thread.join(timeout)
+        if self.__thread.is_alive():
+            raise RemoteTimeout("stabilize is still running")
+        if self.error is not None:
+            raise self.error
+        return self.progress()
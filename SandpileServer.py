@@ -0,0 +1,421 @@
+r"""
+Sandpile Server
+
+A stand-in for the Sandpile program's server mode, written in plain Python.
+It speaks the same line protocol as the program, so a SandpileRemote can
+connect to it, which is handy for testing scripts and for running many
+headless programs on one machine. It has no GUI: ``repaint`` does nothing,
+``get_selected`` is always empty, and the identity, burning and dual
+configurations are not available.
+
+It also accepts the ``set_compression`` request that SandpileRemote sends
+when asked to compress (see FrameCodec), and can imitate a slow host or a
+slow network link.
+
+As in the program, a vertex with no outgoing edges is a sink, and a
+non-sink vertex is unstable when it holds at least as many grains as the
+total weight of its outgoing edges.
+
+EXAMPLES:
+
+    >>> server = SandpileServer(port=7237).start()
+    >>> srem = SandpileRemote()
+    >>> srem.connect(port=7237)
+    >>> srem.add_vertices([[0.0, 0.0], [5.0, 5.0]])
+    >>> server.stop()
+
+From a shell, ``python SandpileServer.py 7236`` serves until interrupted.
+"""
+
+import random
+import socket
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from FrameCodec import CODECS, HEADER, encode_frame, read_raw_frame, decode_frame
+
+
+class SandpileState:
+    r"""
+    The graph and configuration held by a SandpileServer.
+    """
+
+    def __init__(self):
+        self.delete_graph()
+
+    def delete_graph(self):
+        self.positions = []
+        # One dict per vertex: destination -> weight, in insertion order.
+        self.out_edges = []
+        self.degrees = []
+        self.config = []
+
+    def num_vertices(self):
+        return len(self.positions)
+
+    def check_vertex(self, v):
+        if v < 0 or v >= len(self.positions):
+            raise ValueError("no vertex %d" % v)
+
+    def add_vertex(self, x, y):
+        self.positions.append((x, y))
+        self.out_edges.append(dict())
+        self.degrees.append(0)
+        self.config.append(0)
+
+    def add_edge(self, source, dest, weight):
+        self.check_vertex(source)
+        self.check_vertex(dest)
+        edges = self.out_edges[source]
+        new_weight = edges.get(dest, 0) + weight
+        old_weight = edges.pop(dest, 0)
+        if new_weight > 0:
+            edges[dest] = new_weight
+            self.degrees[source] += new_weight - old_weight
+        else:
+            self.degrees[source] -= old_weight
+
+    def edges(self):
+        return [(v, u, w) for v in range(len(self.out_edges))
+                for u, w in self.out_edges[v].items()]
+
+    def is_sink(self, v):
+        return self.degrees[v] == 0
+
+    def is_unstable(self, v):
+        return self.degrees[v] > 0 and self.config[v] >= self.degrees[v]
+
+    def unstables(self):
+        return [v for v in range(len(self.config)) if self.is_unstable(v)]
+
+    def fire(self, v, times=1):
+        self.config[v] -= times * self.degrees[v]
+        for u, w in self.out_edges[v].items():
+            self.config[u] += times * w
+
+    def update(self):
+        for v in self.unstables():
+            self.fire(v)
+
+    def stabilize(self):
+        todo = self.unstables()
+        while todo:
+            v = todo.pop()
+            if not self.is_unstable(v):
+                continue
+            self.fire(v, self.config[v] // self.degrees[v])
+            for u in self.out_edges[v]:
+                if self.is_unstable(u):
+                    todo.append(u)
+
+    def max_stable(self):
+        return [max(d - 1, 0) for d in self.degrees]
+
+
+def _format(values):
+    return ",".join(map(str, values))
+
+
+def _parse_ints(data):
+    return [int(x) for x in data.split(",")]
+
+
+class SandpileServer:
+    r"""
+    Serves the Sandpile line protocol on a TCP port from a background
+    thread. All connections share one graph and configuration, like the
+    program.
+    """
+
+    def __init__(self, host="localhost", port=7236, delay=0.0, bandwidth=None,
+                 level=1, compression=True):
+        r"""
+        Create a server. Call ``start()`` to begin accepting connections.
+
+        INPUT:
+
+        - ``host`` (optional) - string; the address to listen on. Default
+          "localhost".
+
+        - ``port`` (optional) - int; the port to listen on. 0 picks a free
+          port, which is then available as ``server.port``. Default is 7236.
+
+        - ``delay`` (optional) - float; seconds to sleep before answering
+          each command, to imitate a slow host. Default is 0.
+
+        - ``bandwidth`` (optional) - float; bytes per second. Each message
+          sent or received is delayed by its size over this, to imitate a
+          slow network. Default is None, meaning no limit.
+
+        - ``level`` (optional) - int; the compression level for replies on
+          connections that negotiated compression. Default is 1.
+
+        - ``compression`` (optional) - If False, treat ``set_compression``
+          as an unknown command, like the Sandpile program. Default is
+          True.
+
+        OUTPUT:
+
+        SandpileServer
+
+        EXAMPLES::
+
+            >>> server = SandpileServer(port=0).start()
+            >>> server.port
+                50123
+        """
+        self.state = SandpileState()
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self.level = level
+        self.compression = compression
+        self.lock = threading.Lock()
+        self.random = random.Random()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.connections.append(self.request)
+                codec = None
+                threshold = 0
+                try:
+                    while True:
+                        if codec is None:
+                            data = self.rfile.readline()
+                            if not data:
+                                break
+                            msg = data.decode().rstrip("\r\n")
+                            server.throttle(len(data))
+                        else:
+                            frame = read_raw_frame(self.rfile)
+                            if frame is None:
+                                break
+                            msg = decode_frame(*frame).decode()
+                            server.throttle(HEADER.size + len(frame[1]))
+                        switch_to = None
+                        if server.compression and msg.startswith("set_compression "):
+                            reply, switch_to, threshold = server.negotiate(msg)
+                        else:
+                            reply = server.handle(msg)
+                        if codec is None:
+                            out = (reply + "\n").encode()
+                        else:
+                            out = encode_frame(reply.encode(), codec, threshold, server.level)
+                        server.throttle(len(out))
+                        self.wfile.write(out)
+                        self.wfile.flush()
+                        if switch_to is not None:
+                            codec = switch_to
+                except socket.error:
+                    pass
+                finally:
+                    server.connections.remove(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.connections = []
+        self.thread = None
+
+    def start(self):
+        r"""
+        Starts serving on a background thread and returns the server.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        r"""
+        Stops serving and closes the listening socket.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        self.drop_connections()
+
+    def drop_connections(self):
+        r"""
+        Abruptly closes every open client connection, as if the program
+        had crashed. The server keeps accepting new connections.
+        """
+        for conn in list(self.connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def throttle(self, num_bytes):
+        r"""
+        Sleeps for as long as ``num_bytes`` take at the set bandwidth.
+        """
+        if self.bandwidth:
+            time.sleep(num_bytes / float(self.bandwidth))
+
+    def negotiate(self, msg):
+        r"""
+        Answers a ``set_compression <codec> <threshold>`` request.
+
+        OUTPUT:
+
+        A tuple ``(reply, codec, threshold)``; ``codec`` is None if the
+          request is refused.
+        """
+        parts = msg.split(" ")
+        if len(parts) != 3 or parts[1] not in CODECS:
+            return "error: unsupported compression", None, 0
+        return "done", parts[1], int(parts[2])
+
+    def handle(self, msg):
+        r"""
+        Executes one command and returns the reply (without the newline).
+        """
+        if self.delay:
+            time.sleep(self.delay)
+        parts = msg.split(" ", 1)
+        command = parts[0]
+        arg = parts[1] if len(parts) > 1 else ""
+        method = getattr(self, "cmd_" + command, None)
+        if method is None:
+            return "error: unknown command " + command
+        try:
+            with self.lock:
+                reply = method(arg)
+        except (ValueError, IndexError) as e:
+            return "error: %s: %s" % (command, e)
+        return "done" if reply is None else reply
+
+    # Commands. Each returns the reply, or None for "done".
+
+    def cmd_repaint(self, arg):
+        pass
+
+    def cmd_update(self, arg):
+        self.state.update()
+
+    def cmd_stabilize(self, arg):
+        self.state.stabilize()
+
+    def cmd_delete_graph(self, arg):
+        self.state.delete_graph()
+
+    def cmd_clear_sand(self, arg):
+        self.state.config = [0] * self.state.num_vertices()
+
+    def cmd_get_vertices(self, arg):
+        return " ".join("%r,%r" % p for p in self.state.positions)
+
+    def cmd_get_num_of_vertices(self, arg):
+        return str(self.state.num_vertices())
+
+    def cmd_get_vertex(self, arg):
+        v = int(arg)
+        self.state.check_vertex(v)
+        return "%r,%r" % self.state.positions[v]
+
+    def cmd_add_vertices(self, arg):
+        for pos in arg.split(" "):
+            x, y = pos.split(",")
+            self.state.add_vertex(float(x), float(y))
+
+    def cmd_add_vertex(self, arg):
+        x, y = arg.split(" ")
+        self.state.add_vertex(float(x), float(y))
+
+    def cmd_get_edges(self, arg):
+        return " ".join(_format(e) for e in self.state.edges())
+
+    def cmd_add_edge(self, arg):
+        self.state.add_edge(*[int(x) for x in arg.split(" ")])
+
+    def cmd_add_edges(self, arg):
+        for edge in arg.split(" "):
+            self.state.add_edge(*_parse_ints(edge))
+
+    def cmd_get_config(self, arg):
+        if arg:
+            raise ValueError("no configuration named " + arg)
+        return _format(self.state.config)
+
+    def cmd_get_sand(self, arg):
+        v = int(arg)
+        self.state.check_vertex(v)
+        return str(self.state.config[v])
+
+    def cmd_set_sand(self, arg):
+        v, amount = [int(x) for x in arg.split(" ")]
+        self.state.check_vertex(v)
+        self.state.config[v] = amount
+
+    def cmd_add_sand(self, arg):
+        v, amount = [int(x) for x in arg.split(" ")]
+        self.state.check_vertex(v)
+        self.state.config[v] += amount
+
+    def cmd_add_random_sand(self, arg):
+        nonsinks = [v for v in range(self.state.num_vertices()) if not self.state.is_sink(v)]
+        if not nonsinks:
+            return
+        for i in range(int(arg)):
+            self.state.config[self.random.choice(nonsinks)] += 1
+
+    def __config_arg(self, arg):
+        config = _parse_ints(arg)
+        if len(config) != self.state.num_vertices():
+            raise ValueError("expected %d values, got %d"
+                             % (self.state.num_vertices(), len(config)))
+        return config
+
+    def cmd_set_config(self, arg):
+        self.state.config = self.__config_arg(arg)
+
+    def cmd_add_config(self, arg):
+        config = self.__config_arg(arg)
+        self.state.config = [a + b for a, b in zip(self.state.config, config)]
+
+    def cmd_get_unstables(self, arg):
+        return _format(self.state.unstables())
+
+    def cmd_get_num_unstables(self, arg):
+        return str(len(self.state.unstables()))
+
+    def cmd_is_sink(self, arg):
+        v = int(arg)
+        self.state.check_vertex(v)
+        return "true" if self.state.is_sink(v) else "false"
+
+    def cmd_get_sinks(self, arg):
+        return _format(v for v in range(self.state.num_vertices()) if self.state.is_sink(v))
+
+    def cmd_get_nonsinks(self, arg):
+        return _format(v for v in range(self.state.num_vertices()) if not self.state.is_sink(v))
+
+    def cmd_get_selected(self, arg):
+        return ""
+
+    def cmd_set_to_max_stable(self, arg):
+        self.state.config = self.state.max_stable()
+
+    def cmd_add_max_stable(self, arg):
+        self.state.config = [a + b for a, b in zip(self.state.config, self.state.max_stable())]
+
+    def cmd_get_max_stable(self, arg):
+        return _format(self.state.max_stable())
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 7236
+    server = SandpileServer(port=port).start()
+    print("Serving the Sandpile protocol on port %d" % server.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
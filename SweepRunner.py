@@ -0,0 +1,290 @@
+r"""
+Sweep Runner
+
+Runs parameter sweeps (e.g. graph sizes x sand amounts x seeds) in parallel
+on a process pool and streams the results to a JSON-lines file as trials
+finish. Rerunning a sweep with the same results file skips the trials that
+already completed, so an interrupted sweep picks up where it left off.
+
+Trials run either headless, as a plain function of their parameters, or
+against a pool of Sandpile programs: each worker process then holds its own
+connection to one of the given endpoints.
+
+EXAMPLES:
+
+A trial for a pool of programs gets the worker's SandpileRemote and the
+trial parameters. It must be defined at module level so it can be sent to
+the workers, and must return something JSON serializable. Here
+``build_grid`` stands for the user's own graph construction:
+
+    >>> def trial(srem, params):
+    ...     srem.auto_repaint = False
+    ...     build_grid(srem, params["size"])
+    ...     srem.add_random_sand(params["sand"])
+    ...     srem.stabilize()
+    ...     return srem.get_config()
+
+    >>> grid = parameter_grid(size=[20, 40, 80], sand=[1000, 10000], seed=range(10))
+    >>> runner = SweepRunner(trial, grid, "sweep.jsonl",
+    ...                      endpoints=[("localhost", 7236), ("localhost", 7237)])
+    >>> runner.run()
+        60
+    >>> results = load_results("sweep.jsonl")
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from socket import error as socket_error
+
+from SandpileRemote import SandpileRemote, RemoteTimeout
+
+# The endpoint of a pool worker, and its connection to that Sandpile
+# program; None until connected, and again after the connection dropped.
+_worker_endpoint = None
+_worker_remote = None
+
+
+def _connect_worker(endpoints):
+    global _worker_endpoint
+    _worker_endpoint = endpoints.get()
+    _reconnect_worker()
+
+
+def _reconnect_worker():
+    global _worker_remote
+    host, port = _worker_endpoint
+    remote = SandpileRemote()
+    remote.connect(host, port)
+    _worker_remote = remote
+
+
+def _run_trial(trial, key, params):
+    global _worker_remote
+    start = time.time()
+    if _worker_endpoint is None:
+        result = trial(params)
+    else:
+        if _worker_remote is None:
+            _reconnect_worker()
+        try:
+            result = trial(_worker_remote, params)
+        except (socket_error, EOFError, RemoteTimeout):
+            # The trial fails, but the next one given to this worker gets a
+            # fresh connection instead of the dead one.
+            try:
+                _worker_remote.close()
+            except socket_error:
+                pass
+            _worker_remote = None
+            raise
+    return key, result, time.time() - start
+
+
+def parameter_grid(**axes):
+    r"""
+    Returns the cartesian product of the given parameter values.
+
+    INPUT:
+
+    - Keyword arguments mapping each parameter name to a sequence of values.
+
+    OUTPUT:
+
+    A list of dicts, one per combination.
+
+    EXAMPLES::
+
+        >>> parameter_grid(size=[10, 20], seed=[0, 1])
+            [{'seed': 0, 'size': 10}, {'seed': 0, 'size': 20},
+             {'seed': 1, 'size': 10}, {'seed': 1, 'size': 20}]
+    """
+    names = sorted(axes)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[list(axes[n]) for n in names])]
+
+
+def trial_key(params):
+    r"""
+    Returns the string that identifies a trial in the results file.
+    """
+    return json.dumps(params, sort_keys=True)
+
+
+def load_results(path, errors=False):
+    r"""
+    Reads a results file written by SweepRunner.
+
+    INPUT:
+
+    - ``path`` - string; the results file.
+
+    - ``errors`` (optional) - If True, also return the records of trials
+      that raised. Default is False.
+
+    OUTPUT:
+
+    A list of dicts with keys ``params``, ``result`` (or ``error``) and
+      ``seconds``. A partially written last line is ignored.
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            record = json.loads(line)
+            if errors or "error" not in record:
+                records.append(record)
+    return records
+
+
+class SweepRunner:
+    r"""
+    Runs a trial function over a parameter grid on a process pool.
+    """
+
+    def __init__(self, trial, grid, path, endpoints=None, max_workers=None):
+        r"""
+        Set up a sweep.
+
+        INPUT:
+
+        - ``trial`` - A module-level function. Without ``endpoints`` it is
+          called as ``trial(params)``; with them as ``trial(srem, params)``
+          where ``srem`` is the worker's connected SandpileRemote. It must
+          return a JSON serializable value.
+
+        - ``grid`` - A list of dicts of JSON serializable parameters, e.g.
+          from ``parameter_grid()``.
+
+        - ``path`` - string; the JSON-lines file results are appended to.
+
+        - ``endpoints`` (optional) - A list of (host, port) pairs of running
+          Sandpile programs. One worker process is started per endpoint.
+
+        - ``max_workers`` (optional) - int; the number of worker processes
+          for headless sweeps. Defaults to the number of CPUs.
+
+        OUTPUT:
+
+        SweepRunner
+
+        EXAMPLES::
+
+            >>> runner = SweepRunner(trial, parameter_grid(size=[10, 20]), "out.jsonl")
+        """
+        self.trial = trial
+        self.grid = list(grid)
+        self.path = path
+        self.endpoints = endpoints
+        if endpoints is not None:
+            max_workers = len(endpoints)
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+
+    def completed(self):
+        r"""
+        Returns the set of keys of the trials already in the results file.
+        """
+        return set(trial_key(r["params"]) for r in load_results(self.path))
+
+    def pending(self):
+        r"""
+        Returns the parameters of the trials that still have to be run.
+        """
+        done = self.completed()
+        return [p for p in self.grid if trial_key(p) not in done]
+
+    def __open_results(self):
+        # Cut off a line left half written by an interrupted run, reading
+        # back from the end to the last newline.
+        with open(self.path, "a+b") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            end = size
+            while end > 0:
+                start = max(end - 65536, 0)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                f.truncate(end)
+        return open(self.path, "a")
+
+    def run(self, verbose=False):
+        r"""
+        Runs every pending trial. Results are written as soon as each
+        trial finishes. A trial that raises, or returns a value that is
+        not JSON serializable, is recorded with its error and will be
+        retried by the next ``run()``. If a worker's connection to its
+        program drops, the trial running on it fails and the worker
+        reconnects for its next trial.
+
+        INPUT:
+
+        - ``verbose`` (optional) - If True, print a line per finished trial.
+
+        OUTPUT:
+
+        int; the number of trials that completed successfully.
+
+        EXAMPLES::
+
+            >>> runner.run()
+                60
+        """
+        todo = self.pending()
+        params_by_key = dict((trial_key(p), p) for p in todo)
+        keys = iter(list(params_by_key))
+        if self.endpoints is not None:
+            context = multiprocessing.get_context()
+            endpoint_queue = context.Queue()
+            for endpoint in self.endpoints:
+                endpoint_queue.put(tuple(endpoint))
+            pool = ProcessPoolExecutor(self.max_workers, mp_context=context,
+                                       initializer=_connect_worker,
+                                       initargs=(endpoint_queue,))
+        else:
+            pool = ProcessPoolExecutor(self.max_workers)
+        succeeded = 0
+        out = self.__open_results()
+        try:
+            running = dict()
+            while True:
+                # Keep a couple of trials queued per worker.
+                while len(running) < 2 * self.max_workers:
+                    key = next(keys, None)
+                    if key is None:
+                        break
+                    future = pool.submit(_run_trial, self.trial, key, params_by_key[key])
+                    running[future] = key
+                if not running:
+                    break
+                done, not_done = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    record = {"params": params_by_key[key]}
+                    try:
+                        key, result, seconds = future.result()
+                        line = json.dumps(dict(record, result=result, seconds=seconds))
+                        succeeded += 1
+                    except Exception as e:
+                        # The trial raised, or returned something that is
+                        # not JSON serializable.
+                        record["error"] = repr(e)
+                        line = json.dumps(record)
+                    out.write(line + "\n")
+                    out.flush()
+                    if verbose:
+                        print("%s: %s" % (key, "error" if "error" in record else "done"))
+        finally:
+            out.close()
+            pool.shutdown()
+        return succeeded
@@ -0,0 +1,399 @@
+r"""
+Sweep Scheduler
+
+Runs a parameter sweep across several Sandpile programs, typically one per
+machine, each reached at a ``host:port`` endpoint.
+
+Every endpoint is driven by its own thread and pulls the next trial when it
+is free, so fast hosts naturally do more of the work. The scheduler keeps a
+running average of each endpoint's trial time and uses it near the end of
+the sweep: a slow endpoint leaves the last trials to faster ones that would
+finish them sooner, and an idle fast endpoint re-runs a trial that a slow
+one is still working on. Whichever copy finishes first is kept, and the
+other is stopped by cutting its connection, so a straggler does not hold
+up the end of the sweep; its endpoint reconnects for its next trial. If a
+connection drops or a reply times out, the trial goes back on the queue
+and the endpoint reconnects; an endpoint that keeps failing is retired.
+
+Results are streamed to the same JSON-lines format as SweepRunner, so a
+sweep can be resumed, and ``report()`` gives per-endpoint utilisation.
+
+EXAMPLES:
+
+    >>> scheduler = SweepScheduler(trial, grid,
+    ...     ["box1:7236", "box2:7236", "box3:7236"], path="sweep.jsonl")
+    >>> scheduler.run()
+        600
+    >>> for node in scheduler.report():
+    ...     print(node["endpoint"], node["completed"], node["utilisation"])
+        box1:7236 311 0.98
+        box2:7236 204 0.97
+        box3:7236 85 0.91
+"""
+
+import json
+import socket
+import threading
+import time
+from collections import deque
+from socket import error as socket_error
+
+from SandpileRemote import RemoteTimeout, SandpileRemote
+from SweepRunner import load_results, trial_key
+
+
+def parse_endpoint(endpoint, default_port=7236):
+    r"""
+    Turns ``"host:port"``, ``"host"`` or ``(host, port)`` into a
+    ``(host, port)`` pair.
+    """
+    if isinstance(endpoint, (tuple, list)):
+        return endpoint[0], int(endpoint[1])
+    host, sep, port = endpoint.rpartition(":")
+    if not sep:
+        return endpoint, default_port
+    return host, int(port)
+
+
+class _Node:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.host, self.port = parse_endpoint(endpoint)
+        self.remote = None
+        self.alive = True
+        self.key = None
+        self.cancelled = False
+        self.started = None
+        self.mean_seconds = None
+        self.completed = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+
+    def name(self):
+        return "%s:%d" % (self.host, self.port)
+
+    def abort(self):
+        # Stops the trial this node is running by cutting its connection,
+        # which makes the trial's next send or receive fail.
+        self.cancelled = True
+        try:
+            self.remote.s.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, socket_error):
+            pass
+
+    def remaining(self, now):
+        # Expected seconds until this node is free.
+        if self.key is None:
+            return 0.0
+        if self.mean_seconds is None:
+            return float("inf")
+        return max(self.mean_seconds - (now - self.started), 0.0)
+
+
+class SweepScheduler:
+    r"""
+    Schedules trials over several Sandpile programs by measured throughput.
+    """
+
+    def __init__(self, trial, grid, endpoints, path=None, max_failures=3,
+                 backoff=1.0, smoothing=0.3):
+        r"""
+        Set up a distributed sweep.
+
+        INPUT:
+
+        - ``trial`` - A function called as ``trial(srem, params)`` with a
+          connected SandpileRemote. It should return a JSON serializable
+          value if ``path`` is given.
+
+        - ``grid`` - A list of dicts of parameters, e.g. from
+          ``parameter_grid()``.
+
+        - ``endpoints`` - A list of ``"host:port"`` strings or
+          ``(host, port)`` pairs.
+
+        - ``path`` (optional) - string; a JSON-lines file to append results
+          to. Trials already in it are skipped.
+
+        - ``max_failures`` (optional) - int; an endpoint is retired after
+          this many consecutive connection failures or timeouts. Default
+          is 3.
+
+        - ``backoff`` (optional) - float; seconds to wait before the first
+          reconnection attempt, doubled after each failure. Default is 1.
+
+        - ``smoothing`` (optional) - float; the weight of the latest trial
+          in each endpoint's running average trial time. Default is 0.3.
+
+        OUTPUT:
+
+        SweepScheduler
+
+        EXAMPLES::
+
+            >>> scheduler = SweepScheduler(trial, grid, ["box1:7236", "box2:7236"])
+        """
+        self.trial = trial
+        self.grid = list(grid)
+        self.path = path
+        self.max_failures = max_failures
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.nodes = [_Node(e) for e in endpoints]
+        self.results = dict()
+        self.errors = dict()
+        self.__lock = threading.Condition()
+        self.__elapsed = 0.0
+        self.__params = dict()
+
+    def __done(self):
+        return not self.__queue and not self.__running
+
+    def __faster_nodes_first(self, node, now):
+        # The number of other nodes that would finish a trial before this
+        # one could, counting the time to finish what they are doing.
+        if node.mean_seconds is None:
+            return 0
+        return sum(1 for n in self.nodes
+                   if n is not node and n.alive and n.mean_seconds is not None
+                   and n.remaining(now) + n.mean_seconds < node.mean_seconds)
+
+    def __next_trial(self, node):
+        # Called with the lock held. Returns a key, or None when finished.
+        while True:
+            if self.__done():
+                return None
+            now = time.time()
+            if self.__queue:
+                if len(self.__queue) > self.__faster_nodes_first(node, now):
+                    return self.__queue.popleft()
+            else:
+                # Steal the trial that is expected to finish last, if this
+                # node would finish it sooner.
+                best = None
+                for n in self.nodes:
+                    if (n is node or n.key is None or self.__finished(n.key)
+                            or len(self.__running.get(n.key, ())) > 1):
+                        continue
+                    if best is None or n.remaining(now) > best.remaining(now):
+                        best = n
+                if best is not None and node.mean_seconds is not None \
+                        and node.mean_seconds < best.remaining(now):
+                    return best.key
+            self.__lock.wait(0.05)
+
+    def __finished(self, key):
+        return key in self.results or key in self.errors
+
+    def __connect(self, node):
+        delay = self.backoff
+        attempts = 0
+        while True:
+            try:
+                remote = SandpileRemote()
+                remote.connect(node.host, node.port)
+                node.remote = remote
+                return True
+            except socket_error:
+                node.failures += 1
+                attempts += 1
+                if attempts >= self.max_failures:
+                    return False
+                time.sleep(delay)
+                delay *= 2
+
+    def __finish(self, node, key, record):
+        # Called with the lock held.
+        if self.__finished(key):
+            node.duplicates += 1
+            return
+        if "error" in record:
+            node.errors += 1
+            self.errors[key] = record["error"]
+        else:
+            node.completed += 1
+            self.results[key] = record["result"]
+        for n in self.nodes:
+            if n is not node and n.key == key:
+                n.abort()
+        self.__running.pop(key, None)
+        if key in self.__queue:
+            self.__queue.remove(key)
+        if self.__out is not None:
+            self.__out.write(json.dumps(record) + "\n")
+            self.__out.flush()
+
+    def __work(self, node):
+        consecutive = 0
+        while True:
+            with self.__lock:
+                key = self.__next_trial(node)
+                if key is None:
+                    break
+                node.key, node.started = key, time.time()
+                self.__running.setdefault(key, set()).add(node.endpoint)
+            if node.remote is None and not self.__connect(node):
+                with self.__lock:
+                    node.alive = False
+                    node.key = None
+                    self.__requeue(node, key)
+                    self.__lock.notify_all()
+                break
+            params = self.__params[key]
+            record = {"params": params, "endpoint": node.name()}
+            dropped = False
+            try:
+                with self.__lock:
+                    if self.__finished(key):
+                        node.abort()
+                record["result"] = self.trial(node.remote, params)
+                consecutive = 0
+            except (socket_error, EOFError, RemoteTimeout):
+                dropped = True
+            except Exception as e:
+                record["error"] = repr(e)
+            with self.__lock:
+                cancelled, node.cancelled = node.cancelled, False
+            if cancelled:
+                # Another endpoint finished this trial first and cut the
+                # connection; whatever the trial raised is not its fault.
+                node.remote.close()
+                node.remote = None
+                if "result" not in record:
+                    with self.__lock:
+                        node.key = None
+                        node.duplicates += 1
+                        self.__lock.notify_all()
+                    continue
+            if dropped:
+                # A timeout closes the connection too; see receive().
+                try:
+                    node.remote.close()
+                except socket_error:
+                    pass
+                node.remote = None
+                node.failures += 1
+                consecutive += 1
+                with self.__lock:
+                    node.key = None
+                    self.__requeue(node, key)
+                    if consecutive >= self.max_failures:
+                        node.alive = False
+                    self.__lock.notify_all()
+                if not node.alive:
+                    break
+                continue
+            seconds = time.time() - node.started
+            record["seconds"] = seconds
+            with self.__lock:
+                node.key = None
+                if not self.__finished(key):
+                    # Time spent on a copy that lost is not useful work.
+                    node.busy_seconds += seconds
+                if node.mean_seconds is None:
+                    node.mean_seconds = seconds
+                else:
+                    node.mean_seconds += self.smoothing * (seconds - node.mean_seconds)
+                self.__finish(node, key, record)
+                self.__lock.notify_all()
+        if node.remote is not None:
+            node.remote.close()
+            node.remote = None
+
+    def __requeue(self, node, key):
+        # Called with the lock held.
+        running = self.__running.get(key)
+        if running is None:
+            return
+        running.discard(node.endpoint)
+        if not running and not self.__finished(key):
+            del self.__running[key]
+            self.__queue.appendleft(key)
+
+    def run(self):
+        r"""
+        Runs every trial not already in the results file. Returns when all
+        trials are done or every endpoint has been retired.
+
+        INPUT:
+
+        None
+
+        OUTPUT:
+
+        int; the number of trials completed successfully in this run.
+
+        EXAMPLES::
+
+            >>> scheduler.run()
+                600
+        """
+        done = set()
+        if self.path is not None:
+            done = set(trial_key(r["params"]) for r in load_results(self.path))
+        self.__params = dict()
+        for p in self.grid:
+            key = trial_key(p)
+            if key not in done:
+                self.__params[key] = p
+        self.__queue = deque(self.__params)
+        self.__running = dict()
+        before = len(self.results)
+        self.__out = open(self.path, "a") if self.path is not None else None
+        start = time.time()
+        threads = [threading.Thread(target=self.__work, args=(n,)) for n in self.nodes]
+        try:
+            for t in threads:
+                t.daemon = True
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            self.__elapsed += time.time() - start
+            if self.__out is not None:
+                self.__out.close()
+                self.__out = None
+        return len(self.results) - before
+
+    def pending(self):
+        r"""
+        Returns the parameters of the trials that have not completed, e.g.
+        because every endpoint was retired.
+        """
+        return [self.__params[k] for k in self.__params
+                if k not in self.results and k not in self.errors]
+
+    def report(self):
+        r"""
+        Returns per-endpoint statistics for the runs so far.
+
+        OUTPUT:
+
+        A list of dicts, one per endpoint, with keys ``endpoint``,
+          ``alive``, ``completed``, ``errors``, ``duplicates`` (trials this
+          endpoint finished, or was stopped in, after another had already
+          done them),
+          ``failures`` (connection failures and timeouts), ``busy_seconds``
+          (time spent on trials whose result was kept, not on duplicates),
+          ``utilisation`` (busy time over wall time), ``mean_seconds`` and
+          ``throughput`` (trials per second of wall time).
+
+        EXAMPLES::
+
+            >>> scheduler.report()[0]["utilisation"]
+                0.98
+        """
+        elapsed = self.__elapsed or 1e-12
+        return [{"endpoint": n.name(),
+                 "alive": n.alive,
+                 "completed": n.completed,
+                 "errors": n.errors,
+                 "duplicates": n.duplicates,
+                 "failures": n.failures,
+                 "busy_seconds": n.busy_seconds,
+                 "utilisation": n.busy_seconds / elapsed,
+                 "mean_seconds": n.mean_seconds,
+                 "throughput": n.completed / elapsed}
+                for n in self.nodes]
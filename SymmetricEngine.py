@@ -0,0 +1,291 @@
+r"""
+Symmetric Engine
+
+Stabilization of symmetric configurations on symmetric graphs, on one
+fundamental domain of the symmetry instead of the whole graph.
+
+An automorphism of the graph is a permutation of the vertices that maps
+every edge to an edge of the same weight. If a configuration is unchanged
+by a group of automorphisms, then so is its stabilization, and so is its
+odometer: every vertex of an orbit fires as often as the others. The whole
+avalanche can therefore be followed on one vertex per orbit, in a quotient
+graph where firing an orbit's representative loses its out-degree and
+sends to the representative of each orbit what one of its vertices would
+get if the whole orbit fired. Edges that leave the domain are reflected
+back into it this way. On a square grid with the sinks around it, such as
+``grid_graph(n, n)``, the eight symmetries of the square cut the work and
+memory by up to 8 times.
+
+The symmetries of graphs laid out on a square lattice (the reflections,
+and for square lattices the rotations) are found from the vertex
+positions, or any automorphisms can be given. For each configuration,
+stabilize() uses those that leave it unchanged and falls back to the whole
+graph if there are none. Results are unfolded back to one value per
+vertex, indexed like the program's.
+
+EXAMPLES:
+
+    >>> positions, edges = grid_graph(101, 101)
+    >>> engine = SymmetricEngine.from_graph(positions, edges)
+    >>> len(engine.automorphisms)
+        7
+    >>> config = engine.engine.max_stable()
+    >>> config[5100] += 10**5
+    >>> stable, odometer = engine.stabilize(config)
+    >>> engine.quotient(config).num_vertices
+        1377
+"""
+
+import numpy as np
+
+from ConfigRenderer import lattice_cells
+from SandpileEngine import SandpileEngine
+
+
+def check_automorphism(engine, permutation):
+    r"""
+    Checks whether a permutation of the vertices is an automorphism of an
+    engine's graph.
+
+    INPUT:
+
+    - ``engine`` - A SandpileEngine.
+
+    - ``permutation`` - An int array; ``permutation[v]`` is the image of
+      vertex ``v``.
+
+    OUTPUT:
+
+    bool
+    """
+    n = engine.num_vertices
+    permutation = np.asarray(permutation, dtype=np.int64)
+    if permutation.shape != (n,) or not np.array_equal(np.sort(permutation), np.arange(n)):
+        return False
+    sources = np.repeat(np.arange(n), np.diff(engine.indptr))
+    keys = sources * n + engine.indices
+    mapped = permutation[sources] * n + permutation[engine.indices]
+    order = np.argsort(mapped, kind="stable")
+    return (np.array_equal(np.sort(keys), mapped[order])
+            and np.array_equal(engine.weights[np.argsort(keys, kind="stable")],
+                               engine.weights[order]))
+
+
+def grid_automorphisms(positions, engine):
+    r"""
+    Returns the symmetries of a graph laid out on a square lattice: those
+    of the reflections of the lattice in its middle row, column and (for a
+    square lattice) diagonals, and of its rotations, that are automorphisms
+    of the graph.
+
+    INPUT:
+
+    - ``positions`` - A list of lists of floats, as given by
+      ``get_vertices()``.
+
+    - ``engine`` - A SandpileEngine for the graph.
+
+    OUTPUT:
+
+    A list of int arrays, as for check_automorphism(), without the
+      identity; empty if the positions are not on a lattice.
+
+    EXAMPLES::
+
+        >>> positions, edges = grid_graph(20, 30)
+        >>> len(grid_automorphisms(positions, SandpileEngine(len(positions), edges)))
+            3
+    """
+    cells = lattice_cells(positions)
+    if cells is None:
+        return []
+    rows, cols, (height, width) = cells
+    vertex = np.full((height, width), -1, dtype=np.int64)
+    vertex[rows, cols] = np.arange(len(rows))
+    flip_r, flip_c = height - 1 - rows, width - 1 - cols
+    transforms = [(flip_r, cols), (rows, flip_c), (flip_r, flip_c)]
+    if height == width:
+        transforms += [(cols, rows), (flip_c, flip_r), (cols, flip_r), (flip_c, rows)]
+    automorphisms = []
+    for r, c in transforms:
+        permutation = vertex[r, c]
+        if (permutation >= 0).all() and check_automorphism(engine, permutation):
+            automorphisms.append(permutation)
+    return automorphisms
+
+
+class _Rounds:
+    # Takes the place of an AvalancheStats to find the duration of an
+    # avalanche on the quotient.
+
+    def record(self, size, area, duration):
+        self.duration = duration
+
+
+class SymmetricEngine:
+    r"""
+    A SandpileEngine together with automorphisms of its graph, to
+    stabilize symmetric configurations on a quotient graph.
+
+    engine - The SandpileEngine for the whole graph.
+
+    automorphisms - The list of automorphisms, as int arrays.
+    """
+
+    def __init__(self, engine, automorphisms):
+        r"""
+        Binds automorphisms to an engine.
+
+        INPUT:
+
+        - ``engine`` - A SandpileEngine.
+
+        - ``automorphisms`` - A list of permutations of the vertices, as
+          for check_automorphism(). For a configuration, those of them that
+          leave it unchanged generate the symmetry used, so listing a whole
+          group rather than generators lets more configurations use some
+          of it.
+
+        OUTPUT:
+
+        SymmetricEngine; raises ValueError if a permutation is not an
+          automorphism.
+
+        EXAMPLES::
+
+            >>> engine = SandpileEngine(3, [[0, 1, 1], [2, 1, 1], [1, 0, 1], [1, 2, 1]])
+            >>> symmetric = SymmetricEngine(engine, [[2, 1, 0]])
+        """
+        self.engine = engine
+        self.automorphisms = []
+        for permutation in automorphisms:
+            if not check_automorphism(engine, permutation):
+                raise ValueError("not an automorphism of the graph")
+            self.automorphisms.append(np.asarray(permutation, dtype=np.int64))
+        # (quotient engine, representatives, orbit of each vertex) by the
+        # automorphisms used.
+        self.__quotients = dict()
+
+    @classmethod
+    def from_graph(cls, positions, edges):
+        r"""
+        Builds an engine for a graph, with the symmetries found by
+        grid_automorphisms().
+
+        INPUT:
+
+        - ``positions``, ``edges`` - As given by ``get_vertices()`` and
+          ``get_edges()``.
+
+        OUTPUT:
+
+        SymmetricEngine
+        """
+        engine = SandpileEngine(len(positions), edges)
+        return cls(engine, grid_automorphisms(positions, engine))
+
+    @classmethod
+    def from_remote(cls, srem):
+        r"""
+        Builds an engine for the graph currently in the program.
+
+        INPUT:
+
+        - ``srem`` - A connected SandpileRemote.
+
+        OUTPUT:
+
+        SymmetricEngine
+
+        EXAMPLES::
+
+            >>> engine = SymmetricEngine.from_remote(srem)
+        """
+        return cls.from_graph(srem.get_vertices(), srem.get_edges())
+
+    def __fixing(self, config):
+        # The indices of the automorphisms that leave config unchanged.
+        return tuple(i for i, permutation in enumerate(self.automorphisms)
+                     if np.array_equal(config[permutation], config))
+
+    def __quotient(self, used):
+        if used not in self.__quotients:
+            engine = self.engine
+            n = engine.num_vertices
+            # Label each vertex with the least vertex of its orbit.
+            labels = np.arange(n)
+            while True:
+                new = labels
+                for i in used:
+                    new = np.minimum(new, new[self.automorphisms[i]])
+                if np.array_equal(new, labels):
+                    break
+                labels = new
+            representatives, orbits = np.unique(labels, return_inverse=True)
+            # Edges into representatives, from every vertex of each orbit.
+            sources = np.repeat(np.arange(n), np.diff(engine.indptr))
+            keep = labels[engine.indices] == engine.indices
+            edges = np.stack((orbits[sources[keep]], orbits[engine.indices[keep]],
+                              engine.weights[keep]), axis=1)
+            merged = SandpileEngine(len(representatives), edges)
+            quotient = SandpileEngine.from_csr(merged.indptr, merged.indices, merged.weights,
+                                               engine.degrees[representatives])
+            self.__quotients[used] = (quotient, representatives, orbits)
+        return self.__quotients[used]
+
+    def quotient(self, config):
+        r"""
+        Returns the quotient engine used for a configuration: one vertex
+        per orbit, numbered in the order of each orbit's least vertex.
+        Configurations on it are ``config[representatives(config)]``.
+        """
+        config = np.asarray(config, dtype=np.int64)
+        return self.__quotient(self.__fixing(config))[0]
+
+    def representatives(self, config):
+        r"""
+        Returns the least vertex of each orbit used for a configuration.
+        """
+        config = np.asarray(config, dtype=np.int64)
+        return self.__quotient(self.__fixing(config))[1].copy()
+
+    def stabilize(self, config, check_sinks=False, estimate=False, stats=None):
+        r"""
+        Stabilizes a configuration, on the quotient by the automorphisms
+        that leave it unchanged.
+
+        INPUT:
+
+        - ``config`` - A list or array of ints, one per vertex.
+
+        - ``check_sinks``, ``estimate``, ``stats`` (optional) - As for
+          ``SandpileEngine.stabilize()``.
+
+        OUTPUT:
+
+        A pair ``(stable, odometer)`` of int64 arrays over all the
+          vertices, as from ``SandpileEngine.stabilize()``.
+
+        EXAMPLES::
+
+            >>> stable, odometer = engine.stabilize(engine.engine.max_stable() + 1)
+        """
+        config = np.array(config, dtype=np.int64)
+        if config.shape != (self.engine.num_vertices,):
+            raise ValueError("expected %d values, got %d"
+                             % (self.engine.num_vertices, config.size))
+        used = self.__fixing(config)
+        if not used:
+            return self.engine.stabilize(config, check_sinks, estimate, stats)
+        if check_sinks:
+            self.engine.check_sinks_reachable()
+        quotient, representatives, orbits = self.__quotient(used)
+        rounds = _Rounds()
+        stable, odometer = quotient.stabilize(config[representatives], estimate=estimate,
+                                              stats=rounds)
+        odometer = odometer[orbits]
+        if stats is not None:
+            # Durations on the quotient are those on the whole graph, but
+            # sizes and areas are not, so record the unfolded avalanche.
+            stats.record(odometer.sum(), np.count_nonzero(odometer), rounds.duration)
+        return stable[orbits], odometer
@@ -0,0 +1,259 @@
+r"""
+Threaded Remote
+
+A SandpileRemote that many threads can use at once over one connection.
+
+SandpileRemote sends a command and then reads the next line as its reply,
+so two threads sharing it can read each other's replies. ThreadedRemote
+instead hands every command to a single I/O thread, which writes commands
+to the socket in the order they were submitted and hands each reply line
+back to the command it answers (the program replies in order). Each caller
+only waits for its own reply, so for example a thread watching the
+configuration for display can share the connection with a thread running
+a computation without either holding a lock across a round trip.
+
+All the methods of SandpileRemote work unchanged, since each thread's
+``receive()`` returns the reply to that thread's oldest outstanding
+``send()``.
+
+EXAMPLES:
+
+    >>> srem = ThreadedRemote()
+    >>> srem.connect()
+    >>> def watch():
+    ...     while True:
+    ...         frames.append(srem.get_config())
+    >>> threading.Thread(target=watch).start()
+    >>> srem.stabilize()
+"""
+
+import errno
+import select
+import threading
+from collections import deque
+from socket import socketpair, error as socket_error
+
+from FrameCodec import HEADER, decode_frame, encode_frame
+from SandpileRemote import SandpileRemote, RemoteTimeout
+
+_RETRY = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+class _Reply:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ThreadedRemote(SandpileRemote):
+    r"""
+    A thread-safe SandpileRemote that multiplexes commands from many
+    threads over one connection. The verbose and echo fields have no
+    effect.
+    """
+
+    def __init__(self):
+        r"""
+        Create an object to access the Sandpile program remotely from
+        several threads.
+
+        INPUT:
+
+        None
+
+        OUTPUT:
+
+        ThreadedRemote
+
+        EXAMPLES:
+
+        >>> srem = ThreadedRemote()
+        """
+        SandpileRemote.__init__(self)
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__requests = []
+        self.__thread = None
+        self.__error = None
+        self.s = self.f = self.__wake_r = self.__wake_w = None
+
+    def connect(self, host="localhost", port=7236, timeout=None,
+                compression=None, compress_threshold=1024, compress_level=1,
+                negotiate_timeout=2.0):
+        r"""
+        Connects to the Sandpile program and starts the I/O thread; see
+        SandpileRemote.connect. ``timeout`` limits how long each caller
+        waits for its reply. A caller that times out gets RemoteTimeout,
+        but since replies are matched by position the connection stays
+        usable for everyone else. Connecting again closes the previous
+        connection and forgets every thread's unanswered commands.
+        """
+        if self.__thread is not None:
+            self.close()
+        # Compression is negotiated before the I/O thread takes over.
+        SandpileRemote.connect(self, host, port, timeout, compression,
+                               compress_threshold, compress_level, negotiate_timeout)
+        self.s.setblocking(False)
+        self.__wake_r, self.__wake_w = socketpair()
+        self.__wake_r.setblocking(False)
+        self.__wake_w.setblocking(False)
+        self.__local = threading.local()
+        self.__requests = []
+        self.__error = None
+        self.__closing = False
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __wake(self):
+        try:
+            self.__wake_w.send(b"x")
+        except socket_error:
+            # The buffer is full, so the I/O thread is waking up anyway.
+            pass
+
+    def send(self, msg):
+        if self.compression is None:
+            data = (msg + "\n").encode()
+        else:
+            data = encode_frame(msg.encode(), self.compression,
+                                self.compress_threshold, self.compress_level)
+        reply = _Reply()
+        with self.__lock:
+            if self.__thread is None:
+                raise socket_error("not connected")
+            if self.__error is not None:
+                raise self.__error
+            self.__requests.append((data, reply))
+        self.__wake()
+        pending = getattr(self.__local, "pending", None)
+        if pending is None:
+            pending = self.__local.pending = deque()
+        pending.append(reply)
+
+    def receive(self, timeout=None):
+        pending = getattr(self.__local, "pending", None)
+        if not pending:
+            raise ValueError("receive() called without a matching send()")
+        reply = pending.popleft()
+        if timeout is None:
+            timeout = self.timeout
+        if not reply.event.wait(timeout):
+            raise RemoteTimeout("no reply from the Sandpile program")
+        if reply.error is not None:
+            raise reply.error
+        return reply.value
+
+    def pipeline(self, msgs):
+        r"""
+        Sends several messages and returns the replies in order; see
+        SandpileRemote.pipeline. The I/O thread already overlaps sending
+        and receiving, so this just queues them all before waiting.
+        """
+        for msg in msgs:
+            self.send(msg)
+        return [self.receive() for msg in msgs]
+
+    def __replies(self, incoming):
+        # Splits the complete replies off the front of incoming. Returns
+        # them and the number of bytes they took.
+        replies = []
+        start = 0
+        if self.compression is None:
+            while True:
+                end = incoming.find(b"\n", start)
+                if end < 0:
+                    break
+                replies.append(incoming[start:end].decode() + "\n")
+                start = end + 1
+        else:
+            while len(incoming) - start >= HEADER.size:
+                tag, length = HEADER.unpack_from(incoming, start)
+                end = start + HEADER.size + length
+                if end > len(incoming):
+                    break
+                payload = bytes(incoming[start + HEADER.size:end])
+                replies.append(decode_frame(tag, payload).decode() + "\n")
+                start = end
+        return replies, start
+
+    def __run(self):
+        outgoing = bytearray()
+        incoming = bytearray()
+        # Bytes of incoming already known not to finish a line.
+        scanned = 0
+        in_flight = deque()
+        try:
+            while True:
+                writers = [self.s] if outgoing else []
+                readable, writable, _ = select.select([self.s, self.__wake_r], writers, [])
+                if self.__wake_r in readable:
+                    try:
+                        self.__wake_r.recv(4096)
+                    except socket_error:
+                        pass
+                    with self.__lock:
+                        requests, self.__requests = self.__requests, []
+                    for data, reply in requests:
+                        outgoing += data
+                        in_flight.append(reply)
+                if writable:
+                    try:
+                        sent = self.s.send(outgoing)
+                        del outgoing[:sent]
+                    except socket_error as e:
+                        if e.errno not in _RETRY:
+                            raise
+                if self.s in readable:
+                    try:
+                        data = self.s.recv(65536)
+                    except socket_error as e:
+                        if e.errno not in _RETRY:
+                            raise
+                        data = None
+                    if data is None:
+                        pass
+                    elif not data:
+                        raise socket_error("connection closed by the Sandpile program")
+                    else:
+                        incoming += data
+                        # Only look for replies once one can have ended,
+                        # so a long reply is not rescanned on every recv.
+                        if self.compression is not None or incoming.find(b"\n", scanned) >= 0:
+                            replies, used = self.__replies(incoming)
+                            del incoming[:used]
+                            for value in replies:
+                                reply = in_flight.popleft()
+                                reply.value = value
+                                reply.event.set()
+                        scanned = len(incoming)
+                with self.__lock:
+                    if self.__closing and not outgoing and not in_flight and not self.__requests:
+                        return
+        except Exception as e:
+            error = e if isinstance(e, socket_error) else socket_error(str(e))
+            with self.__lock:
+                self.__error = error
+                requests, self.__requests = self.__requests, []
+            for reply in list(in_flight) + [r for d, r in requests]:
+                reply.error = error
+                reply.event.set()
+
+    def close(self):
+        r"""
+        Waits for outstanding commands to be answered, then stops the I/O
+        thread and closes the connection.
+        """
+        if self.__thread is not None:
+            with self.__lock:
+                self.__closing = True
+            self.__wake()
+            self.__thread.join()
+            with self.__lock:
+                self.__thread = None
+        for f in (self.f, self.s, self.__wake_r, self.__wake_w):
+            if f is not None:
+                f.close()
@@ -0,0 +1,445 @@
+r"""
+Trajectory Recorder
+
+Classes for recording the sequence of configurations produced by repeated
+calls to ``update()`` and for reading them back with random access.
+
+Each step is stored as a sparse delta (the vertices whose sand changed and
+by how much) and every ``keyframe_interval`` steps a full configuration is
+written. Records are zlib compressed and appended to the log, so a crashed
+run leaves a readable file. Seeking to a step only replays the deltas since
+the nearest keyframe.
+
+Note that the program can only hand back whole configurations, so capturing
+a step still costs one ``get_config``; it is the storage that is O(changes).
+
+Given a VertexOrder, configurations are stored renumbered in that order,
+where the changes of a step fall in runs that compress better. The order
+is saved in the log, and TrajectoryReader gives everything back in the
+original numbering.
+
+EXAMPLES:
+
+    >>> srem = SandpileRemote()
+    >>> srem.connect()
+    >>> rec = TrajectoryRecorder(srem, "relax.traj", keyframe_interval=50)
+    >>> rec.run_until_stable()
+        212
+    >>> rec.close()
+    >>> reader = TrajectoryReader("relax.traj")
+    >>> len(reader)
+        213
+    >>> reader.config_at(100)[:5]
+        [3, 2, 3, 1, 0]
+"""
+
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+
+MAGIC = b"SPTRAJ1\n"
+# The same, followed by a vertex order after the header.
+ORDERED_MAGIC = b"SPTRAJ2\n"
+KEYFRAME = b"K"
+DELTA = b"D"
+
+# kind, step, number of entries, compressed payload length
+_RECORD = struct.Struct("<cIII")
+_HEADER = struct.Struct("<I")
+# number of vertices, compressed payload length
+_ORDER = struct.Struct("<II")
+# The array typecode of a 4-byte unsigned int; "I" is only guaranteed to
+# be at least 2 bytes.
+_U32 = next(code for code in "IL" if array(code).itemsize == 4)
+
+
+def _pack(typecode, values):
+    try:
+        arr = array(typecode, values)
+    except OverflowError:
+        raise ValueError("cannot record a value outside the range of a 64-bit integer")
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _unpack(typecode, data):
+    arr = array(typecode)
+    arr.frombytes(data)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def _to_original(order, config):
+    # The values of a renumbered configuration by original vertex.
+    result = [0] * len(order)
+    for i, v in enumerate(order):
+        result[v] = config[i]
+    return result
+
+
+class TrajectoryRecorder:
+    r"""
+    Records the configuration of the program after every step to an
+    append-only, compressed log.
+
+    ``remote`` can be anything with ``update()``, ``get_config()`` and
+    ``get_num_unstables()`` methods, e.g. a SandpileRemote. If ``path``
+    already holds a trajectory, new steps are appended after it.
+    """
+
+    def __init__(self, remote, path, keyframe_interval=100, level=6, order=None):
+        r"""
+        Open (or continue) a trajectory log.
+
+        INPUT:
+
+        - ``remote`` - A connected SandpileRemote (or compatible object).
+
+        - ``path`` - string; the file to append to.
+
+        - ``keyframe_interval`` (optional) - int; a full configuration is
+          written every this many steps. Default is 100.
+
+        - ``level`` (optional) - int; the zlib compression level. Default
+          is 6.
+
+        - ``order`` (optional) - A VertexOrder to store configurations in.
+          When appending to a log, it must be the log's order. Default is
+          the original numbering.
+
+        OUTPUT:
+
+        TrajectoryRecorder; raises ValueError if ``order`` differs from
+          that of the log being appended to.
+
+        EXAMPLES::
+
+            >>> rec = TrajectoryRecorder(srem, "relax.traj")
+        """
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be at least 1")
+        self.remote = remote
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self.order = None if order is None else [int(v) for v in order.order]
+        self.last_config = None
+        self.num_steps = 0
+        self.__since_keyframe = 0
+        reader = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            reader = TrajectoryReader(path)
+            if reader.order != self.order and len(reader) > 0:
+                reader.close()
+                raise ValueError("%s is stored in a different vertex order" % path)
+        if reader is not None and len(reader) > 0:
+            self.num_steps = len(reader)
+            self.last_config = self.__local(reader.config_at(self.num_steps - 1))
+            self.__since_keyframe = self.num_steps - 1 - reader.keyframe_before(self.num_steps - 1)
+            end = reader.end
+            reader.close()
+            self.f = open(path, "r+b")
+            self.f.truncate(end)
+            self.f.seek(end)
+        else:
+            if reader is not None:
+                reader.close()
+            self.f = open(path, "wb")
+            self.f.write(MAGIC if self.order is None else ORDERED_MAGIC)
+            self.f.write(_HEADER.pack(keyframe_interval))
+            if self.order is not None:
+                data = zlib.compress(_pack(_U32, self.order), self.level)
+                self.f.write(_ORDER.pack(len(self.order), len(data)))
+                self.f.write(data)
+            self.f.flush()
+
+    def __local(self, config):
+        if self.order is None:
+            return list(config)
+        return [config[v] for v in self.order]
+
+    def __write(self, kind, count, payload):
+        data = zlib.compress(payload, self.level)
+        self.f.write(_RECORD.pack(kind, self.num_steps, count, len(data)))
+        self.f.write(data)
+        self.f.flush()
+        self.num_steps += 1
+
+    def record(self, config=None):
+        r"""
+        Appends a configuration to the log as the next step.
+
+        INPUT:
+
+        - ``config`` (optional) - A list of ints. If not given, the current
+          configuration is fetched from the program.
+
+        OUTPUT:
+
+        int; the number of vertices that changed since the previous step.
+          On a keyframe every vertex counts as changed. Raises ValueError
+          if a pile, or the change in one, does not fit in a 64-bit integer.
+
+        EXAMPLES::
+
+            >>> rec.record()
+                480
+        """
+        if config is None:
+            config = self.remote.get_config()
+        config = self.__local(config)
+        last = self.last_config
+        if (last is None or len(last) != len(config)
+                or self.__since_keyframe + 1 >= self.keyframe_interval):
+            self.__write(KEYFRAME, len(config), _pack("q", config))
+            self.__since_keyframe = 0
+            changed = len(config)
+        else:
+            indices = [i for i in range(len(config)) if config[i] != last[i]]
+            gaps = [indices[0]] if indices else []
+            gaps.extend(indices[k] - indices[k - 1] for k in range(1, len(indices)))
+            diffs = [config[i] - last[i] for i in indices]
+            self.__write(DELTA, len(indices), _pack(_U32, gaps) + _pack("q", diffs))
+            self.__since_keyframe += 1
+            changed = len(indices)
+        self.last_config = config
+        return changed
+
+    def update(self):
+        r"""
+        Tells the program to fire all unstable vertices and records the
+        resulting configuration.
+
+        INPUT:
+
+        None
+
+        OUTPUT:
+
+        int; the number of vertices that changed.
+
+        EXAMPLES::
+
+            >>> rec.update()
+                37
+        """
+        if self.last_config is None:
+            self.record()
+        self.remote.update()
+        return self.record()
+
+    def run(self, steps):
+        r"""
+        Calls ``update()`` ``steps`` times, recording after each.
+
+        INPUT:
+
+        - ``steps`` - int; the number of updates.
+
+        OUTPUT:
+
+        None
+
+        EXAMPLES::
+
+            >>> rec.run(1000)
+        """
+        for i in range(steps):
+            self.update()
+
+    def run_until_stable(self, max_steps=None):
+        r"""
+        Updates and records until there are no unstable vertices left.
+
+        Warning: like ``stabilize()``, this will not return if there is no
+        global sink unless ``max_steps`` is given.
+
+        INPUT:
+
+        - ``max_steps`` (optional) - int; stop after this many updates.
+
+        OUTPUT:
+
+        int; the number of updates performed.
+
+        EXAMPLES::
+
+            >>> rec.run_until_stable()
+                212
+        """
+        if self.last_config is None:
+            self.record()
+        steps = 0
+        while self.remote.get_num_unstables() > 0:
+            if max_steps is not None and steps >= max_steps:
+                break
+            self.update()
+            steps += 1
+        return steps
+
+    def close(self):
+        r"""
+        Closes the log file. The remote connection is left open.
+        """
+        self.f.close()
+
+
+class TrajectoryReader:
+    r"""
+    Random access to a log written by TrajectoryRecorder.
+
+    Opening the log scans the record headers (without decompressing
+    anything) to build an index of step offsets and keyframes. A trailing
+    record that was cut short, e.g. by a crash, is ignored.
+    """
+
+    def __init__(self, path):
+        r"""
+        Open a trajectory log for reading.
+
+        INPUT:
+
+        - ``path`` - string; the log file.
+
+        OUTPUT:
+
+        TrajectoryReader
+
+        EXAMPLES::
+
+            >>> reader = TrajectoryReader("relax.traj")
+        """
+        self.f = open(path, "rb")
+        magic = self.f.read(len(MAGIC))
+        if magic not in (MAGIC, ORDERED_MAGIC):
+            self.f.close()
+            raise IOError("%s is not a trajectory log" % path)
+        self.keyframe_interval = _HEADER.unpack(self.f.read(_HEADER.size))[0]
+        # The original vertex at each stored position, or None.
+        self.order = None
+        if magic == ORDERED_MAGIC:
+            count, length = _ORDER.unpack(self.f.read(_ORDER.size))
+            self.order = _unpack(_U32, zlib.decompress(self.f.read(length))).tolist()
+        self.offsets = []
+        self.keyframes = []
+        self.__cache = None
+        self.end = self.f.tell()
+        self.f.seek(0, 2)
+        size = self.f.tell()
+        while self.end + _RECORD.size <= size:
+            self.f.seek(self.end)
+            kind, step, count, length = _RECORD.unpack(self.f.read(_RECORD.size))
+            if self.end + _RECORD.size + length > size:
+                # A record cut short, e.g. by a crash.
+                break
+            if step != len(self.offsets):
+                raise IOError("corrupt trajectory log: expected step %d, found %d"
+                              % (len(self.offsets), step))
+            if kind == KEYFRAME:
+                self.keyframes.append(step)
+            self.offsets.append(self.end)
+            self.end += _RECORD.size + length
+
+    def __read(self, step):
+        self.f.seek(self.offsets[step])
+        kind, s, count, length = _RECORD.unpack(self.f.read(_RECORD.size))
+        return kind, count, zlib.decompress(self.f.read(length))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        self.f.close()
+
+    def keyframe_before(self, step):
+        r"""
+        Returns the step of the last keyframe at or before ``step``.
+        """
+        return self.keyframes[bisect_right(self.keyframes, step) - 1]
+
+    def changes_at(self, step):
+        r"""
+        Returns the sparse change recorded at a step.
+
+        INPUT:
+
+        - ``step`` - int; the step.
+
+        OUTPUT:
+
+        A pair of lists ``(vertices, differences)``, or None if the step is
+          a keyframe. Vertices are in increasing order unless the log is
+          stored in a vertex order.
+
+        EXAMPLES::
+
+            >>> reader.changes_at(3)
+                ([189, 190, 209, 210], [-4, -4, -4, -4])
+        """
+        changes = self.__changes_at(step)
+        if changes is None or self.order is None:
+            return changes
+        vertices, diffs = changes
+        return [self.order[v] for v in vertices], diffs
+
+    def __changes_at(self, step):
+        kind, count, payload = self.__read(step)
+        if kind == KEYFRAME:
+            return None
+        gaps = _unpack(_U32, payload[:4 * count])
+        diffs = _unpack("q", payload[4 * count:])
+        vertices = []
+        v = 0
+        for g in gaps:
+            v += g
+            vertices.append(v)
+        return vertices, list(diffs)
+
+    def config_at(self, step):
+        r"""
+        Returns the configuration after the given step.
+
+        INPUT:
+
+        - ``step`` - int; the step. Negative values count from the end.
+
+        OUTPUT:
+
+        A list of ints.
+
+        EXAMPLES::
+
+            >>> reader.config_at(-1)
+                [3, 2, 3, 3, 0]
+        """
+        if step < 0:
+            step += len(self)
+        if step < 0 or step >= len(self):
+            raise IndexError("step out of range")
+        start = self.keyframe_before(step)
+        cache = self.__cache
+        if cache is not None and start <= cache[0] <= step:
+            start, config = cache[0], array("q", cache[1])
+        else:
+            kind, count, payload = self.__read(start)
+            config = _unpack("q", payload)
+        for s in range(start + 1, step + 1):
+            vertices, diffs = self.__changes_at(s)
+            for i in range(len(vertices)):
+                config[vertices[i]] += diffs[i]
+        self.__cache = (step, config)
+        if self.order is not None:
+            return _to_original(self.order, config)
+        return config.tolist()
+
+    def __getitem__(self, step):
+        return self.config_at(step)
+
+    def __iter__(self):
+        for step in range(len(self)):
+            yield self.config_at(step)
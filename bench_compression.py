@@ -0,0 +1,99 @@
+r"""
+Benchmark of the compressed transport.
+
+Times ``get_config`` and ``set_config`` on square grids of several sizes
+against a local SandpileServer throttled to several bandwidths, with and
+without compression, and reports for each bandwidth the smallest grid from
+which compression stays faster. Messages below the compression threshold
+(1024 bytes by default) are sent raw either way.
+
+Run with ``python bench_compression.py``; pass ``--quick`` for a shorter
+run.
+"""
+
+import random
+import sys
+import time
+import zlib
+
+from FrameCodec import CODECS
+from SandpileRemote import SandpileRemote
+from SandpileServer import SandpileServer
+
+SIZES = [10, 30, 100, 300, 1000]
+BANDWIDTHS = [1e6, 1e7, 1e8, None]
+REPEATS = 3
+THRESHOLD = 1024
+
+
+def load_grid(server, n, seed=0):
+    # Only the configuration matters for these commands, so fill the
+    # server's state directly instead of uploading a graph.
+    rng = random.Random(seed)
+    num_vertices = n * n
+    state = server.state
+    state.delete_graph()
+    state.positions = [(0.0, 0.0)] * num_vertices
+    state.config = [rng.randint(0, 3) for i in range(num_vertices)]
+    return list(state.config)
+
+
+def best_time(f, repeats):
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        f()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(sizes=SIZES, bandwidths=BANDWIDTHS, repeats=REPEATS):
+    codecs = [None] + sorted(CODECS)
+    print("%8s %10s %10s %12s  %s" % ("vertices", "raw bytes", "zlib bytes",
+                                      "bandwidth", "  ".join("%14s" % (c or "raw")
+                                                             for c in codecs)))
+    crossover = dict()
+    for bandwidth in bandwidths:
+        server = SandpileServer(port=0, bandwidth=bandwidth).start()
+        for n in sizes:
+            config = load_grid(server, n)
+            raw = ",".join(map(str, config)).encode()
+            packed = zlib.compress(raw, 1)
+            times = []
+            for codec in codecs:
+                srem = SandpileRemote()
+                srem.auto_repaint = False
+                srem.connect(port=server.port, compression=codec,
+                             compress_threshold=THRESHOLD)
+                t = best_time(lambda: srem.get_config(), repeats)
+                t += best_time(lambda: srem.set_config(config), repeats)
+                srem.close()
+                times.append(t)
+            label = "unlimited" if bandwidth is None else "%.0e B/s" % bandwidth
+            print("%8d %10d %10d %12s  %s" % (n * n, len(raw), len(packed), label,
+                                              "  ".join("%13.4fs" % t for t in times)))
+            # The crossover is the smallest size from which compression
+            # stays ahead. Below the threshold both sides send raw, so the
+            # timings only differ by noise.
+            if len(raw) < THRESHOLD:
+                continue
+            if min(times[1:]) < times[0]:
+                crossover.setdefault(bandwidth, n * n)
+            else:
+                crossover.pop(bandwidth, None)
+        server.stop()
+    print("")
+    for bandwidth in bandwidths:
+        label = "unlimited" if bandwidth is None else "%.0e B/s" % bandwidth
+        if bandwidth in crossover:
+            print("%12s: compression wins from %d vertices" % (label, crossover[bandwidth]))
+        else:
+            print("%12s: compression never won" % label)
+
+
+if __name__ == "__main__":
+    if "--quick" in sys.argv:
+        main(sizes=[10, 100, 300], bandwidths=[1e6, 1e8, None], repeats=2)
+    else:
+        main()
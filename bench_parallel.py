@@ -0,0 +1,50 @@
+r"""
+Benchmark of ParallelEngine.
+
+Stabilizes a large pile in the middle of a square grid with SandpileEngine
+and with ParallelEngine on 1, 2, 4, ... worker processes up to the number
+of CPUs, checks that every result matches the serial one exactly, and
+prints the times and speedups.
+
+Run with ``python bench_parallel.py [size] [grains]``; the defaults are a
+300x300 grid and 200000 grains.
+"""
+
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from GridEngine import grid_graph
+from ParallelEngine import ParallelEngine
+from SandpileEngine import SandpileEngine
+
+
+def main(size=300, grains=200000):
+    positions, edges = grid_graph(size, size)
+    num_vertices = len(positions)
+    config = np.zeros(num_vertices, dtype=np.int64)
+    config[(size // 2) * size + size // 2] = grains
+
+    start = time.time()
+    stable, odometer = SandpileEngine(num_vertices, edges).stabilize(config)
+    serial = time.time() - start
+    print("%d x %d grid, %d grains, %d firings" % (size, size, grains, odometer.sum()))
+    print("%10s %10s %8s" % ("processes", "seconds", "speedup"))
+    print("%10s %10.2f %8.2f" % ("serial", serial, 1.0))
+
+    processes = 1
+    while processes <= multiprocessing.cpu_count():
+        engine = ParallelEngine(num_vertices, edges, processes)
+        start = time.time()
+        result = engine.stabilize(config)
+        elapsed = time.time() - start
+        if not ((result[0] == stable).all() and (result[1] == odometer).all()):
+            raise AssertionError("%d processes gave a different result" % processes)
+        print("%10d %10.2f %8.2f" % (processes, elapsed, serial / elapsed))
+        processes *= 2
+
+
+if __name__ == "__main__":
+    main(*[int(float(x)) for x in sys.argv[1:3]])
@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+
+from AvalancheStats import AvalancheStats
+from GridEngine import grid_graph
+from SandpileEngine import SandpileEngine
+
+
+def test_stabilize_records_size_area_duration():
+    engine = SandpileEngine(3, [[0, 1, 1], [1, 0, 1], [1, 2, 1]])
+    stats = AvalancheStats()
+    engine.stabilize([3, 0, 0], stats=stats)
+    engine.stabilize([0, 0, 0], stats=stats)
+    summary = stats.summary()
+    assert summary["count"] == 2
+    assert summary["size"]["max"] == 7 and summary["size"]["zeros"] == 1
+    assert summary["area"]["max"] == 2
+    assert summary["duration"]["max"] >= 1
+
+
+def test_stabilize_many_matches_one_at_a_time():
+    positions, edges = grid_graph(6, 6)
+    engine = SandpileEngine(len(positions), edges)
+    configs = np.random.default_rng(0).integers(0, 8, (20, len(positions)))
+    one, many = AvalancheStats(), AvalancheStats()
+    for config in configs:
+        engine.stabilize(config, stats=one)
+    engine.stabilize_many(configs, stats=many)
+    a, b = one.summary(), many.summary()
+    for name in ("size", "area", "duration"):
+        for key in ("count", "zeros", "mean", "variance", "max", "histogram"):
+            assert np.allclose(a[name][key], b[name][key])
+
+
+def test_empty_graph(tmp_path):
+    path = str(tmp_path / "stats.jsonl")
+    stats = AvalancheStats(path)
+    engine = SandpileEngine(0, [])
+    engine.stabilize([], stats=stats)
+    engine.stabilize_many(np.zeros((2, 0), dtype=np.int64), stats=stats)
+    stats.close()
+    with open(path) as f:
+        assert json.loads(f.readline())["count"] == 3
+
+
+def test_drive_fits_exponent():
+    positions, edges = grid_graph(16, 16)
+    engine = SandpileEngine(len(positions), edges)
+    stats = AvalancheStats(xmin=dict(size=4, area=4, duration=2))
+    stats.drive(engine, engine.max_stable(), 3000, seed=1)
+    assert stats.count == 3000
+    alpha, error = stats.exponents()["size"]
+    assert 1.0 < alpha < 2.0 and error > 0
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from ConfigArray import ConfigArray, fit_dtype
+
+
+def test_promotion_and_compact():
+    config = ConfigArray([1, 2, 3])
+    assert config.dtype == np.int32
+    config.add_sand(1, 2 ** 31)
+    assert config.dtype == np.int64 and config[1] == 2 ** 31 + 2
+    config += [10 ** 20, 0, 0]
+    assert config.dtype == object and config.tolist() == [10 ** 20 + 1, 2 ** 31 + 2, 3]
+    config -= [10 ** 20, 2 ** 31, 0]
+    assert config.tolist() == [1, 2, 3]
+    config.compact()
+    assert config.dtype == np.int32 and config.magnitude == 3
+    config.set_sand(0, -2 ** 40)
+    assert config.dtype == np.int64 and config[0] == -2 ** 40
+
+
+def test_repeated_vertices():
+    config = ConfigArray([0, 0])
+    config.add(2 ** 31 - 1, [0, 0, 0])
+    assert config.tolist() == [6442450941, 0]
+    config = ConfigArray([0, 0])
+    config.add([2 ** 62, 2 ** 62, 2 ** 62], [1, 1, 1])
+    assert config.tolist() == [0, 3 * 2 ** 62]
+    config = ConfigArray([5, 5])
+    config.add(-7, np.array([True, False]))
+    assert config.tolist() == [-2, 5] and config.dtype == np.int32
+
+
+def test_against_python_ints():
+    rng = np.random.default_rng(0)
+    config = ConfigArray.zeros(6)
+    expected = [0] * 6
+    for step in range(300):
+        amount = int(rng.integers(-2 ** 40, 2 ** 40)) << int(rng.integers(0, 40))
+        vertex = int(rng.integers(0, 6))
+        if rng.random() < 0.2:
+            config.set_sand(vertex, amount)
+            expected[vertex] = amount
+        else:
+            config.add_sand(vertex, amount)
+            expected[vertex] += amount
+        assert config.tolist() == expected
+    config.compact()
+    assert config.dtype == fit_dtype(max(map(abs, expected)))
+
+
+def test_array_conversion_does_not_wrap():
+    config = ConfigArray([2 ** 31, -1])
+    assert np.asarray(config).dtype == np.int64
+    assert np.asarray(config, dtype=np.float64).tolist() == [2.0 ** 31, -1.0]
+    with pytest.raises(OverflowError):
+        np.asarray(config, dtype=np.int32)
+    with pytest.raises(OverflowError):
+        np.asarray(ConfigArray([10 ** 20]), dtype=np.int64)
+    assert np.asarray(ConfigArray([3, -4]), dtype=np.int8).tolist() == [3, -4]
+
+
+def test_bad_values():
+    with pytest.raises(TypeError):
+        ConfigArray([1.5, 2.0])
+    with pytest.raises(ValueError):
+        ConfigArray([[1, 2]])
+    assert ConfigArray([]).tolist() == [] and ConfigArray([]) == []
@@ -0,0 +1,64 @@
+import pytest
+
+from ConfigHistory import ConfigHistory
+from GridEngine import grid_graph
+from SandpileRemote import SandpileRemote
+from SandpileServer import SandpileServer
+
+
+@pytest.fixture
+def srem():
+    server = SandpileServer(port=0).start()
+    srem = SandpileRemote()
+    srem.auto_repaint = False
+    srem.connect(port=server.port)
+    positions, edges = grid_graph(20, 20)
+    srem.add_vertices(positions)
+    srem.add_edges(edges)
+    yield srem
+    srem.close()
+    server.stop()
+
+
+def test_undo_redo(srem):
+    history = ConfigHistory(srem, chunk_size=50)
+    configs = [srem.get_config()]
+    for vertex in (5, 210, 399):
+        srem.add_sand(vertex, 100)
+        srem.stabilize()
+        assert history.commit() == len(configs)
+        configs.append(srem.get_config())
+    assert history.undo() == 2 and srem.get_config() == configs[2]
+    assert history.undo(5) == 0 and srem.get_config() == configs[0]
+    assert history.redo(2) == 2 and srem.get_config() == configs[2]
+    history.checkout(-1)
+    assert srem.get_config() == configs[3]
+    for step, config in enumerate(configs):
+        assert history.config_at(step) == config
+    with pytest.raises(IndexError):
+        history.checkout(4)
+
+
+def test_commit_after_undo_drops_redo(srem):
+    history = ConfigHistory(srem)
+    srem.add_sand(0, 3)
+    history.commit()
+    srem.add_sand(0, 3)
+    history.commit()
+    history.undo(2)
+    srem.set_sand(7, 2 ** 40)
+    assert history.commit() == 1 and len(history) == 2
+    assert history.redo() == 1 and history.config_at(1)[7] == 2 ** 40
+    history.undo()
+    assert srem.get_sand(7) == 0
+
+
+def test_unchanged_chunks_are_shared(srem):
+    history = ConfigHistory(srem, chunk_size=40)
+    first = history.memory()
+    for step in range(10):
+        srem.add_sand(3, 1)
+        history.commit()
+    # Only the first chunk changes, so each step costs one chunk.
+    assert history.memory() < 2 * first
+    assert history.checkout(0) == 1 and srem.get_sand(3) == 0
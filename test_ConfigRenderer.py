@@ -0,0 +1,109 @@
+import struct
+import threading
+import zlib
+
+import numpy as np
+import pytest
+
+from ConfigRenderer import (DEFAULT_BACKGROUND, DEFAULT_NEGATIVE, DEFAULT_PALETTE,
+                            ConfigRenderer, FrameWriter, encode_png, lattice_cells,
+                            png_sequence)
+from GridEngine import grid_graph
+
+
+def decode_png(data):
+    # Reads back what encode_png() writes: 8-bit RGB, one IDAT, no filters.
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    chunks = dict()
+    at = 8
+    while at < len(data):
+        length, = struct.unpack(">I", data[at:at + 4])
+        tag, body = data[at + 4:at + 8], data[at + 8:at + 8 + length]
+        assert struct.unpack(">I", data[at + 8 + length:at + 12 + length])[0] == \
+            zlib.crc32(tag + body) & 0xffffffff
+        chunks[tag] = body
+        at += 12 + length
+    width, height = struct.unpack(">II", chunks[b"IHDR"][:8])
+    raw = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8)
+    raw = raw.reshape(height, width * 3 + 1)
+    assert (raw[:, 0] == 0).all()
+    return raw[:, 1:].reshape(height, width, 3)
+
+
+def test_lattice():
+    positions, edges = grid_graph(3, 4)
+    renderer = ConfigRenderer(positions, cell=2)
+    assert renderer.is_lattice and renderer.grid_shape == (5, 6)
+    assert renderer.shape == (10, 12)
+    config = [0] * len(positions)
+    config[0], config[1], config[4] = 2, 100, -3
+    image = renderer.render(config)
+    assert image.shape == (10, 12, 3) and image.dtype == np.uint8
+    # Vertex 0 is the top left grid vertex, one cell in from the corner.
+    assert (image[2:4, 2:4] == DEFAULT_PALETTE[2]).all()
+    assert (image[2:4, 4:6] == DEFAULT_PALETTE[-1]).all()
+    assert (image[4:6, 2:4] == DEFAULT_NEGATIVE).all()
+    assert (image[0:2, 0:2] == DEFAULT_BACKGROUND).all()
+    assert ConfigRenderer(positions, size=120).shape == (100, 120)
+
+
+def test_scattered():
+    positions = np.random.default_rng(0).integers(0, 2000, (30, 2)).tolist()
+    renderer = ConfigRenderer(positions, size=256, radius=2)
+    assert not renderer.is_lattice and max(renderer.shape) == 256
+    image = renderer.render([1] * 30)
+    colors = {tuple(c) for c in image.reshape(-1, 3)}
+    assert colors == {tuple(DEFAULT_PALETTE[1]), tuple(DEFAULT_BACKGROUND)}
+    with pytest.raises(ValueError):
+        renderer.render([1] * 29)
+
+
+def test_lattice_cells_needs_density():
+    assert lattice_cells([[0.0, 0.0], [1e-7, 0.0], [10.0, 10.0]]) is None
+    assert lattice_cells([[0, 0], [1, 0], [0, 1], [1000, 1000]]) is None
+    assert lattice_cells([[0, 0], [0, 0]]) is None
+    rows, cols, shape = lattice_cells([[0, 0], [20, 0], [10, 10]])
+    assert shape == (2, 3) and rows.tolist() == [1, 1, 0] and cols.tolist() == [0, 2, 1]
+
+
+def test_encode_png_round_trip(tmp_path):
+    image = np.random.default_rng(1).integers(0, 256, (7, 5, 3)).astype(np.uint8)
+    assert (decode_png(encode_png(image)) == image).all()
+    png_sequence(str(tmp_path / "f%03d.png"))(4, image)
+    assert (decode_png((tmp_path / "f004.png").read_bytes()) == image).all()
+
+
+def test_frame_writer_drops_when_full():
+    positions, edges = grid_graph(2, 2)
+    renderer = ConfigRenderer(positions, cell=1)
+    release = threading.Event()
+    frames = []
+
+    def sink(number, image):
+        release.wait()
+        frames.append((number, image))
+
+    writer = FrameWriter(renderer, sink, max_queued=2)
+    results = [writer.capture([i] * len(positions)) for i in range(10)]
+    # The writer holds one frame and the queue two more, at most.
+    assert results[:2] == [True, True] and not all(results)
+    assert writer.dropped == results.count(False) and writer.captured == results.count(True)
+    release.set()
+    writer.close()
+    assert [n for n, image in frames] == list(range(writer.captured))
+    assert writer.written == writer.captured
+    assert (frames[1][1][1, 1] == DEFAULT_PALETTE[1]).all()
+
+
+def test_frame_writer_error():
+    positions, edges = grid_graph(2, 2)
+
+    def sink(number, image):
+        raise IOError("disk full")
+
+    writer = FrameWriter(ConfigRenderer(positions), sink)
+    writer.capture([0] * len(positions), block=True)
+    with pytest.raises(IOError):
+        writer.close()
+    with pytest.raises(IOError):
+        writer.capture([0] * len(positions))
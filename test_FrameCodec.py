@@ -0,0 +1,121 @@
+import io
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from FrameCodec import CODECS, HEADER, RAW, decode_frame, encode_frame, read_frame, read_raw_frame
+from SandpileRemote import SandpileRemote
+from SandpileServer import SandpileServer
+
+MESSAGES = [b"", b"done", b"x" * 5000, b",".join(b"%d" % (i % 9) for i in range(100000)),
+            os.urandom(3000)]
+
+
+@pytest.mark.parametrize("codec", [None] + sorted(CODECS))
+@pytest.mark.parametrize("threshold", [0, 1024])
+def test_round_trip(codec, threshold):
+    stream = io.BytesIO(b"".join(encode_frame(m, codec, threshold) for m in MESSAGES))
+    assert [read_frame(stream) for m in MESSAGES] == MESSAGES
+    assert read_frame(stream) is None
+
+
+def test_small_and_incompressible_messages_are_raw():
+    assert encode_frame(b"done", "zlib", 1024) == HEADER.pack(RAW, 4) + b"done"
+    noise = os.urandom(4096)
+    assert encode_frame(noise, "zlib", 0)[:1] == RAW
+    assert len(encode_frame(b"0," * 4096, "zlib", 0)) < 200
+
+
+def test_truncated_frame():
+    frame = encode_frame(b"0," * 4096, "zlib", 0)
+    assert read_raw_frame(io.BytesIO(frame[:-1])) is None
+    assert read_raw_frame(io.BytesIO(frame[:3])) is None
+
+
+def test_unknown_tag():
+    with pytest.raises(ValueError):
+        decode_frame(b"?", b"")
+
+
+@pytest.mark.parametrize("codec", sorted(CODECS))
+def test_compressed_connection(codec):
+    server = SandpileServer(port=0).start()
+    try:
+        srem = SandpileRemote()
+        srem.connect(port=server.port, compression=codec, compress_threshold=16)
+        assert srem.compression == codec
+        srem.auto_repaint = False
+        srem.add_vertices([[float(i), 0.0] for i in range(3000)])
+        config = [i % 5 for i in range(3000)]
+        srem.set_config(config)
+        assert srem.get_config() == config
+        srem.close()
+    finally:
+        server.stop()
+
+
+def test_refused_compression_stays_plain():
+    server = SandpileServer(port=0).start()
+    try:
+        srem = SandpileRemote()
+        srem.connect(port=server.port, compression="nonesuch")
+        assert srem.compression is None
+        assert srem.get_num_of_vertices() == 0
+        srem.close()
+    finally:
+        server.stop()
+
+
+def test_refused_compression_stays_uncompressed():
+    server = SandpileServer(port=0, compression=False).start()
+    try:
+        srem = SandpileRemote()
+        srem.connect(port=server.port, compression="zlib")
+        assert srem.compression is None
+        srem.add_vertices([[0.0, 0.0]])
+        assert srem.get_num_of_vertices() == 1
+        srem.close()
+    finally:
+        server.stop()
+
+
+def test_unanswered_compression_reconnects():
+    # A server that ignores commands it does not know and answers
+    # get_num_of_vertices, on any number of connections.
+    listener = socket.socket()
+    listener.bind(("localhost", 0))
+    listener.listen(2)
+    connections = []
+
+    def serve():
+        while True:
+            try:
+                conn, address = listener.accept()
+            except OSError:
+                return
+            connections.append(conn)
+            threading.Thread(target=answer, args=(conn,), daemon=True).start()
+
+    def answer(conn):
+        for line in conn.makefile("rb"):
+            if line.startswith(b"get_num_of_vertices"):
+                conn.sendall(b"7\n")
+
+    threading.Thread(target=serve, daemon=True).start()
+    try:
+        srem = SandpileRemote()
+        start = time.time()
+        srem.connect(port=listener.getsockname()[1], timeout=5.0, compression="zlib",
+                     negotiate_timeout=0.2)
+        assert 0.2 <= time.time() - start < 2.0
+        assert srem.compression is None
+        assert srem.get_num_of_vertices() == 7
+        assert len(connections) == 2
+        srem.close()
+    finally:
+        listener.close()
+        for conn in connections:
+            conn.close()
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from GraphGenerators import (erdos_renyi, grid, hexagonal, random_regular, torus,
+                             triangular)
+from GridEngine import grid_graph
+from SandpileRemote import SandpileRemote
+from SandpileServer import SandpileServer
+
+
+def check_graph(graph, degree):
+    # Every chunking gives the same graph, every vertex but the sinks has
+    # the given degree, and edges between non-sinks go both ways.
+    positions, edges = graph.to_lists()
+    assert len(positions) == graph.num_vertices
+    for chunk_size in (1, 7, graph.num_vertices):
+        assert np.concatenate(list(graph.positions(chunk_size))).tolist() == positions
+        chunks = [c for c in graph.edges(chunk_size) if len(c)]
+        assert np.concatenate(chunks).tolist() == edges
+    degrees = graph.engine().degrees
+    nonsinks = degrees > 0
+    assert (degrees[nonsinks] == degree).all()
+    inner = {(s, d) for s, d, w in edges if nonsinks[d]}
+    assert inner == {(d, s) for s, d in inner}
+    assert all(s != d for s, d in inner) and len(inner) == sum(nonsinks[d] for s, d, w in edges)
+    return degrees
+
+
+@pytest.mark.parametrize("rows, cols", [(1, 1), (3, 5), (6, 4)])
+def test_lattices(rows, cols):
+    degrees = check_graph(grid(rows, cols), 4)
+    assert np.count_nonzero(degrees) == rows * cols
+    positions, edges = grid_graph(rows, cols)
+    assert grid(rows, cols).num_vertices == len(positions)
+    inner = sorted(e for e in grid(rows, cols).to_lists()[1] if e[1] < rows * cols)
+    assert inner == sorted(e for e in edges if e[1] < rows * cols)
+    check_graph(triangular(rows, cols), 6)
+    check_graph(hexagonal(rows, cols), 3)
+
+
+def test_torus():
+    degrees = check_graph(torus(4, 5, attach=[]), 4)
+    assert degrees.tolist() == [4] * 20 + [0]
+    assert check_graph(torus(3, 3, attach="all"), 5)[-1] == 0
+
+
+@pytest.mark.parametrize("n, degree", [(8, 4), (6, 5), (5, 4), (2, 1), (4, 0),
+                                       (10, 3), (11, 6), (300, 3), (60, 20)])
+def test_random_regular(n, degree):
+    for seed in range(5):
+        graph = random_regular(n, degree, seed=seed, attach=[])
+        if degree:
+            check_graph(graph, degree)
+        assert graph.engine().degrees[:n].tolist() == [degree] * n
+    assert random_regular(n, degree, seed=3).to_lists() == \
+        random_regular(n, degree, seed=3).to_lists()
+    with pytest.raises(ValueError):
+        random_regular(n, n)
+
+
+def test_erdos_renyi():
+    graph = erdos_renyi(200, 0.05, seed=2, attach="all")
+    degrees = graph.engine().degrees
+    assert abs(degrees[:200].mean() - 1 - 0.05 * 199) < 1
+    check_graph(erdos_renyi(40, 1.0, attach=[]), 39)
+    assert not erdos_renyi(30, 0.0, attach=[]).engine().degrees.any()
+    # Dense and sparse draws take different branches.
+    for p in (0.2, 0.8):
+        positions, edges = erdos_renyi(50, p, seed=1).to_lists()
+        pairs = {(s, d) for s, d, w in edges if d < 50}
+        assert len(pairs) == len(edges) - 1 and all(s != d for s, d in pairs)
+
+
+def test_upload():
+    server = SandpileServer(port=0).start()
+    try:
+        srem = SandpileRemote()
+        srem.auto_repaint = False
+        srem.connect(port=server.port)
+        srem.add_vertices([[0.0, 0.0]])
+        graph = triangular(5, 6)
+        assert graph.upload(srem, chunk_size=4) == 1
+        positions, edges = graph.to_lists()
+        assert srem.get_num_of_vertices() == 1 + len(positions)
+        # The program merges the repeated edges to the sink.
+        merged = dict()
+        for s, d, w in edges:
+            merged[s + 1, d + 1] = merged.get((s + 1, d + 1), 0) + w
+        assert sorted(srem.get_edges()) == sorted([s, d, w] for (s, d), w in merged.items())
+        srem.close()
+    finally:
+        server.stop()
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from GridEngine import GridEngine, grid_graph
+from SandpileEngine import SandpileEngine
+
+
+@pytest.mark.parametrize("rows, cols", [(1, 1), (3, 5), (8, 8), (13, 6)])
+def test_grid_matches_sandpile_engine(rows, cols):
+    positions, edges = grid_graph(rows, cols)
+    grid = GridEngine.from_graph(positions, edges)
+    engine = SandpileEngine(len(positions), edges)
+    rng = np.random.default_rng(rows * cols)
+    for trial in range(3):
+        config = rng.integers(0, 12, len(positions))
+        assert grid.update(config).tolist() == engine.update(config).tolist()
+        stable, odometer = grid.stabilize(config)
+        expected, fired = engine.stabilize(config)
+        assert stable.tolist() == expected.tolist()
+        assert odometer.tolist() == fired.tolist()
+    assert grid.max_stable().tolist() == engine.max_stable().tolist()
+
+
+def test_grid_round_trip():
+    positions, edges = grid_graph(4, 3)
+    grid = GridEngine.from_graph(positions, edges)
+    config = np.arange(len(positions))
+    assert grid.from_grid(grid.to_grid(config)).tolist() == config.tolist()
+
+
+def test_single_pile_is_symmetric():
+    positions, edges = grid_graph(9, 9)
+    grid = GridEngine.from_graph(positions, edges)
+    config = np.zeros(len(positions), dtype=np.int64)
+    config[4 * 9 + 4] = 1000
+    stable = grid.to_grid(grid.stabilize(config)[0])
+    assert (stable == stable.T).all() and (stable == stable[::-1]).all()
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from GridEngine import grid_graph
+from ParallelEngine import ParallelEngine, partition
+from SandpileEngine import SandpileEngine
+from test_SandpileEngine import random_graph
+
+
+def check(num_vertices, edges, config, **kwargs):
+    engine = ParallelEngine(num_vertices, edges, **kwargs)
+    stable, odometer = engine.stabilize(config)
+    expected, fired = SandpileEngine(num_vertices, edges).stabilize(config)
+    assert stable.tolist() == expected.tolist()
+    assert odometer.tolist() == fired.tolist()
+    return engine
+
+
+@pytest.mark.parametrize("processes", [1, 2, 3])
+@pytest.mark.parametrize("rows, cols", [(1, 1), (6, 9), (20, 20)])
+def test_grid(rows, cols, processes):
+    positions, edges = grid_graph(rows, cols)
+    config = np.zeros(len(positions), dtype=np.int64)
+    config[(rows // 2) * cols + cols // 2] = 40 * rows * cols
+    config[0] += 7
+    check(len(positions), edges, config, processes=processes)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_random_graph(seed):
+    rng = np.random.default_rng(seed)
+    n = 40
+    edges = random_graph(rng, n, directed=bool(seed % 2))
+    config = rng.integers(0, 30, n + 1)
+    check(n + 1, edges, config, processes=3)
+
+
+def test_more_processes_than_vertices():
+    engine = check(3, [[0, 1, 1], [1, 2, 1]], [4, 3, 0], processes=8)
+    assert engine.processes == 2
+
+
+def test_empty_regions_are_skipped():
+    engine = check(4, [[0, 1, 1], [1, 0, 1], [1, 2, 1], [0, 3, 1]], [5, 5, 0, 0],
+                   regions=[4, 4, 7, 7])
+    assert engine.processes == 2 and engine.regions.tolist() == [0, 0, 1, 1]
+
+
+def test_empty_graph():
+    assert [a.tolist() for a in ParallelEngine(0, []).stabilize([])] == [[], []]
+
+
+def test_partition_sizes():
+    positions, edges = grid_graph(10, 10)
+    regions = partition(len(positions), edges, 4)
+    assert np.bincount(regions).tolist() == [35, 35, 35, 35]
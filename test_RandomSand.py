@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from RandomSand import RandomSand
+
+
+@pytest.mark.parametrize("amount", [0, 3, 50, 1000])
+def test_batch_totals(amount):
+    sand = RandomSand([2, 0, 3, 1, 0], seed=4)
+    configs = sand.batch(amount, 6, base=[1, 1, 1, 1, 1])
+    assert configs.shape == (6, 5) and configs.dtype == np.int64
+    assert (configs.sum(axis=1) == amount + 5).all()
+    assert (configs[:, [1, 4]] == 1).all()
+
+
+def test_amount_per_trial():
+    sand = RandomSand([1, 1, 1, 0], seed=0)
+    configs = sand.batch([0, 2, -5, 30], 4)
+    assert configs.sum(axis=1).tolist() == [0, 2, 0, 30]
+
+
+def test_seed_repeats():
+    a, b = RandomSand([1, 2, 0], seed=7), RandomSand([1, 2, 0], seed=7)
+    assert a.batch(10, 3).tolist() == b.batch(10, 3).tolist()
+    assert a.sample(1000).tolist() == b.sample(1000).tolist()
+
+
+def test_weights():
+    sand = RandomSand([1, 1, 1, 0], weights=[0, 1, 3, 100], seed=2)
+    assert sand.probabilities.tolist() == [0, 0.25, 0.75]
+    configs = sand.batch(2, 500)
+    assert (configs[:, [0, 3]] == 0).all()
+    # Both branches draw from the same distribution.
+    for config in (configs.sum(axis=0), sand.sample(10 ** 5)):
+        assert abs(config[2] / config.sum() - 0.75) < 0.02
+
+
+def test_bad_arguments():
+    with pytest.raises(ValueError):
+        RandomSand([0, 0])
+    with pytest.raises(ValueError):
+        RandomSand([1, 1], weights=[1])
+    with pytest.raises(ValueError):
+        RandomSand([1, 1], weights=[0, 0])
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from ResilientRemote import ResilientRemote
+from SandpileRemote import RemoteTimeout
+from SandpileServer import SandpileServer
+
+
+@pytest.fixture
+def server():
+    server = SandpileServer(port=0).start()
+    yield server
+    server.stop()
+
+
+def connect(server):
+    srem = ResilientRemote()
+    srem.backoff = 0.01
+    srem.auto_repaint = False
+    srem.connect(port=server.port)
+    # A path of three vertices whose ends have edges to a sink.
+    srem.add_vertices([[0.0, 0.0], [1.0, 0.0], [2.0, 0.0], [3.0, 0.0]])
+    srem.add_edges([[0, 1, 1], [1, 0, 1], [1, 2, 1], [2, 1, 1], [0, 3, 1], [2, 3, 1]])
+    return srem
+
+
+def test_reconnect_replays_journal(server):
+    srem = connect(server)
+    srem.set_config([1, 0, 1, 0])
+    srem.add_sand(1, 5)
+    server.drop_connections()
+    assert srem.get_config() == [1, 5, 1, 0]
+    assert srem.reconnects == 1
+    assert srem.get_num_of_vertices() == 4
+    srem.stabilize()
+    server.drop_connections()
+    assert srem.get_config() == srem.get_config()
+    assert srem.reconnects == 2
+    assert sum(srem.get_config()[:3]) <= 3
+
+
+def test_checkpoint_interval_shortens_journal(server):
+    srem = connect(server)
+    srem.checkpoint_interval = 3
+    for i in range(7):
+        srem.add_sand(i % 3, 1)
+    assert len([m for m in srem.journal if m.startswith("add_sand")]) <= 3
+    expected = srem.get_config()
+    server.drop_connections()
+    assert srem.get_config() == expected == [3, 2, 2, 0]
+
+
+def test_random_sand_is_checkpointed_at_once(server):
+    srem = connect(server)
+    srem.add_random_sand(50)
+    assert not any(m.startswith("add_random_sand") for m in srem.journal)
+    expected = srem.get_config()
+    server.drop_connections()
+    assert srem.get_config() == expected
+
+
+def test_timeout_then_next_command(server):
+    srem = connect(server)
+    srem.set_config([3, 3, 3, 0])
+    server.delay = 0.3
+    with pytest.raises(RemoteTimeout):
+        srem.stabilize(timeout=0.05)
+    # Let the abandoned stabilize finish on the server before the replay.
+    time.sleep(0.4)
+    server.delay = 0.0
+    assert srem.get_config() == [3, 3, 3, 0]
+    assert srem.reconnects == 1
+    srem.stabilize()
+    assert srem.get_num_unstables() == 0
@@ -0,0 +1,223 @@
+import numpy as np
+import pytest
+
+from SandpileEngine import SandpileEngine, UnreachableSinkError
+
+
+def random_graph(rng, n, directed=True):
+    # n non-sinks and one sink, vertex n. Every vertex has an edge to the
+    # next one or to the sink, so every vertex reaches the sink.
+    edges = []
+    for v in range(n):
+        edges.append([v, v + 1, int(rng.integers(1, 3))])
+        for u in rng.choice(n + 1, size=int(rng.integers(0, 4)), replace=True):
+            if u != v:
+                edges.append([v, int(u), int(rng.integers(1, 4))])
+    if not directed:
+        edges += [[u, v, w] for v, u, w in edges if u != n]
+    return edges
+
+
+def naive_weights(n, edges):
+    out = [dict() for v in range(n)]
+    for s, d, w in edges:
+        out[s][d] = out[s].get(d, 0) + w
+    return out
+
+
+def naive_update(out, config):
+    config = list(config)
+    degrees = [sum(o.values()) for o in out]
+    unstable = [v for v in range(len(out)) if degrees[v] and config[v] >= degrees[v]]
+    for v in unstable:
+        config[v] -= degrees[v]
+        for d, w in out[v].items():
+            config[d] += w
+    return config, unstable
+
+
+def naive_stabilize(out, config):
+    odometer = [0] * len(out)
+    while True:
+        config, unstable = naive_update(out, config)
+        if not unstable:
+            return config, odometer
+        for v in unstable:
+            odometer[v] += 1
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_against_naive_loop(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 30))
+    edges = random_graph(rng, n, directed=bool(seed % 2))
+    engine = SandpileEngine(n + 1, edges)
+    out = naive_weights(n + 1, edges)
+    for trial in range(5):
+        config = rng.integers(0, 3 * max(engine.degrees) + 1, n + 1).tolist()
+        assert engine.update(config).tolist() == naive_update(out, config)[0]
+        stable, odometer = engine.stabilize(config)
+        expected, fired = naive_stabilize(out, config)
+        assert stable.tolist() == expected
+        assert odometer.tolist() == fired
+    assert engine.sinks().tolist() == [n]
+    assert len(engine.unstables(engine.max_stable())) == 0
+
+
+def test_repeated_edges_are_merged():
+    engine = SandpileEngine(3, [[0, 1, 1], [0, 1, 2], [1, 2, 1], [1, 0, 1], [1, 0, -1]])
+    assert engine.degrees.tolist() == [3, 1, 0]
+    assert engine.stabilize([3, 0, 0])[0].tolist() == [0, 0, 3]
+
+
+def test_input_is_not_modified():
+    engine = SandpileEngine(3, [[0, 1, 1], [1, 0, 1], [1, 2, 1]])
+    config = np.array([3, 0, 0])
+    engine.stabilize(config)
+    assert config.tolist() == [3, 0, 0]
+
+
+def test_unreachable_sink():
+    engine = SandpileEngine(3, [[0, 1, 1], [1, 0, 1]])
+    with pytest.raises(UnreachableSinkError):
+        engine.stabilize([5, 0, 0], check_sinks=True)
+
+
+def test_edge_out_of_range():
+    with pytest.raises(ValueError):
+        SandpileEngine(2, [[0, 2, 1]])
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_estimate_gives_the_same_result(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(2, 25))
+    engine = SandpileEngine(n + 1, random_graph(rng, n, directed=bool(seed % 2)))
+    config = np.zeros(n + 1, dtype=np.int64)
+    config[rng.integers(0, n, 3)] = rng.integers(100, 5000, 3)
+    estimate = engine.estimate_odometer(config)
+    stable, odometer = engine.stabilize(config)
+    assert (estimate >= 0).all() and (estimate <= odometer).all()
+    fast, fast_odometer = engine.stabilize(config, estimate=True)
+    assert fast.tolist() == stable.tolist()
+    assert fast_odometer.tolist() == odometer.tolist()
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_stabilize_many_matches_stabilize(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 20))
+    engine = SandpileEngine(n + 1, random_graph(rng, n, directed=bool(seed % 2)))
+    configs = rng.integers(0, 4 * max(engine.degrees), (7, n + 1))
+    stable, firings = engine.stabilize_many(configs)
+    for config, s, f in zip(configs, stable, firings):
+        expected, odometer = engine.stabilize(config)
+        assert s.tolist() == expected.tolist() and f == odometer.sum()
+        assert engine.odometer(config, s).tolist() == odometer.tolist()
+
+
+def test_stabilize_many_fortran_order():
+    engine = SandpileEngine(3, [[0, 1, 1], [1, 0, 1], [1, 2, 1]])
+    configs = np.asfortranarray([[3, 0, 0], [0, 2, 0]])
+    stable, firings = engine.stabilize_many(configs)
+    assert stable.tolist() == [[0, 1, 2], [0, 1, 1]]
+    assert firings.tolist() == [7, 2]
+
+
+def test_empty_graph():
+    engine = SandpileEngine(0, [])
+    assert [a.tolist() for a in engine.stabilize([])] == [[], []]
+    stable, firings = engine.stabilize_many(np.zeros((3, 0), dtype=np.int64))
+    assert stable.shape == (3, 0) and firings.tolist() == [0, 0, 0]
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_identity_burning_and_dual(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 15))
+    engine = SandpileEngine(n + 1, random_graph(rng, n, directed=bool(seed % 2)))
+    nonsinks = engine.degrees > 0
+    script = engine.burning_script()
+    lap = engine.laplacian()
+    assert (script[nonsinks] >= 1).all() and (lap.dot(script)[nonsinks] >= 0).all()
+    # The least such vector: lowering any entry breaks it.
+    for v in np.flatnonzero(script > 1):
+        lower = script.copy()
+        lower[v] -= 1
+        assert (lap.dot(lower)[nonsinks] < 0).any()
+    burning = engine.burning()
+    identity = engine.identity()
+    assert engine.stabilize(2 * identity)[0][nonsinks].tolist() == identity[nonsinks].tolist()
+    for trial in range(5):
+        recurrent = engine.stabilize(engine.max_stable() + rng.integers(0, 3, n + 1))[0]
+        recurrent[~nonsinks] = 0
+        assert engine.stabilize(recurrent + identity)[0][nonsinks].tolist() == \
+            recurrent[nonsinks].tolist()
+        stable, odometer = engine.stabilize(recurrent + burning)
+        assert stable[nonsinks].tolist() == recurrent[nonsinks].tolist()
+        assert odometer.tolist() == script.tolist()
+    assert engine.dual().tolist() == (engine.max_stable() - burning).tolist()
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_firing_vector_against_laplacian(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 20))
+    engine = SandpileEngine(n + 1, random_graph(rng, n, directed=bool(seed % 2)))
+    config = rng.integers(0, 10, n + 1)
+    vector = rng.integers(-3, 4, n + 1) * (rng.random(n + 1) < 0.4)
+    expected = config - engine.laplacian().dot(vector)
+    assert engine.apply_firing_vector(config, vector).tolist() == expected.tolist()
+    vertices, changes = engine.firing_changes(vector)
+    assert (np.diff(vertices) > 0).all() and (changes != 0).all()
+    assert vertices.tolist() == np.flatnonzero(expected != config).tolist()
+    # Firing every unstable vertex as a set is an update.
+    assert engine.fire_vertices(config, engine.unstables(config)).tolist() == \
+        engine.update(config).tolist()
+
+
+def test_legal_set_firing():
+    engine = SandpileEngine(3, [[0, 1, 1], [1, 0, 1], [1, 2, 1]])
+    assert engine.fire_vertices([1, 2, 0], [0, 1, 1], legal=True).tolist() == [1, 1, 1]
+    with pytest.raises(ValueError):
+        engine.fire_vertices([0, 2, 0], [0], legal=True)
+    assert engine.fire_vertices([0, 2, 0], [0]).tolist() == [-1, 3, 0]
+    # Firing both is legal although vertex 0 alone is not.
+    assert engine.fire_vertices([0, 2, 0], [0, 1], legal=True).tolist() == [0, 1, 1]
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_burn_against_adding_burning(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 15))
+    engine = SandpileEngine(n + 1, random_graph(rng, n, directed=bool(seed % 2)))
+    nonsinks = engine.degrees > 0
+    # Stable configurations near the top, where about half are recurrent.
+    configs = engine.max_stable() - rng.integers(0, engine.degrees // 2 + 1, (40, n + 1))
+    configs = np.maximum(configs, 0) * nonsinks
+    burning = engine.burning()
+    expected = []
+    for config in configs:
+        stable = engine.stabilize(config + burning)[0]
+        expected.append(stable[nonsinks].tolist() == config[nonsinks].tolist())
+    assert engine.is_recurrent(configs).tolist() == expected
+    assert any(expected) and not all(expected)
+    assert engine.is_recurrent(configs[0]) == expected[0]
+    burnt = engine.burn(configs)
+    assert burnt.shape == configs.shape and burnt[:, ~nonsinks].all()
+    unstable = engine.max_stable() + 1
+    assert not engine.is_recurrent(unstable) and not engine.burn(unstable)[nonsinks].any()
+
+
+def test_odometer_is_exact_past_float_precision():
+    # A path of three vertices with both ends joined to the sink.
+    engine = SandpileEngine(4, [[0, 1, 1], [1, 0, 1], [1, 2, 1], [2, 1, 1], [2, 3, 1],
+                                [0, 3, 1]])
+    fired = np.array([2 ** 60 + 1, 2 ** 59 + 3, 2 ** 58 + 7, 0])
+    stable = np.array([0, 1, 0, 0])
+    config = engine.apply_firing_vector(stable, -fired)
+    assert engine.odometer(config, stable).tolist() == fired.tolist()
+    # The reduced Laplacian has determinant 4, and one grain less at an
+    # end is not a whole number of firings.
+    with pytest.raises(ValueError):
+        engine.odometer([1, 0, 0, 0], [0, 0, 0, 0])
@@ -0,0 +1,110 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from GridEngine import grid_graph
+from SandpileEngine import SandpileEngine
+import SandpileGroup as group_module
+from SandpileGroup import SandpileGroup, _PRIMES, _dot_mod, _rational_solve
+
+
+class EngineRemote:
+    # Stands in for a SandpileRemote whose graph is already known.
+    def __init__(self, engine):
+        self.engine = engine
+
+    def get_engine(self):
+        return self.engine
+
+
+def group_of(num_vertices, edges):
+    return SandpileGroup(EngineRemote(SandpileEngine(num_vertices, edges)))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rational_solve_is_exact(seed):
+    rng = np.random.default_rng(seed)
+    for trial in range(40):
+        n = int(rng.integers(1, 12))
+        matrix = rng.integers(-50, 50, (n, n))
+        if round(np.linalg.det(matrix)) == 0:
+            continue
+        b = rng.integers(-10 ** 6, 10 ** 6, n)
+        x = _rational_solve(matrix, b)
+        for i in range(n):
+            assert sum(Fraction(int(matrix[i, j])) * x[j] for j in range(n)) == b[i]
+
+
+def test_dot_mod_does_not_overflow():
+    # Sums of more than 2**13 products of residues near 2**25 overflow an
+    # int64 when taken directly.
+    p = _PRIMES[0]
+    rng = np.random.default_rng(0)
+    matrix = rng.integers(p - 1000, p, (3, 20000))
+    vector = rng.integers(p - 1000, p, 20000)
+    expected = [sum(int(a) * int(v) for a, v in zip(row, vector)) % p for row in matrix]
+    assert _dot_mod(matrix, vector, p).tolist() == expected
+
+
+def test_rational_solve_stops_at_the_bound(monkeypatch):
+    # Digits that are wrong never pass the exact check, and more of them
+    # cannot help.
+    monkeypatch.setattr(group_module, "_dot_mod", lambda matrix, vector, p: vector * 0 + 1)
+    with pytest.raises(ValueError, match="Hadamard bound"):
+        _rational_solve(np.array([[2, -1], [-1, 2]]), np.array([1, 0]))
+
+
+def test_group_laws_on_a_grid():
+    positions, edges = grid_graph(3, 3)
+    group = group_of(len(positions), edges)
+    e = group.identity()
+    assert group.is_recurrent(e)
+    rng = np.random.default_rng(1)
+    for trial in range(5):
+        a = group.add(e, (rng.integers(0, 4, len(positions)) * (group.engine.degrees > 0)).tolist())
+        b = group.add(e, (rng.integers(0, 4, len(positions)) * (group.engine.degrees > 0)).tolist())
+        assert group.is_recurrent(a)
+        assert group.add(a, e) == a
+        assert group.add(a, b) == group.add(b, a)
+        assert group.add(a, group.inverse(a)) == e
+        order = group.order(a)
+        assert group.power(a, order) == e
+        # No smaller power is the identity.
+        x, n = a, 1
+        while x != e:
+            x, n = group.add(x, a), n + 1
+        assert n == order
+
+
+def test_order_of_cycle_group():
+    # A path of n vertices with both ends joined to the sink has a cyclic
+    # sandpile group of order n + 1.
+    n = 6
+    edges = [[i, j, 1] for i in range(n) for j in (i - 1, i + 1) if 0 <= j < n]
+    edges += [[0, n, 1], [n - 1, n, 1]]
+    group = group_of(n + 1, edges)
+    assert group.identity() == [1] * n + [0]
+    a = [0] + [1] * (n - 1) + [0]
+    assert group.is_recurrent(a)
+    assert group.order(a) == n + 1
+
+
+def test_order_memo_is_bounded(monkeypatch):
+    n = 6
+    edges = [[i, j, 1] for i in range(n) for j in (i - 1, i + 1) if 0 <= j < n]
+    edges += [[0, n, 1], [n - 1, n, 1]]
+    group = SandpileGroup(EngineRemote(SandpileEngine(n + 1, edges)), cache_size=2)
+    solves = []
+    solve = group_module._rational_solve
+    monkeypatch.setattr(group_module, "_rational_solve",
+                        lambda matrix, b: solves.append(1) or solve(matrix, b))
+    units = [[int(i == j) for j in range(n + 1)] for i in range(n)]
+    for a in units:
+        assert group.order(a) == n + 1
+    assert len(solves) == n
+    # Only the last two orders are remembered.
+    group.order(units[-1])
+    assert len(solves) == n
+    group.order(units[0])
+    assert len(solves) == n + 1
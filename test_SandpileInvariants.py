@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from GridEngine import grid_graph
+from SandpileEngine import SandpileEngine
+from SandpileInvariants import SandpileInvariants
+from test_SandpileEngine import random_graph
+
+
+def smith_factors(matrix):
+    # The invariant factors other than 1 of a square integer matrix, by
+    # plain elimination with Python ints.
+    a = [list(row) for row in matrix]
+    n = len(a)
+    diagonal = []
+    for t in range(n):
+        entries = [(abs(a[i][j]), i, j) for i in range(t, n) for j in range(t, n) if a[i][j]]
+        if not entries:
+            diagonal.extend([0] * (n - t))
+            break
+        while True:
+            value, i, j = min(entries)
+            a[t], a[i] = a[i], a[t]
+            for row in a:
+                row[t], row[j] = row[j], row[t]
+            done = True
+            for i in range(t + 1, n):
+                q = a[i][t] // a[t][t]
+                a[i] = [x - q * y for x, y in zip(a[i], a[t])]
+                done = done and not a[i][t]
+            for j in range(t + 1, n):
+                q = a[t][j] // a[t][t]
+                for row in a:
+                    row[j] -= q * row[t]
+                done = done and not a[t][j]
+            if done:
+                bad = [i for i in range(t + 1, n)
+                       if any(a[i][j] % a[t][t] for j in range(t + 1, n))]
+                if not bad:
+                    break
+                a[t] = [x + y for x, y in zip(a[t], a[bad[0]])]
+            entries = [(abs(a[i][j]), i, j) for i in range(t, n) for j in range(t, n)
+                       if a[i][j] and (i == t or j == t)]
+        diagonal.append(abs(a[t][t]))
+    return [d for d in diagonal if d != 1]
+
+
+def reduced_laplacian(engine):
+    nonsinks = np.flatnonzero(engine.degrees > 0)
+    return engine.laplacian()[nonsinks][:, nonsinks].toarray().astype(int).tolist()
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_against_plain_smith_form(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 14))
+    engine = SandpileEngine(n + 1, random_graph(rng, n, directed=bool(seed % 2)))
+    invariants = SandpileInvariants(engine)
+    factors = smith_factors(reduced_laplacian(engine))
+    assert invariants.factors == factors
+    order = 1
+    for f in factors:
+        order *= f
+    assert invariants.order == order
+    assert invariants.rank == len(factors)
+
+
+def test_grid():
+    positions, edges = grid_graph(3, 3)
+    invariants = SandpileInvariants.from_graph(len(positions), edges)
+    assert invariants.factors == [4, 112, 224]
+    assert invariants.order == 4 * 112 * 224 and invariants.exponent == 224
+
+
+def test_larger_grid_against_plain_smith_form():
+    positions, edges = grid_graph(7, 6)
+    engine = SandpileEngine(len(positions), edges)
+    assert SandpileInvariants(engine).factors == smith_factors(reduced_laplacian(engine))
+
+
+def test_degrees_are_part_of_the_hash():
+    # A path of 3 with both ends joined to the sink, and the same edges
+    # with the middle vertex losing an extra grain to the sink, as in a
+    # quotient engine.
+    engine = SandpileEngine(4, [[0, 1, 1], [1, 0, 1], [1, 2, 1], [2, 1, 1],
+                                [0, 3, 1], [2, 3, 1]])
+    heavier = SandpileEngine.from_csr(engine.indptr, engine.indices, engine.weights,
+                                      degrees=engine.degrees + [0, 1, 0, 0])
+    first, second = SandpileInvariants(engine), SandpileInvariants(heavier)
+    assert first.hash != second.hash
+    assert first.factors == smith_factors(reduced_laplacian(engine))
+    assert second.factors == smith_factors(reduced_laplacian(heavier))
+    assert first.order == 4 and second.order == 8
@@ -0,0 +1,164 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from GridEngine import grid_graph
+from SandpileRemote import (RemoteTimeout, SandpileRemote, StabilizeCancelled,
+                            StabilizeTimeout, UnreachableSinkError)
+from SandpileServer import SandpileServer
+
+
+@pytest.fixture
+def server():
+    server = SandpileServer(port=0).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def srem(server):
+    srem = SandpileRemote()
+    srem.auto_repaint = False
+    srem.connect(port=server.port)
+    positions, edges = grid_graph(4, 5)
+    srem.add_vertices(positions)
+    srem.add_edges(edges)
+    yield srem
+    srem.close()
+
+
+def pile(srem, grains=300):
+    config = [0] * srem.get_num_of_vertices()
+    config[7] = grains
+    srem.set_config(config)
+    return config
+
+
+def update_rounds(srem, config):
+    # The rounds and firings of stabilizing by updates, counted locally.
+    engine = srem.get_engine()
+    config = np.array(config)
+    rounds = firings = 0
+    while len(engine.unstables(config)):
+        firings += len(engine.unstables(config))
+        config = engine.update(config)
+        rounds += 1
+    return rounds, firings
+
+
+def test_firing(srem):
+    engine = srem.get_engine()
+    config = [3] * 20 + [0] * 18
+    srem.set_config(config)
+    vector = [0] * 38
+    vector[6], vector[7] = 2, -1
+    assert srem.apply_firing_vector(vector) == len(engine.firing_changes(vector)[0]) == 8
+    config = engine.apply_firing_vector(config, vector).tolist()
+    assert srem.get_config() == config
+    srem.fire_vertices([0, 1, 1], legal=True)
+    assert srem.get_config() == engine.fire_vertices(config, [0, 1]).tolist()
+    before = srem.get_config()
+    with pytest.raises(ValueError):
+        srem.fire_vertices([1], legal=True)
+    assert srem.get_config() == before
+    assert srem.apply_firing_vector([0] * 38) == 0
+
+
+def test_is_recurrent(srem):
+    engine = srem.get_engine()
+    srem.set_config(engine.max_stable().tolist())
+    assert srem.is_recurrent()
+    assert srem.is_recurrent([[0] * 38, engine.identity().tolist()]) == [False, True]
+
+
+def test_stabilize_by_updates(srem):
+    config = pile(srem)
+    rounds, firings = update_rounds(srem, config)
+    progress = dict()
+    stats = srem.stabilize_by_updates(timeout=30.0, progress=progress)
+    assert stats is progress
+    assert (stats["rounds"], stats["firings"], stats["unstables"]) == (rounds, firings, 0)
+    stable = srem.get_engine().stabilize(config)[0]
+    assert srem.get_config() == stable.tolist()
+
+
+def test_stabilize_by_updates_deadline(server, srem):
+    pile(srem)
+    server.delay = 0.01
+    with pytest.raises(StabilizeTimeout) as raised:
+        srem.stabilize_by_updates(timeout=0.2)
+    stats = raised.value.stats
+    assert stats["rounds"] > 0 and stats["firings"] >= stats["rounds"]
+    assert stats["unstables"] > 0 and stats["seconds"] >= 0.15
+
+
+def test_stabilize_by_updates_cancel(srem):
+    pile(srem)
+    cancel = threading.Event()
+    progress = dict()
+
+    def cancel_after_rounds():
+        # Cancels from another thread once a few updates are done.
+        while progress.get("rounds", 0) < 3:
+            time.sleep(0.001)
+        cancel.set()
+
+    watcher = threading.Thread(target=cancel_after_rounds)
+    watcher.start()
+    with pytest.raises(StabilizeCancelled) as raised:
+        srem.stabilize_by_updates(cancel=cancel, progress=progress)
+    watcher.join()
+    assert raised.value.stats is progress and progress["rounds"] >= 3
+    assert progress["unstables"] > 0
+    # The connection is still usable, with the partly relaxed pile.
+    assert srem.get_num_unstables() == progress["unstables"]
+
+
+def test_plain_stabilize_timeout(server, srem):
+    pile(srem)
+    server.delay = 0.5
+    with pytest.raises(StabilizeTimeout) as raised:
+        srem.stabilize(timeout=0.1)
+    stats = raised.value.stats
+    assert sorted(stats) == ["firings", "rounds", "seconds", "unstables"]
+    assert stats["rounds"] is None and stats["seconds"] >= 0.1
+
+
+def test_unreachable_sink(server):
+    srem = SandpileRemote()
+    srem.auto_repaint = False
+    srem.connect(port=server.port)
+    srem.add_vertices([[0.0, 0.0], [5.0, 5.0], [10.0, 0.0], [15.0, 0.0]])
+    srem.add_edges([[0, 1, 1], [1, 0, 1], [2, 1, 1], [3, 2, 1], [3, 0, 1]])
+    with pytest.raises(UnreachableSinkError) as raised:
+        srem.check_sinks_reachable()
+    assert raised.value.vertices == [0, 1, 2, 3]
+    srem.set_sand(0, 5)
+    # Raised before the program is asked, which would never answer.
+    with pytest.raises(UnreachableSinkError):
+        srem.stabilize(check_sinks=True)
+    srem.add_vertices([[20.0, 0.0]])
+    srem.add_edges([[1, 4, 1]])
+    srem.check_sinks_reachable()
+    srem.stabilize(timeout=5.0, check_sinks=True)
+    assert srem.get_num_unstables() == 0
+    srem.close()
+
+
+def test_async(server, srem):
+    config = pile(srem)
+    task = srem.stabilize_async(timeout=30.0)
+    stats = task.wait(30.0)
+    assert task.done() and stats["unstables"] == 0
+    assert (stats["rounds"], stats["firings"]) == update_rounds(srem, config)
+    pile(srem)
+    server.delay = 0.01
+    task = srem.stabilize_async()
+    with pytest.raises(RemoteTimeout):
+        task.wait(0.05)
+    task.cancel()
+    with pytest.raises(StabilizeCancelled):
+        task.wait(5.0)
+    assert task.done() and 0 < task.progress()["unstables"]
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+
+from SandpileServer import SandpileServer
+from SweepRunner import SweepRunner, load_results, parameter_grid, trial_key
+
+
+def square(params):
+    if params["x"] == 3:
+        return {3}
+    return params["x"] ** 2
+
+
+def slow_count(srem, params):
+    srem.get_num_of_vertices()
+    time.sleep(0.2)
+    return srem.get_num_of_vertices() + params["x"]
+
+
+def test_parameter_grid_order():
+    assert parameter_grid(size=[10, 20], seed=[0, 1]) == [
+        {"seed": 0, "size": 10}, {"seed": 0, "size": 20},
+        {"seed": 1, "size": 10}, {"seed": 1, "size": 20}]
+
+
+def test_unserializable_result_is_a_trial_error(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    runner = SweepRunner(square, parameter_grid(x=range(5)), path, max_workers=2)
+    assert runner.run() == 4
+    records = load_results(path, errors=True)
+    assert len(records) == 5
+    errors = [r for r in records if "error" in r]
+    assert [r["params"] for r in errors] == [{"x": 3}]
+    assert sorted(r["result"] for r in records if "result" in r) == [0, 1, 4, 16]
+    assert runner.pending() == [{"x": 3}]
+
+
+def test_resume_drops_half_written_line(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    grid = parameter_grid(x=[0, 1, 2])
+    with open(path, "w") as f:
+        f.write('{"params": {"x": 0}, "result": 0, "seconds": 0}\n')
+        f.write('{"params": {"x": 1}, "res')
+    runner = SweepRunner(square, grid, path, max_workers=1)
+    assert [trial_key(p) for p in runner.pending()] == [trial_key(p) for p in grid[1:]]
+    assert runner.run() == 2
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 3 and all(line.endswith("}") for line in lines)
+
+
+def test_worker_reconnects_after_drop(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    server = SandpileServer(port=0).start()
+
+    def drop_after_first():
+        # Drop the worker's connection once a trial has finished, so it
+        # dies in the middle of the sweep.
+        while not (os.path.exists(path) and load_results(path, errors=True)):
+            time.sleep(0.01)
+        server.drop_connections()
+
+    dropper = threading.Thread(target=drop_after_first)
+    dropper.start()
+    try:
+        runner = SweepRunner(slow_count, parameter_grid(x=range(6)), path,
+                             endpoints=[("localhost", server.port)])
+        assert runner.run() == 5
+        dropper.join()
+        records = load_results(path, errors=True)
+        assert len([r for r in records if "error" in r]) == 1
+        assert runner.run() == 1 and runner.pending() == []
+        assert sorted(r["result"] for r in load_results(path)) == list(range(6))
+    finally:
+        server.stop()
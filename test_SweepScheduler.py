@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from SandpileServer import SandpileServer
+from SweepRunner import load_results, parameter_grid
+from SweepScheduler import SweepScheduler
+
+
+@pytest.fixture
+def servers():
+    started = [SandpileServer(port=0).start(), SandpileServer(port=0).start()]
+    yield started
+    for server in started:
+        server.stop()
+
+
+def path_trial(srem, params):
+    # Relaxes sand on a path whose ends have edges to a sink. The servers
+    # share nothing, so each trial rebuilds its graph.
+    n = params["n"]
+    srem.delete_graph()
+    srem.add_vertices([[float(i), 0.0] for i in range(n + 1)])
+    edges = []
+    for i in range(n):
+        for j in (i - 1, i + 1):
+            edges.append([i, j if 0 <= j < n else n, 1])
+    srem.add_edges(edges)
+    srem.set_sand(0, params["sand"])
+    srem.stabilize(timeout=params.get("timeout"))
+    return srem.get_config()
+
+
+def stabilize_trial(srem, params):
+    srem.stabilize(timeout=params["timeout"])
+
+
+def test_two_servers(servers, tmp_path):
+    path = str(tmp_path / "sweep.jsonl")
+    grid = parameter_grid(n=[3, 4, 5], sand=[0, 7, 20])
+    scheduler = SweepScheduler(path_trial, grid, [("localhost", s.port) for s in servers],
+                               path=path, backoff=0.01)
+    assert scheduler.run() == 9
+    records = load_results(path)
+    assert len(records) == 9
+    for record in records:
+        config = record["result"]
+        assert sum(config[:-1]) <= 2 * len(config[:-1])
+    assert sum(node["completed"] for node in scheduler.report()) == 9
+    # Nothing left to do on a rerun.
+    assert SweepScheduler(path_trial, grid, [("localhost", servers[0].port)], path=path).run() == 0
+
+
+def test_dropped_connection_is_requeued(servers):
+    dropped = threading.Event()
+
+    def trial(srem, params):
+        if not dropped.is_set():
+            dropped.set()
+            # Once the server has answered, it holds the connection.
+            srem.get_num_of_vertices()
+            for server in servers:
+                server.drop_connections()
+        return path_trial(srem, params)
+
+    grid = parameter_grid(n=[3, 4], sand=[5, 9])
+    scheduler = SweepScheduler(trial, grid, [("localhost", s.port) for s in servers],
+                               backoff=0.01)
+    assert scheduler.run() == 4
+    assert not scheduler.errors and not scheduler.pending()
+    assert sum(node["failures"] for node in scheduler.report()) >= 1
+
+
+def test_timeout_is_requeued_and_reconnects():
+    slow = SandpileServer(port=0, delay=0.3).start()
+    try:
+        grid = parameter_grid(n=[3, 4], sand=[6], timeout=[0.1])
+        scheduler = SweepScheduler(stabilize_trial, grid, [("localhost", slow.port)],
+                                   max_failures=2, backoff=0.01)
+        assert scheduler.run() == 0
+        # Each timeout requeued the trial and the endpoint reconnected,
+        # until it was retired.
+        assert not scheduler.errors and len(scheduler.pending()) == 2
+        report = scheduler.report()[0]
+        assert report["failures"] == 2 and not report["alive"]
+    finally:
+        slow.stop()
+
+
+def test_straggler_is_stopped(servers):
+    slow = SandpileServer(port=0, delay=0.5).start()
+    try:
+        grid = parameter_grid(n=[3, 4, 5], sand=[6, 8])
+        endpoints = [("localhost", slow.port), ("localhost", servers[0].port)]
+        scheduler = SweepScheduler(path_trial, grid, endpoints, backoff=0.01)
+        start = time.time()
+        assert scheduler.run() == 6
+        # The slow endpoint needs seconds for a single trial.
+        assert time.time() - start < 1.0
+        assert not scheduler.errors
+        slow_node, fast_node = scheduler.report()
+        assert fast_node["completed"] == 6 and slow_node["completed"] == 0
+        assert slow_node["duplicates"] == 1 and slow_node["failures"] == 0
+        assert slow_node["busy_seconds"] == 0 and slow_node["alive"]
+    finally:
+        slow.stop()
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from AvalancheStats import AvalancheStats
+from GridEngine import grid_graph
+from SymmetricEngine import SymmetricEngine, check_automorphism
+from SandpileEngine import SandpileEngine
+
+
+def symmetrize(engine, config):
+    # The sum of a configuration's images under the group generated by the
+    # automorphisms, which every one of them leaves unchanged.
+    images = {tuple(config)}
+    while True:
+        new = {tuple(np.asarray(c)[p]) for c in images for p in engine.automorphisms} | images
+        if new == images:
+            return np.sum([list(c) for c in images], axis=0)
+        images = new
+
+
+@pytest.mark.parametrize("rows, cols, count", [(5, 5, 7), (6, 6, 7), (4, 7, 3), (1, 1, 7)])
+def test_grid_matches_whole_graph(rows, cols, count):
+    positions, edges = grid_graph(rows, cols)
+    symmetric = SymmetricEngine.from_graph(positions, edges)
+    assert len(symmetric.automorphisms) == count
+    engine = symmetric.engine
+    rng = np.random.default_rng(rows * cols)
+    nonsinks = engine.degrees > 0
+    for trial in range(4):
+        config = symmetrize(symmetric, rng.integers(0, 6, len(positions)) * nonsinks)
+        one, whole = AvalancheStats(), AvalancheStats()
+        stable, odometer = symmetric.stabilize(config, stats=one)
+        expected, fired = engine.stabilize(config, stats=whole)
+        assert stable.tolist() == expected.tolist()
+        assert odometer.tolist() == fired.tolist()
+        for name in ("size", "area", "duration"):
+            for key in ("mean", "max"):
+                assert one.summary()[name][key] == whole.summary()[name][key]
+    if rows > 1:
+        assert symmetric.quotient(config).num_vertices < engine.num_vertices
+
+
+def test_falls_back_without_symmetry():
+    positions, edges = grid_graph(4, 4)
+    symmetric = SymmetricEngine.from_graph(positions, edges)
+    config = np.zeros(len(positions), dtype=np.int64)
+    config[1] = 9
+    assert symmetric.representatives(config).tolist() == list(range(len(positions)))
+    assert symmetric.stabilize(config)[1].tolist() == symmetric.engine.stabilize(config)[1].tolist()
+
+
+def test_not_an_automorphism():
+    engine = SandpileEngine(3, [[0, 1, 1], [2, 1, 2], [1, 0, 1], [1, 2, 1]])
+    assert not check_automorphism(engine, [2, 1, 0])
+    assert not check_automorphism(engine, [0, 0, 1])
+    with pytest.raises(ValueError):
+        SymmetricEngine(engine, [[2, 1, 0]])
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from SandpileServer import SandpileServer
+from ThreadedRemote import ThreadedRemote
+
+
+@pytest.fixture
+def server():
+    server = SandpileServer(port=0).start()
+    yield server
+    server.stop()
+
+
+def build(srem, n):
+    srem.auto_repaint = False
+    srem.delete_graph()
+    srem.add_vertices([[float(i), 0.0] for i in range(n + 1)])
+    srem.add_edges([[i, n, 1] for i in range(n)])
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_threads_share_connection(server, compression):
+    srem = ThreadedRemote()
+    srem.connect(port=server.port, compression=compression, compress_threshold=64)
+    assert srem.compression == compression
+    n = 20000
+    build(srem, n)
+    srem.set_config([i % 7 for i in range(n)] + [0])
+    expected = srem.get_config()
+    failures = []
+
+    def reader():
+        for i in range(5):
+            if srem.get_config() != expected or srem.get_num_of_vertices() != n + 1:
+                failures.append(i)
+
+    threads = [threading.Thread(target=reader) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not failures
+    assert srem.pipeline(["get_sand 3", "get_sand 4", "get_num_of_vertices"]) == \
+        ["3\n", "4\n", "%d\n" % (n + 1)]
+    srem.close()
+
+
+def test_close_before_connect():
+    srem = ThreadedRemote()
+    srem.close()
+
+
+def test_reconnect_forgets_pending(server):
+    srem = ThreadedRemote()
+    srem.connect(port=server.port)
+    build(srem, 3)
+    srem.send("get_num_of_vertices")
+    srem.connect(port=server.port)
+    with pytest.raises(ValueError):
+        srem.receive()
+    assert srem.get_num_of_vertices() == 4
+    srem.close()
@@ -0,0 +1,92 @@
+import pytest
+
+from TrajectoryRecorder import TrajectoryReader, TrajectoryRecorder
+from VertexOrder import VertexOrder
+
+
+class FakeRemote:
+    # Moves one grain along a path each update.
+    def __init__(self, config):
+        self.config = list(config)
+
+    def get_config(self):
+        return list(self.config)
+
+    def update(self):
+        i = self.config.index(max(self.config))
+        self.config[i] -= 1
+        self.config[(i + 1) % len(self.config)] += 1
+
+    def get_num_unstables(self):
+        return 1
+
+
+def record(path, steps, order=None, keyframe_interval=4):
+    remote = FakeRemote([5, 0, 2, 0, 7])
+    rec = TrajectoryRecorder(remote, path, keyframe_interval=keyframe_interval, order=order)
+    expected = [remote.get_config()]
+    rec.record()
+    for i in range(steps):
+        rec.update()
+        expected.append(remote.get_config())
+    rec.close()
+    return expected
+
+
+@pytest.mark.parametrize("order", [None, VertexOrder([4, 2, 0, 3, 1])])
+def test_round_trip(tmp_path, order):
+    path = str(tmp_path / "run.traj")
+    expected = record(path, 10, order)
+    reader = TrajectoryReader(path)
+    assert len(reader) == len(expected)
+    assert [reader.config_at(s) for s in range(len(reader))] == expected
+    assert reader.config_at(3) == expected[3]
+    vertices, diffs = reader.changes_at(1)
+    assert sorted(vertices) == [0, 4] and sorted(diffs) == [-1, 1]
+    reader.close()
+
+
+def test_append_continues_steps(tmp_path):
+    path = str(tmp_path / "run.traj")
+    record(path, 5)
+    remote = FakeRemote([1, 1, 1, 1, 1])
+    rec = TrajectoryRecorder(remote, path, keyframe_interval=4)
+    assert rec.num_steps == 6
+    rec.record()
+    rec.close()
+    reader = TrajectoryReader(path)
+    assert len(reader) == 7 and reader.config_at(-1) == [1, 1, 1, 1, 1]
+
+
+def test_truncated_record_is_ignored(tmp_path):
+    path = str(tmp_path / "run.traj")
+    expected = record(path, 5)
+    with open(path, "r+b") as f:
+        f.seek(0, 2)
+        f.truncate(f.tell() - 3)
+    reader = TrajectoryReader(path)
+    assert [reader.config_at(s) for s in range(len(reader))] == expected[:-1]
+
+
+def test_empty_ordered_log_reopens_unordered(tmp_path):
+    path = str(tmp_path / "run.traj")
+    TrajectoryRecorder(FakeRemote([0, 0, 0, 0, 0]), path,
+                       order=VertexOrder([4, 3, 2, 1, 0])).close()
+    rec = TrajectoryRecorder(FakeRemote([1, 2, 3, 4, 5]), path)
+    rec.record()
+    rec.close()
+    assert TrajectoryReader(path).config_at(0) == [1, 2, 3, 4, 5]
+
+
+def test_nonempty_log_in_other_order_is_refused(tmp_path):
+    path = str(tmp_path / "run.traj")
+    record(path, 2, VertexOrder([4, 3, 2, 1, 0]))
+    with pytest.raises(ValueError):
+        TrajectoryRecorder(FakeRemote([0] * 5), path)
+
+
+def test_pile_beyond_int64(tmp_path):
+    rec = TrajectoryRecorder(FakeRemote([0]), str(tmp_path / "run.traj"))
+    with pytest.raises(ValueError):
+        rec.record([2 ** 63])
+    rec.close()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from GridEngine import grid_graph
+from SandpileEngine import SandpileEngine
+from VertexOrder import ReorderedEngine, VertexOrder, hilbert_order
+
+
+def mean_span(order, edges):
+    edges = order.edges(edges)
+    return np.abs(edges[:, 0] - edges[:, 1]).mean()
+
+
+def test_hilbert_visits_neighbours_in_turn():
+    positions = [[x, y] for x in range(8) for y in range(8)]
+    pos = np.array(positions)[hilbert_order(positions)]
+    assert (np.abs(np.diff(pos, axis=0)).sum(axis=1) == 1).all()
+    assert hilbert_order([]).tolist() == []
+
+
+@pytest.mark.parametrize("method", ["rcm", "hilbert"])
+def test_orders_bring_neighbours_together(method):
+    positions, edges = grid_graph(30, 30)
+    shuffle = VertexOrder(np.random.default_rng(0).permutation(len(positions)))
+    positions = np.array(positions)[shuffle.order].tolist()
+    edges = shuffle.edges(edges).tolist()
+    order = VertexOrder.from_graph(positions, edges, method)
+    assert sorted(order.order.tolist()) == list(range(len(positions)))
+    assert mean_span(order, edges) < mean_span(VertexOrder(np.arange(len(positions))), edges) / 10
+    if method == "rcm":
+        assert order.bandwidth(edges) <= 2 * 30
+
+
+def test_round_trip():
+    order = VertexOrder([2, 0, 3, 1])
+    config = np.array([[5, 6, 7, 8], [1, 2, 3, 4]])
+    assert order.to_local(config[0]).tolist() == [7, 5, 8, 6]
+    assert order.to_original(order.to_local(config)).tolist() == config.tolist()
+    with pytest.raises(ValueError):
+        VertexOrder([0, 0, 1])
+    with pytest.raises(ValueError):
+        VertexOrder.from_graph([], [], "spiral")
+
+
+def test_reordered_engine_matches():
+    positions, edges = grid_graph(9, 7)
+    positions = np.array(positions)[::-1].tolist()
+    n = len(positions)
+    edges = [[n - 1 - s, n - 1 - d, w] for s, d, w in edges]
+    engine = SandpileEngine(n, edges)
+    reordered = ReorderedEngine(n, edges, VertexOrder.from_graph(positions, edges, "hilbert"))
+    assert reordered.degrees.tolist() == engine.degrees.tolist()
+    assert reordered.max_stable().tolist() == engine.max_stable().tolist()
+    configs = np.random.default_rng(3).integers(0, 9, (5, n))
+    for config in configs:
+        assert reordered.unstables(config).tolist() == engine.unstables(config).tolist()
+        assert reordered.update(config).tolist() == engine.update(config).tolist()
+        assert [a.tolist() for a in reordered.stabilize(config)] == \
+            [a.tolist() for a in engine.stabilize(config)]
+    assert [a.tolist() for a in reordered.stabilize_many(configs)] == \
+        [a.tolist() for a in engine.stabilize_many(configs)]
+    with pytest.raises(ValueError):
+        reordered.stabilize([1, 2])